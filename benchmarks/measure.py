@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+'''
+Offline benchmark of the measurement pipeline (dataset → transformations → model → measure).
+
+Times the evaluation of a measure for each model family on synthetic MNIST and CIFAR10 shaped data,
+for several batch sizes and thread counts, stores the timings as json and compares them with a saved baseline.
+
+    python -m benchmarks.measure -save_baseline      # record a baseline
+    python -m benchmarks.measure                     # compare with the baseline, exit code 1 if there are regressions
+
+Baselines depend on the machine, so none is committed: if the baseline file doesn't exist, the run records it
+(as with -save_baseline) instead of comparing.
+'''
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from pathlib import Path
+
+import texttable
+import torch
+import tmeasures as tm
+from tmeasures.pytorch.transformations.affine import RotationGenerator
+from tmeasures.transformations.parameters import UniformRotation
+
+import datasets
+from experiments.tasks import Task
+from experiments.models import SimpleConvConfig, AllConvolutionalConfig, VGG16DConfig, ResNetConfig
+from pytorch.numpy_dataset import NumpyDataset
+
+default_folderpath = Path(__file__).parent
+default_baseline_path = default_folderpath / "baseline.json"
+default_results_path = default_folderpath / "results" / "latest.json"
+
+model_configs = {c.__name__[:-len("Config")]: c for c in
+                 [SimpleConvConfig, AllConvolutionalConfig, VGG16DConfig, ResNetConfig]}
+default_datasets = ["mnist", "cifar10"]
+
+
+class BenchmarkConfig:
+    def __init__(self, model: str, dataset: str, batch_size: int, threads: int, samples: int, transformations: int):
+        self.model = model
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.threads = threads
+        self.samples = samples
+        self.transformations = transformations
+
+    def id(self):
+        return f"{self.model}_{self.dataset}_b{self.batch_size}_t{self.threads}_s{self.samples}_m{self.transformations}"
+
+    def __repr__(self):
+        return f"Benchmark({self.model},{self.dataset},batch_size={self.batch_size},threads={self.threads},samples={self.samples},transformations={self.transformations})"
+
+
+def synthetic_dataset(template: str, samples: int) -> datasets.ClassificationDataset:
+    name = f"synthetic_{template}_benchmark{samples}"
+    datasets.register_synthetic(name, template, n_train=samples, n_test=samples)
+    dataset = datasets.get_classification(name)
+    dataset.normalize_features()
+    return dataset
+
+
+def run_benchmark(c: BenchmarkConfig, repeats: int, measure: tm.pytorch.PyTorchMeasure) -> dict:
+    torch.set_num_threads(c.threads)
+    torch.manual_seed(0)
+    synthetic = synthetic_dataset(c.dataset, c.samples)
+    mc = model_configs[c.model].for_dataset(Task.Classification, c.dataset)
+    model = mc.make(synthetic.input_shape, synthetic.num_classes)
+    model.eval()
+    dataset = NumpyDataset(synthetic.x_test)
+    transformations = RotationGenerator(UniformRotation(c.transformations, 1.0))
+    o = tm.pytorch.PyTorchMeasureOptions(batch_size=c.batch_size, num_workers=0, verbose=False)
+
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        measure.eval(dataset, transformations, model, o)
+        times.append(time.perf_counter() - start)
+    seconds = min(times)
+    return {"id": c.id(),
+            "model": c.model,
+            "dataset": c.dataset,
+            "batch_size": c.batch_size,
+            "threads": c.threads,
+            "samples": c.samples,
+            "transformations": len(transformations),
+            "seconds": seconds,
+            "samples_per_second": c.samples / seconds,
+            "transformations_per_second": c.samples * len(transformations) / seconds,
+            }
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[dict]:
+    '''
+    :return: results slower than their baseline by more than `tolerance` (relative)
+    '''
+    baseline = {r["id"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        if r["id"] not in baseline:
+            continue
+        b = baseline[r["id"]]
+        r["baseline_seconds"] = b["seconds"]
+        r["change"] = r["seconds"] / b["seconds"] - 1
+        if r["change"] > tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def print_results(results: list[dict], tolerance: float):
+    table = texttable.Texttable(max_width=160)
+    table.header(["model", "dataset", "batch", "threads", "seconds", "samples/s", "transformations/s", "vs baseline"])
+    for r in results:
+        if "change" in r:
+            change = f"{r['change'] * 100:+.1f}%"
+            if r["change"] > tolerance:
+                change += " REGRESSION"
+        else:
+            change = "-"
+        table.add_row([r["model"], r["dataset"], r["batch_size"], r["threads"], f"{r['seconds']:.3f}",
+                       f"{r['samples_per_second']:.1f}", f"{r['transformations_per_second']:.1f}", change])
+    print(table.draw())
+
+
+def save(path: Path, results: list[dict]):
+    path.parent.mkdir(exist_ok=True, parents=True)
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+
+def load(path: Path) -> list[dict]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the measurement pipeline on synthetic data.")
+    parser.add_argument('-models', nargs="+", default=list(model_configs.keys()), choices=list(model_configs.keys()))
+    parser.add_argument('-datasets', nargs="+", default=default_datasets, choices=list(datasets.synthetic.templates.keys()),
+                        help="Real datasets whose shape and classes are imitated with synthetic data")
+    parser.add_argument('-batch_sizes', nargs="+", type=int, default=[32, 128])
+    parser.add_argument('-threads', nargs="+", type=int, default=[1, 4])
+    parser.add_argument('-samples', type=int, default=32, help="Number of samples to measure")
+    parser.add_argument('-transformations', type=int, default=8, help="Number of rotations to measure")
+    parser.add_argument('-repeats', type=int, default=3, help="Repetitions per benchmark, the fastest one is kept")
+    parser.add_argument('-output', type=Path, default=default_results_path)
+    parser.add_argument('-baseline', type=Path, default=default_baseline_path)
+    parser.add_argument('-save_baseline', action="store_true", help="Save results as the new baseline (the default if there is no baseline)")
+    parser.add_argument('-tolerance', type=float, default=0.1, help="Relative slowdown w.r.t. the baseline considered a regression")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    measure = tm.pytorch.NormalizedVarianceInvariance(tm.pytorch.AverageFeatureMaps())
+    configs = [BenchmarkConfig(m, d, b, t, args.samples, args.transformations)
+               for m, d, b, t in itertools.product(args.models, args.datasets, args.batch_sizes, args.threads)]
+    results = []
+    for i, c in enumerate(configs):
+        print(f"[{i + 1}/{len(configs)}] {c}", flush=True)
+        results.append(run_benchmark(c, args.repeats, measure))
+
+    record = args.save_baseline or not args.baseline.exists()
+    if record and not args.save_baseline:
+        print(f"No baseline found at {args.baseline}, recording these results as the baseline")
+    regressions = []
+    if not record:
+        regressions = compare(results, load(args.baseline), args.tolerance)
+    print_results(results, args.tolerance)
+    save(args.output, results)
+    if record:
+        save(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+    if len(regressions) > 0:
+        print(f"{len(regressions)} benchmarks regressed more than {args.tolerance * 100:.0f}% w.r.t. {args.baseline}")
+        sys.exit(1)
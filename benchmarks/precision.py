@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+'''
+Error and memory report of reduced precision measurement (see experiment.measure.precision).
+
+Evaluates a measure for each model on synthetic data with full precision and with a reduced precision policy,
+and reports the error of the reduced precision results and the bytes of activations captured per sample.
+
+    python -m benchmarks.precision -models VGG16D ResNet -datasets cifar10
+'''
+from __future__ import annotations
+
+import argparse
+
+import texttable
+import torch
+import tmeasures as tm
+from tmeasures.pytorch.transformations.affine import RotationGenerator
+from tmeasures.transformations.parameters import UniformRotation
+
+import datasets
+from experiment.measure import precision
+from experiments.tasks import Task
+from experiments.models.util import TruncatedActivationsModule, layer_table
+from pytorch.numpy_dataset import NumpyDataset
+from .measure import model_configs, default_datasets, synthetic_dataset
+
+policies = {"half": precision.half_precision, "bfloat16": precision.bfloat16_precision}
+
+
+def activation_bytes(model: tm.pytorch.ActivationsModule, sample_shape: tuple, dtype: torch.dtype) -> int:
+    table = layer_table(model, sample_shape)
+    element_size = torch.empty(0, dtype=dtype).element_size()
+    return sum(int(torch.Size(s).numel()) * element_size for s in table.shapes)
+
+
+def compare_precision(model_name: str, dataset_name: str, policy: precision.PrecisionPolicy, samples: int,
+                      transformations: int, batch_size: int, measure: tm.pytorch.PyTorchMeasure) -> tuple[dict, list[dict]]:
+    torch.manual_seed(0)
+    synthetic = synthetic_dataset(dataset_name, samples)
+    model = model_configs[model_name].for_dataset(Task.Classification, dataset_name).make(synthetic.input_shape, synthetic.num_classes)
+    model.eval()
+    dataset = NumpyDataset(synthetic.x_test)
+    ts = RotationGenerator(UniformRotation(transformations, 1.0))
+    o = tm.pytorch.PyTorchMeasureOptions(batch_size=batch_size, num_workers=0, verbose=False)
+
+    def evaluate(p: precision.PrecisionPolicy):
+        m = TruncatedActivationsModule(model, lambda m, n: True, capture_dtype=p.capture_dtype)
+        return p.store(measure.eval(dataset, ts, m, o))
+
+    reference = evaluate(precision.full_precision)
+    rows = precision.error_report(reference, evaluate(policy))
+    sample_shape = tuple(dataset[0].shape)
+    full_bytes = activation_bytes(model, sample_shape, torch.float32)
+    reduced_bytes = activation_bytes(model, sample_shape, policy.capture_dtype or torch.float32)
+    summary = {"model": model_name,
+               "dataset": dataset_name,
+               "max_rel_error": max(r["max_rel_error"] for r in rows),
+               "mean_rel_error": sum(r["mean_rel_error"] for r in rows) / len(rows),
+               "mismatched": sum(r["mismatched"] for r in rows),
+               "activation_bytes": full_bytes,
+               "reduced_activation_bytes": reduced_bytes,
+               }
+    return summary, rows
+
+
+def print_summaries(summaries: list[dict]):
+    table = texttable.Texttable(max_width=160)
+    table.header(["model", "dataset", "max rel error", "mean rel error", "non finite mismatches",
+                  "activations/sample (MB)", "reduced (MB)"])
+    for s in summaries:
+        table.add_row([s["model"], s["dataset"], f"{s['max_rel_error']:.2e}", f"{s['mean_rel_error']:.2e}", s["mismatched"],
+                       f"{s['activation_bytes'] / 2 ** 20:.2f}", f"{s['reduced_activation_bytes'] / 2 ** 20:.2f}"])
+    print(table.draw())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare reduced precision measurement with full precision on synthetic data.")
+    parser.add_argument('-models', nargs="+", default=list(model_configs.keys()), choices=list(model_configs.keys()))
+    parser.add_argument('-datasets', nargs="+", default=default_datasets, choices=list(datasets.synthetic.templates.keys()))
+    parser.add_argument('-policy', default="half", choices=list(policies.keys()))
+    parser.add_argument('-samples', type=int, default=32, help="Number of samples to measure")
+    parser.add_argument('-transformations', type=int, default=8, help="Number of rotations to measure")
+    parser.add_argument('-batch_size', type=int, default=32)
+    parser.add_argument('-layers', action="store_true", help="Print the error of each layer")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    measure = tm.pytorch.NormalizedVarianceInvariance(tm.pytorch.AverageFeatureMaps())
+    summaries = []
+    for model_name in args.models:
+        for dataset_name in args.datasets:
+            print(f"{model_name} {dataset_name} {policies[args.policy]}", flush=True)
+            summary, rows = compare_precision(model_name, dataset_name, policies[args.policy], args.samples,
+                                              args.transformations, args.batch_size, measure)
+            if args.layers:
+                precision.print_error_report(rows)
+            summaries.append(summary)
+    print_summaries(summaries)
@@ -1,7 +1,8 @@
-from . import cluttered_mnist,mnist_rot,mnist,fashion_mnist,cifar10,handshape
+from . import synthetic
+from .registry import LoaderRegistry
 
 
-from datasets.util import reduce_size_subset_stratified
+from datasets.util import stratified_indices
 import numpy as np
 import os
 from enum import Enum
@@ -38,19 +39,26 @@ class TrainTestDataset:
         else:
             raise ValueError(subset)
 
+    def feature_statistics(self,indices:np.ndarray=None):
+        '''
+        :param indices: compute them only for these samples of x_train
+        :return: per channel mean and std of x_train (std 1 for constant channels), as used by `normalize_features`
+        '''
+        x=self.x_train if indices is None else self.x_train[indices]
+        x=x.astype(np.float32)
+        u=x.mean(axis=(0,2,3),keepdims=True)
+        d=x.std(axis=(0,2,3),keepdims=True)
+        d[d==0]=1
+        return u,d
+
     def normalize_features(self):
+        u,d=self.feature_statistics()
         self.x_test=self.x_test.astype(np.float32)
         self.x_train=self.x_train.astype(np.float32)
 
-        def mean_std(x:np.ndarray):
-            u=x.mean(axis=(0,2,3),keepdims=True)
-            d=x.std(axis=(0,2,3),keepdims=True)
-            d[d==0]=1
-            return u,d
         def normalize(x,u,d):
             x-=u
             x/=d
-        u,d=mean_std(self.x_train)
         normalize(self.x_train,u,d)
         normalize(self.x_test,u,d)
 
@@ -87,11 +95,44 @@ class ClassificationDataset(TrainTestDataset):
     def reduce_size_stratified(self, percentage:float):
         if percentage==1:
             return self
-        x_train, y_train, _, _ = reduce_size_subset_stratified(percentage, self.x_train, self.y_train)
-        x_test, y_test, _, _ = reduce_size_subset_stratified(percentage, self.x_test, self.y_test)
-        return ClassificationDataset(self.name, x_train, x_test, y_train, y_test
+        train_indices = self.stratified_indices(percentage, DatasetSubset.train)
+        test_indices = self.stratified_indices(percentage, DatasetSubset.test)
+        return ClassificationDataset(self.name, self.x_train[train_indices], self.x_test[test_indices], self.y_train[train_indices], self.y_test[test_indices]
                                      , self.num_classes, self.input_shape, self.labels, self.dataformat)
 
+    def stratified_indices(self, percentage:float, subset:DatasetSubset)->np.ndarray:
+        '''
+        :return: indices of the samples of `subset` kept by `reduce_size_stratified(percentage)`, in the same order
+        '''
+        x,y = self.get_subset(subset)
+        if percentage==1:
+            return np.arange(len(y))
+        indices, _ = stratified_indices(percentage, y)
+        return indices
+
+    def subset_stratified_fixed(self, new_size:int, subset:DatasetSubset, normalize=False):
+        return self.subset_stratified(new_size/self.size(subset), subset, normalize=normalize)
+
+    def subset_stratified(self, percentage:float, subset:DatasetSubset, normalize=False):
+        '''
+        Samples of `subset` of `reduce_size_stratified(percentage)`, copying only those samples (none if percentage is 1
+        and normalize is False).
+        :param normalize: normalize them as `normalize_features` would after `reduce_size_stratified(percentage)`, that is,
+        with the statistics of the reduced train subset
+        :return: x, y
+        '''
+        indices = self.stratified_indices(percentage, subset)
+        x,y = self.get_subset(subset)
+        if percentage != 1:
+            x,y = x[indices],y[indices]
+        if normalize:
+            train_indices = None if percentage==1 else self.stratified_indices(percentage, DatasetSubset.train)
+            u,d = self.feature_statistics(train_indices)
+            x = x.astype(np.float32)
+            x -= u
+            x /= d
+        return x,y
+
     def summary(self):
         result = f"Image Classification Dataset {self.name}\n" \
             f"Dataformat {self.dataformat}\n"
@@ -104,17 +145,43 @@ class ClassificationDataset(TrainTestDataset):
         return result
 
 
-datasets={"mnist":mnist,
-          "lsa16":handshape.HandshapeLoader("lsa16"),
-          "rwth":handshape.HandshapeLoader("rwth", min_samples_per_class=15),
-          # ,"fashion_mnist":fashion_mnist
-          "cifar10":cifar10,
-          # ,"mnist_rot":mnist_rot
-          # ,"cluttered_mnist":cluttered_mnist
-          }
+# loader modules (and their dependencies, like handshape_datasets) are only imported when their dataset is requested
+datasets=LoaderRegistry()
+datasets.register("mnist", "mnist")
+datasets.register("lsa16", "handshape", "HandshapeLoader", id="lsa16")
+datasets.register("rwth", "handshape", "HandshapeLoader", id="rwth", min_samples_per_class=15)
+# datasets.register("fashion_mnist", "fashion_mnist")
+datasets.register("cifar10", "cifar10")
+# datasets.register("mnist_rot", "mnist_rot")
+# datasets.register("cluttered_mnist", "cluttered_mnist")
+
+# offline datasets with the shape, classes and size of the real ones
+for template in synthetic.templates:
+    datasets.add(f"synthetic_{template}", synthetic.SyntheticLoader.like(template))
 names=datasets.keys()
 
 
+def register_synthetic(name:str, template:str, n_train:int=None, n_test:int=None, seed=0):
+    '''
+    Registers a synthetic dataset with the shape and classes of `template` and a custom number of samples.
+    The name must start with "synthetic_".
+    '''
+    assert name.startswith("synthetic_"), f"Synthetic dataset names must start with synthetic_ (got {name})"
+    datasets.add(name, synthetic.SyntheticLoader.like(template, n_train=n_train, n_test=n_test, seed=seed))
+
+
+def base_name(dataset:str)->str:
+    '''
+    Name of the real dataset imitated by a synthetic dataset, or the same name for real datasets.
+    Used to look up per dataset settings (filters, epochs, accuracies) of models.
+    '''
+    # synthetic loaders are never lazy, so real datasets don't need to be loaded to check
+    loader = datasets.resolved(dataset)
+    if isinstance(loader, synthetic.SyntheticLoader) and loader.template is not None:
+        return loader.template
+    return dataset
+
+
 def get_base(dataset,dataformat:str,path:Path):
     path.mkdir(exist_ok=True, parents=True)
 
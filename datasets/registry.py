@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import importlib
+from collections.abc import Mapping
+
+
+class LazyLoader:
+    '''
+    Loader of a dataset defined by the module `datasets.<module>`: the module itself if `factory` is None (it must
+    have a `load_data(path)` function), or the result of calling its attribute `factory` with `kwargs`.
+    The module is only imported when the loader is first requested.
+    '''
+    def __init__(self, module: str, factory: str = None, **kwargs):
+        self.module = module
+        self.factory = factory
+        self.kwargs = kwargs
+
+    def resolve(self):
+        module = importlib.import_module(f"datasets.{self.module}")
+        if self.factory is None:
+            return module
+        return getattr(module, self.factory)(**self.kwargs)
+
+    def __repr__(self):
+        factory = "" if self.factory is None else f".{self.factory}"
+        return f"LazyLoader(datasets.{self.module}{factory})"
+
+
+class LoaderRegistry(Mapping):
+    '''
+    Dataset name -> loader. Loaders registered with `register` are resolved (importing their modules and
+    dependencies) the first time their name is looked up; listing or checking names never resolves them.
+    '''
+    def __init__(self):
+        self.loaders = {}
+
+    def register(self, name: str, module: str, factory: str = None, **kwargs):
+        self.loaders[name] = LazyLoader(module, factory, **kwargs)
+
+    def add(self, name: str, loader):
+        self.loaders[name] = loader
+
+    def __getitem__(self, name: str):
+        loader = self.loaders[name]
+        if isinstance(loader, LazyLoader):
+            loader = loader.resolve()
+            self.loaders[name] = loader
+        return loader
+
+    def resolved(self, name: str):
+        '''
+        :return: the loader of `name` if it is already resolved, None otherwise
+        '''
+        loader = self.loaders.get(name)
+        return None if isinstance(loader, LazyLoader) else loader
+
+    def __contains__(self, name) -> bool:
+        return name in self.loaders
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
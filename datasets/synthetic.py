@@ -0,0 +1,77 @@
+"""Synthetic class-structured image datasets.
+
+Deterministic images with the shapes and number of classes of the real datasets, generated locally so that
+benchmarks and smoke tests can run without network access. Each class has a smooth random prototype image;
+samples are noisy, randomly shifted and rescaled versions of the prototype of their class.
+"""
+
+import numpy as np
+from pathlib import Path
+
+# input_shape, number of classes, train samples, test samples of the datasets being imitated
+templates = {"mnist": ((28, 28, 1), 10, 60000, 10000),
+             "cifar10": ((32, 32, 3), 10, 50000, 10000),
+             "lsa16": ((32, 32, 3), 16, 640, 160),
+             "rwth": ((132, 92, 3), 45, 2687, 672),
+             }
+
+
+class SyntheticLoader:
+    def __init__(self, input_shape: tuple, num_classes: int, n_train: int, n_test: int, seed=0, template: str = None,
+                 noise=0.25, max_shift=2):
+        self.input_shape = tuple(input_shape)
+        self.num_classes = num_classes
+        self.n_train = n_train
+        self.n_test = n_test
+        self.seed = seed
+        self.template = template
+        self.noise = noise
+        self.max_shift = max_shift
+
+    @classmethod
+    def like(cls, template: str, n_train: int = None, n_test: int = None, seed=0):
+        '''
+        Synthetic dataset with the shape and classes of `template`, and its number of samples unless
+        `n_train` or `n_test` are specified.
+        '''
+        input_shape, num_classes, default_train, default_test = templates[template]
+        n_train = default_train if n_train is None else n_train
+        n_test = default_test if n_test is None else n_test
+        return SyntheticLoader(input_shape, num_classes, n_train, n_test, seed=seed, template=template)
+
+    def prototypes(self) -> np.ndarray:
+        h, w, c = self.input_shape
+        rng = np.random.default_rng([self.seed, 0])
+        # low resolution random patterns, upsampled to obtain smooth images
+        lh, lw = max(h // 4, 1), max(w // 4, 1)
+        low = rng.uniform(0, 1, (self.num_classes, lh, lw, c)).astype(np.float32)
+        rows = np.arange(h) * lh // h
+        cols = np.arange(w) * lw // w
+        return low[:, rows, :, :][:, :, cols, :]
+
+    def generate(self, n: int, subset: int, prototypes: np.ndarray, chunk_size=10000) -> tuple[np.ndarray, np.ndarray]:
+        h, w, c = self.input_shape
+        rng = np.random.default_rng([self.seed, subset])
+        # balanced classes in random order
+        y = np.arange(n) % self.num_classes
+        rng.shuffle(y)
+        x = np.empty((n, h, w, c), dtype=np.uint8)
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            m = end - start
+            # shift each sample circularly by a random offset
+            shifts = rng.integers(-self.max_shift, self.max_shift + 1, size=(m, 2))
+            rows = (np.arange(h)[np.newaxis, :] - shifts[:, 0:1]) % h
+            cols = (np.arange(w)[np.newaxis, :] - shifts[:, 1:2]) % w
+            chunk = prototypes[y[start:end, np.newaxis, np.newaxis], rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+            contrast = rng.uniform(0.7, 1.0, size=(m, 1, 1, 1)).astype(np.float32)
+            chunk = chunk * contrast + rng.normal(0, self.noise, size=chunk.shape).astype(np.float32)
+            x[start:end] = (np.clip(chunk, 0, 1) * 255).astype(np.uint8)
+        return x, y.astype(np.uint8 if self.num_classes <= 256 else np.int64)
+
+    def load_data(self, path: Path):
+        prototypes = self.prototypes()
+        x_train, y_train = self.generate(self.n_train, 1, prototypes)
+        x_test, y_test = self.generate(self.n_test, 2, prototypes)
+        labels = [f"{i}" for i in range(self.num_classes)]
+        return (x_train, y_train), (x_test, y_test), self.input_shape, labels
@@ -1,6 +1,6 @@
-import requests
 import shutil
 def download_file(url,filepath):
+    import requests
     with requests.get(url, stream=True) as r:
         with open(filepath, 'wb') as f:
             shutil.copyfileobj(r.raw, f)
@@ -9,7 +9,6 @@ def download_file(url,filepath):
 
 from abc import ABC,abstractmethod
 from urllib.parse import urlparse
-import requests
 import os
 import logging
 class DatasetLoader(ABC):
@@ -77,6 +76,7 @@ class DatasetLoader(ABC):
         return self.load(path)
 
     def download_file(self, url, filepath):
+        import requests
         with requests.get(url, stream=True) as r:
             with open(filepath, 'wb') as f:
                 shutil.copyfileobj(r.raw, f)
@@ -84,38 +84,31 @@ class DatasetLoader(ABC):
 
 import numpy as np
 
-def reduce_size_subset_stratified(percentage, x, y,random=False):
-    x1=[]
-    y1=[]
-    x2=[]
-    y2=[]
-    num_classes= y.max()+1
-    for i in range(num_classes):
-        class_indices = np.squeeze(y == i)
-        class_x=x[class_indices,]
-        class_y=y[class_indices]
-        class_n=len(class_y)
+def stratified_indices(percentage, y, random=False):
+    '''
+    Splits the samples of each class in two, keeping `percentage` of them (rounded down) in the first part.
+    The samples are grouped by class (in increasing order) and keep their original order within each class,
+    or are randomly permuted within it if `random`.
+    :return: indices of the first and second part
+    '''
+    y = np.asarray(y).ravel()
+    # a stable sort groups the samples by class and keeps their order within the class
+    order = np.argsort(y, kind="stable")
+    classes, starts, counts = np.unique(y[order], return_index=True, return_counts=True)
+    indices1 = []
+    indices2 = []
+    for start, class_n in zip(starts, counts):
+        class_indices = order[start:start + class_n]
         if random:
-            indices = np.random.permutation(class_n)
-        else:
-            indices = list(range(class_n))
-        limit=int(class_n * percentage)
-
-        indices1 = indices[:limit]
-        
-        x1.append(class_x[indices1])
-        y1.append(class_y[indices1])
+            class_indices = class_indices[np.random.permutation(class_n)]
+        limit = int(class_n * percentage)
+        indices1.append(class_indices[:limit])
+        indices2.append(class_indices[limit:])
+    return np.concatenate(indices1), np.concatenate(indices2)
 
-        indices2 = indices[limit:]
-        x2.append(class_x[indices2])
-        y2.append(class_y[indices2])
-
-
-    x1 = np.vstack(x1)
-    y1 = np.vstack(y1)
-    x2 = np.vstack(x2)
-    y2 = np.vstack(y2)
-    return x1, y1, x2, y2
+def reduce_size_subset_stratified(percentage, x, y,random=False):
+    indices1, indices2 = stratified_indices(percentage, y, random=random)
+    return x[indices1], y[indices1], x[indices2], y[indices2]
 
 def split_data(x,y,subject,test_subjects):
     if test_subjects=="subject_dependent":
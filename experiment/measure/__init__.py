@@ -1,3 +1,5 @@
 from .parameters import  Parameters,Options,DatasetParameters,MeasureExperimentResult,PyTorchParameters
 
-from .run import main_pytorch
\ No newline at end of file
+from .run import main_pytorch, experiment_pytorch_grid, grid_parameters
+from .grid import supports_grid
+from .blocks import AdaptiveSampling, supports_blocks
\ No newline at end of file
@@ -0,0 +1,346 @@
+'''
+Evaluation of variance measures in blocks of samples. Each block keeps the state of the measure's running statistics
+(instead of its result), so that pooling the blocks gives the same result as evaluating the measure on all of their
+samples at once, and resampling them gives bootstrap or jackknife replicates of that same estimator.
+'''
+from __future__ import annotations
+
+from statistics import NormalDist
+
+import numpy as np
+import torch
+import tmeasures as tm
+from torch.utils.data import Dataset
+from tmeasures.pytorch import ActivationsModule, PyTorchMeasureOptions, PyTorchMeasureResult
+from tmeasures.pytorch.activations_iterator import PytorchActivationsIterator
+from tmeasures.pytorch.base import PyTorchLayerMeasure, STMatrixIterator
+from tmeasures.pytorch.measure_transformer import MeasureTransformation, NoTransformation
+from tmeasures.pytorch.quotient import QuotientMeasure, QuotientMeasureResult, safe_divide
+from tmeasures.pytorch.stats_running import RunningMeanAndVarianceWelford
+
+from .grid import grid_measures, supports_grid, TransformationVarianceGrid, SampleVarianceGrid
+
+
+class AdaptiveSampling:
+    '''
+    Measure samples in stratified blocks of `block_size` until the estimate of every layer is within a relative confidence
+    interval of half width `relative_error` (at level `confidence`), or `max_samples` are used (default: the size given
+    by the dataset parameters). At least `min_samples` are always used.
+    The estimate is the measure evaluated on all the samples used; its error is estimated by jackknife over the blocks.
+    '''
+    def __init__(self, relative_error: float = 0.05, confidence: float = 0.95, block_size: int = 128,
+                 min_samples: int = 256, max_samples: int = None):
+        assert 0 < relative_error and 0 < confidence < 1
+        assert min_samples >= 2 * block_size, "At least two blocks are needed to estimate the error"
+        self.relative_error = relative_error
+        self.confidence = confidence
+        self.block_size = block_size
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+
+    def z(self):
+        return NormalDist().inv_cdf((1 + self.confidence) / 2)
+
+    def id(self):
+        max_samples = "" if self.max_samples is None else f",max={self.max_samples}"
+        return f"Adaptive(e={self.relative_error},c={self.confidence},b={self.block_size},min={self.min_samples}{max_samples},se=jackknife)"
+
+    def __repr__(self):
+        return self.id()
+
+
+def as_numpy(layer) -> np.ndarray:
+    if isinstance(layer, torch.Tensor):
+        layer = layer.detach().cpu().double().numpy()
+    return np.asarray(layer, dtype=np.float64)
+
+
+class TransformationVarianceBlock(PyTorchLayerMeasure):
+    '''
+    State of TransformationVarianceGrid (mean over the rows of the std of each row) for one block of rows:
+    the sum of the row stds.
+    '''
+    def eval(self, st_iterator: STMatrixIterator, layer_name: str):
+        total = 0
+        for row, row_iterator in enumerate(st_iterator):
+            row_variance = RunningMeanAndVarianceWelford()
+            for batch_activations in row_iterator:
+                row_variance.update_batch(batch_activations.double())
+            total = total + row_variance.std()
+        return {"sum": total}
+
+    def generate_result(self, layer_results, layer_names):
+        pass
+
+    @staticmethod
+    def pool(state: dict[str, np.ndarray], sizes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        '''
+        :param state: arrays of shape (blocks, *unit), as returned by `eval` for each block
+        :param sizes: rows of each block
+        :param weights: (replicates, blocks) times each block is counted in each replicate
+        :return: (replicates, *unit) mean of the row stds of the weighted blocks
+        '''
+        s = state["sum"]
+        pooled = weights @ s.reshape(len(s), -1) / (weights @ sizes)[:, None]
+        return pooled.reshape(len(weights), *s.shape[1:])
+
+
+class SampleVarianceBlock(PyTorchLayerMeasure):
+    '''
+    State of SampleVarianceGrid (mean over the rows of the std of each row) for one block of columns:
+    the mean and sum of squared deviations of each row (Welford's state), of shape (rows, *unit).
+    '''
+    def eval(self, st_iterator: STMatrixIterator, layer_name: str):
+        means, m2s = [], []
+        for row, row_iterator in enumerate(st_iterator):
+            row_variance = RunningMeanAndVarianceWelford()
+            for batch_activations in row_iterator:
+                row_variance.update_batch(batch_activations.double())
+            means.append(row_variance.mean())
+            m2s.append(row_variance.s)
+        return {"mean": torch.stack(means), "m2": torch.stack(m2s)}
+
+    def generate_result(self, layer_results, layer_names):
+        pass
+
+    @staticmethod
+    def pool(state: dict[str, np.ndarray], sizes: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        '''
+        Combines the Welford states of the weighted blocks (Chan et al.) and averages the std of the rows.
+        :param state: arrays of shape (blocks, rows, *unit), as returned by `eval` for each block
+        :param sizes: columns of each block
+        :param weights: (replicates, blocks) times each block is counted in each replicate
+        :return: (replicates, *unit)
+        '''
+        shape = state["mean"].shape
+        mean = state["mean"].reshape(shape[0], -1)
+        m2 = state["m2"].reshape(shape[0], -1)
+        # deviations from the mean of all blocks, so that the sums of squares below don't cancel
+        d = mean - sizes @ mean / sizes.sum()
+        w = weights * sizes
+        n = w.sum(axis=1, keepdims=True)
+        d_pooled = w @ d / n
+        m2_pooled = weights @ m2 + w @ (d * d) - n * d_pooled * d_pooled
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(n > 1, np.sqrt(np.maximum(m2_pooled, 0) / (n - 1)), 0)
+        return std.reshape(len(weights), *shape[1:]).mean(axis=1)
+
+
+block_layer_measures = {TransformationVarianceGrid: TransformationVarianceBlock, SampleVarianceGrid: SampleVarianceBlock}
+# measures that can be evaluated in blocks: dataset layout, activations transformer and block layer measure
+block_measures = {m: (dataset2d, transformer, block_layer_measures[layer_measure])
+                  for m, (dataset2d, transformer, layer_measure) in grid_measures.items()}
+
+
+def supports_blocks(measure: tm.pytorch.PyTorchMeasure) -> bool:
+    return supports_grid(measure)
+
+
+def eval_block_state(measure: tm.pytorch.PyTorchMeasure, dataset: Dataset, transformations: tm.TransformationSet,
+                     model: ActivationsModule, o: PyTorchMeasureOptions) -> list[dict[str, np.ndarray]]:
+    '''
+    :return: for each layer, the state of the (non quotient) variance `measure` evaluated on `dataset`
+    '''
+    dataset2d_class, transformer_class, layer_measure_class = block_measures[type(measure)]
+    dataset2d = dataset2d_class(dataset, transformations, device=o.data_device)
+    iterator = PytorchActivationsIterator(model, dataset2d, o, activations_transformer=transformer_class())
+    layer_states = iterator.evaluate(layer_measure_class())
+    return [{k: as_numpy(v) for k, v in state.items()} for state in layer_states]
+
+
+def transform_replicates(t: MeasureTransformation, values: np.ndarray, layer_name: str) -> np.ndarray:
+    '''
+    Applies a quotient's measure transformation to each replicate, (replicates, *unit) values of a layer
+    '''
+    if isinstance(t, NoTransformation):
+        return values
+    return np.stack([t.forward(torch.from_numpy(v), layer_name).numpy() for v in values])
+
+
+def safe_divide_numpy(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    # same conventions as tmeasures' safe_divide
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(y > 0, x / y, np.where(x <= 0, 1.0, np.inf))
+    return r
+
+
+def layer_averages(layers: list[np.ndarray]) -> np.ndarray:
+    '''
+    :param layers: (replicates, *unit) values of each layer
+    :return: (replicates, layers) average of the finite values of each layer
+    '''
+    averages = []
+    for l in layers:
+        l = l.reshape(len(l), -1)
+        finite = np.isfinite(l)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            averages.append(np.where(finite, l, 0).sum(axis=1) / finite.sum(axis=1))
+    return np.stack(averages, axis=1)
+
+
+class BlockResults:
+    '''
+    State of a variance measure (or of the numerator and denominator of a quotient of them) for each block of samples
+    it was evaluated on, consecutive in the dataset. For transformation variances the state of a block is the sum of
+    the stds of its samples, and for sample variances the mean and sum of squared deviations of the activations for
+    each transformation, that is, (2 x transformations) times the size of the activations of a sample.
+    '''
+    def __init__(self, measure: tm.pytorch.PyTorchMeasure, layer_names: list[str]):
+        self.measure = measure
+        self.layer_names = layer_names
+        self.quotient = isinstance(measure, QuotientMeasure)
+        self.sizes = []
+        # component -> blocks -> layers -> state
+        self.blocks = {c: [] for c in self.components()}
+        self.stacked_cache = {}
+
+    def components(self) -> list[str]:
+        return ["x", "y"] if self.quotient else ["value"]
+
+    def component_measure(self, component: str) -> tm.pytorch.PyTorchMeasure:
+        if self.quotient:
+            return self.measure.numerator_measure if component == "x" else self.measure.denominator_measure
+        return self.measure
+
+    def add(self, size: int, **states):
+        self.sizes.append(size)
+        for c in self.components():
+            self.blocks[c].append(states[c])
+        self.stacked_cache = {}
+
+    @property
+    def samples(self) -> int:
+        return int(sum(self.sizes))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["stacked_cache"] = {}
+        return state
+
+    def stacked(self, component: str) -> list[dict[str, np.ndarray]]:
+        '''
+        :return: for each layer, its state arrays stacked over the blocks
+        '''
+        if component not in self.stacked_cache:
+            blocks = self.blocks[component]
+            self.stacked_cache[component] = [{k: np.stack([b[i][k] for b in blocks]) for k in blocks[0][i]}
+                                             for i in range(len(self.layer_names))]
+        return self.stacked_cache[component]
+
+    def pooled(self, component: str, weights: np.ndarray) -> list[np.ndarray]:
+        '''
+        :param weights: (replicates, blocks) times each block is counted in each replicate
+        :return: (replicates, *unit) values of each layer of the component's measure, for the weighted blocks
+        '''
+        pool = block_measures[type(self.component_measure(component))][2].pool
+        sizes = np.asarray(self.sizes, dtype=np.float64)
+        return [pool(state, sizes, weights) for state in self.stacked(component)]
+
+    def layer_values(self, weights: np.ndarray) -> list[np.ndarray]:
+        '''
+        :return: (replicates, *unit) values of each layer of the measure, for the weighted blocks
+        '''
+        if not self.quotient:
+            return self.pooled("value", weights)
+        t = self.measure.measure_transformation
+        x = [transform_replicates(t, l, n) for l, n in zip(self.pooled("x", weights), self.layer_names)]
+        y = [transform_replicates(t, l, n) for l, n in zip(self.pooled("y", weights), self.layer_names)]
+        return [safe_divide_numpy(lx, ly) for lx, ly in zip(x, y)]
+
+    def state_size(self) -> int:
+        return max(int(np.prod(v.shape[1:])) for c in self.components() for l in self.stacked(c) for v in l.values())
+
+    def replicate_averages(self, weights: np.ndarray, max_elements: int = 2 ** 25) -> np.ndarray:
+        '''
+        :return: (replicates, layers) average value of each layer for the weighted blocks,
+        computed in chunks of replicates of at most `max_elements` state values
+        '''
+        chunk = max(1, max_elements // self.state_size())
+        return np.concatenate([layer_averages(self.layer_values(weights[i:i + chunk]))
+                               for i in range(0, len(weights), chunk)], axis=0)
+
+    def result(self) -> PyTorchMeasureResult:
+        '''
+        :return: the result of the measure evaluated on the samples of all blocks
+        '''
+        weights = np.ones((1, len(self)))
+        if self.quotient:
+            x = PyTorchMeasureResult([torch.from_numpy(l[0]) for l in self.pooled("x", weights)], self.layer_names, self.measure.numerator_measure)
+            self.measure.measure_transformation.transform_result(x)
+            y = PyTorchMeasureResult([torch.from_numpy(l[0]) for l in self.pooled("y", weights)], self.layer_names, self.measure.denominator_measure)
+            self.measure.measure_transformation.transform_result(y)
+            v = [safe_divide(lx, ly) for lx, ly in zip(x.layers, y.layers)]
+            return QuotientMeasureResult(v, self.layer_names, self.measure, x, y)
+        return PyTorchMeasureResult([torch.from_numpy(l[0]) for l in self.pooled("value", weights)], self.layer_names, self.measure)
+
+    def bootstrap(self, replicates: int = 1000, confidence: float = 0.95, seed: int = 0) -> LayerIntervals:
+        '''
+        Percentile bootstrap of the average value of each layer, resampling the blocks with replacement
+        and pooling the state of the resampled blocks.
+        '''
+        n_blocks = len(self)
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(n_blocks, np.full(n_blocks, 1 / n_blocks), size=replicates).astype(np.float64)
+        averages = self.replicate_averages(counts)
+        estimate = self.replicate_averages(np.ones((1, n_blocks)))[0]
+        alpha = (1 - confidence) / 2
+        low, high = np.nanquantile(averages, [alpha, 1 - alpha], axis=0)
+        return LayerIntervals(estimate, low, high, confidence)
+
+    def relative_half_width(self, z: float) -> np.ndarray:
+        '''
+        :return: for each layer, half width of the confidence interval of its average value relative to the value,
+        from the jackknife (leave one block out) standard error of the pooled estimate
+        '''
+        n_blocks = len(self)
+        estimate = self.replicate_averages(np.ones((1, n_blocks)))[0]
+        values = self.replicate_averages(1 - np.eye(n_blocks))
+        deviations = values - values.mean(axis=0)
+        standard_error = np.sqrt((n_blocks - 1) / n_blocks * (deviations * deviations).sum(axis=0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = z * standard_error / np.abs(estimate)
+        # constant layers (e.g. all zero) have no error
+        return np.where(standard_error == 0, 0, relative)
+
+
+class LayerIntervals:
+    '''
+    Per layer confidence intervals [low, high] of the average value of each layer, around its `estimate`
+    '''
+    def __init__(self, estimate: np.ndarray, low: np.ndarray, high: np.ndarray, confidence: float):
+        self.estimate = estimate
+        self.low = low
+        self.high = high
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"LayerIntervals(layers={len(self.estimate)},confidence={self.confidence})"
+
+
+def eval_blocks(measure: tm.pytorch.PyTorchMeasure, dataset: torch.utils.data.Dataset, block_size: int,
+                model: ActivationsModule, o: PyTorchMeasureOptions, transformations: tm.TransformationSet,
+                adaptive: AdaptiveSampling = None, verbose=False) -> BlockResults:
+    '''
+    Evaluates the state of `measure` on consecutive blocks of `block_size` samples of `dataset` (which should be
+    ordered so that every block is stratified). If `adaptive` is given, stops as soon as its error target is met.
+    '''
+    assert supports_blocks(measure), f"Only variance measures (and their quotients) can be evaluated in blocks, not {measure}"
+    results = BlockResults(measure, model.activation_names())
+    n = len(dataset)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = torch.utils.data.Subset(dataset, range(start, end))
+        states = {c: eval_block_state(results.component_measure(c), block, transformations, model, o)
+                  for c in results.components()}
+        results.add(end - start, **states)
+
+        if adaptive is not None and results.samples >= adaptive.min_samples:
+            error = results.relative_half_width(adaptive.z())
+            if verbose:
+                print(f"{results.samples} samples, max relative error {np.nanmax(error):.3f} (target {adaptive.relative_error})")
+            if np.all(error <= adaptive.relative_error):
+                break
+    return results
@@ -0,0 +1,199 @@
+'''
+Evaluation of a measure for a grid of (sample size, transformation set) configurations in a single pass.
+The samples of smaller sizes are the prefixes of the largest sample, and the transformations of all sets are
+evaluated together as their union, so every cell of the grid is accumulated from the same activations.
+'''
+from __future__ import annotations
+
+import numpy as np
+import torch
+import tmeasures as tm
+from torch.utils.data import Dataset
+from tmeasures.pytorch import ActivationsModule, PyTorchMeasureOptions, PyTorchMeasureResult
+from tmeasures.pytorch.activations_iterator import PytorchActivationsIterator, IdentityActivationsTransformer
+from tmeasures.pytorch.base import PyTorchLayerMeasure, STMatrixIterator
+from tmeasures.pytorch.dataset2d import SampleTransformationDataset, TransformationSampleDataset
+from tmeasures.pytorch.quotient import QuotientMeasure, QuotientMeasureResult, safe_divide
+from tmeasures.pytorch.stats_running import RunningMeanWelford, RunningMeanAndVarianceWelford
+from tmeasures.pytorch.transformations import PyTorchTransformationSet
+from tmeasures.pytorch.variance_sameequivariance import InverseTransformationTransformer
+
+
+def transformation_key(t) -> tuple:
+    matrix = getattr(t, "transformation_matrix", None)
+    if matrix is None:
+        # no way to compare them, assume different
+        return (id(t),)
+    return tuple(np.round(matrix.flatten().tolist(), 9))
+
+
+class UnionTransformationSet(PyTorchTransformationSet):
+    def __init__(self, members: list, sets: list[PyTorchTransformationSet]):
+        super().__init__(members)
+        self.sets = sets
+
+    def id(self):
+        return f"Union({','.join(s.id() for s in self.sets)})"
+
+    def valid_input(self, shape):
+        return all(s.valid_input(shape) for s in self.sets)
+
+    def copy(self):
+        return UnionTransformationSet(list(self), self.sets)
+
+
+class TransformationGrid:
+    '''
+    The union of `sets`, without duplicated transformations, and a mask of the members of each set in the union.
+    '''
+    def __init__(self, sets: list[PyTorchTransformationSet]):
+        self.sets = sets
+        index = {}
+        members = []
+        self.indices = []
+        for s in sets:
+            set_indices = []
+            for t in s:
+                key = transformation_key(t)
+                if key not in index:
+                    index[key] = len(members)
+                    members.append(t)
+                set_indices.append(index[key])
+            self.indices.append(set_indices)
+        self.union = UnionTransformationSet(members, sets)
+        self.masks = torch.zeros(len(sets), len(members), dtype=torch.bool)
+        for j, set_indices in enumerate(self.indices):
+            self.masks[j, set_indices] = True
+
+    def __len__(self):
+        return len(self.sets)
+
+
+class TransformationVarianceGrid(PyTorchLayerMeasure):
+    '''
+    Variance over rows of samples and columns of (union) transformations.
+    The std of each row is computed for every transformation set, and their mean over the rows is taken at each sample size.
+    '''
+    def __init__(self, sample_sizes: list[int], masks: torch.Tensor):
+        self.sample_sizes = sample_sizes
+        self.masks = masks
+
+    def eval(self, st_iterator: STMatrixIterator, layer_name: str):
+        n_sets = self.masks.shape[0]
+        means = [RunningMeanWelford() for j in range(n_sets)]
+        results = []
+        for row, row_iterator in enumerate(st_iterator):
+            row_variances = [RunningMeanAndVarianceWelford() for j in range(n_sets)]
+            col = 0
+            for batch_activations in row_iterator:
+                col_to = col + batch_activations.shape[0]
+                batch_activations = batch_activations.double()
+                masks = self.masks[:, col:col_to].to(batch_activations.device)
+                for j in range(n_sets):
+                    if masks[j].any():
+                        row_variances[j].update_batch(batch_activations[masks[j]])
+                col = col_to
+            for j in range(n_sets):
+                means[j].update(row_variances[j].std())
+            if row + 1 in self.sample_sizes:
+                results.append([m.mean().clone() for m in means])
+        return results
+
+    def generate_result(self, layer_results, layer_names):
+        pass
+
+
+class SampleVarianceGrid(PyTorchLayerMeasure):
+    '''
+    Variance over rows of (union) transformations and columns of samples.
+    The std of each row is taken at each sample size, and averaged over the rows of each transformation set.
+    '''
+    def __init__(self, sample_sizes: list[int], masks: torch.Tensor):
+        self.sample_sizes = sample_sizes
+        self.masks = masks
+
+    def eval(self, st_iterator: STMatrixIterator, layer_name: str):
+        n_sets = self.masks.shape[0]
+        means = [[RunningMeanWelford() for j in range(n_sets)] for n in self.sample_sizes]
+        for row, row_iterator in enumerate(st_iterator):
+            row_variance = RunningMeanAndVarianceWelford()
+            row_stds = []
+            col = 0
+            for batch_activations in row_iterator:
+                batch_activations = batch_activations.double()
+                start = 0
+                # split the batch at the sample sizes it crosses
+                for n in self.sample_sizes:
+                    if col < n <= col + batch_activations.shape[0]:
+                        row_variance.update_batch(batch_activations[start:n - col])
+                        start = n - col
+                        row_stds.append(row_variance.std())
+                if start < batch_activations.shape[0]:
+                    row_variance.update_batch(batch_activations[start:])
+                col += batch_activations.shape[0]
+            for i, row_std in enumerate(row_stds):
+                for j in range(n_sets):
+                    if self.masks[j, row]:
+                        means[i][j].update(row_std)
+        return [[m.mean() for m in size_means] for size_means in means]
+
+    def generate_result(self, layer_results, layer_names):
+        pass
+
+
+# measures that can be evaluated as a grid: dataset layout, activations transformer and grid layer measure
+grid_measures = {
+    tm.pytorch.TransformationVarianceInvariance: (SampleTransformationDataset, IdentityActivationsTransformer, TransformationVarianceGrid),
+    tm.pytorch.SampleVarianceInvariance: (TransformationSampleDataset, IdentityActivationsTransformer, SampleVarianceGrid),
+    tm.pytorch.TransformationVarianceSameEquivariance: (SampleTransformationDataset, InverseTransformationTransformer, TransformationVarianceGrid),
+    tm.pytorch.SampleVarianceSameEquivariance: (TransformationSampleDataset, InverseTransformationTransformer, SampleVarianceGrid),
+}
+
+
+def supports_grid(measure: tm.pytorch.PyTorchMeasure) -> bool:
+    if isinstance(measure, QuotientMeasure):
+        return supports_grid(measure.numerator_measure) and supports_grid(measure.denominator_measure)
+    return type(measure) in grid_measures
+
+
+def eval_grid(measure: tm.pytorch.PyTorchMeasure, dataset: Dataset, sample_sizes: list[int], grid: TransformationGrid,
+              model: ActivationsModule, o: PyTorchMeasureOptions) -> list[list[PyTorchMeasureResult]]:
+    '''
+    Evaluates `measure` for the first n samples of `dataset`, for each n in `sample_sizes` (increasing, the last one
+    equal to the size of the dataset), and each transformation set of `grid`.
+    :return: results[i][j] for sample_sizes[i] and grid.sets[j]
+    '''
+    assert list(sample_sizes) == sorted(sample_sizes), f"Sample sizes must be increasing: {sample_sizes}"
+    assert sample_sizes[-1] == len(dataset), f"The largest sample size ({sample_sizes[-1]}) must be the size of the dataset ({len(dataset)})"
+    if isinstance(measure, QuotientMeasure):
+        numerators = eval_grid(measure.numerator_measure, dataset, sample_sizes, grid, model, o)
+        denominators = eval_grid(measure.denominator_measure, dataset, sample_sizes, grid, model, o)
+        results = []
+        for row_x, row_y in zip(numerators, denominators):
+            row = []
+            for x, y in zip(row_x, row_y):
+                measure.measure_transformation.transform_result(x)
+                measure.measure_transformation.transform_result(y)
+                v = [safe_divide(lx, ly) for lx, ly in zip(x.layers, y.layers)]
+                row.append(QuotientMeasureResult(v, model.activation_names(), measure, x, y))
+            results.append(row)
+        return results
+
+    dataset2d_class, transformer_class, layer_measure_class = grid_measures[type(measure)]
+    dataset2d = dataset2d_class(dataset, grid.union, device=o.data_device)
+    iterator = PytorchActivationsIterator(model, dataset2d, o, activations_transformer=transformer_class())
+    layer_results = iterator.evaluate(layer_measure_class(sample_sizes, grid.masks))
+    names = model.activation_names()
+    return [[PyTorchMeasureResult([l[i][j] for l in layer_results], names, measure) for j in range(len(grid))]
+            for i in range(len(sample_sizes))]
+
+
+def interleave_classes(y: np.ndarray) -> np.ndarray:
+    '''
+    Order of the samples such that every prefix has (approximately) the class proportions of `y`
+    '''
+    position = np.empty(len(y))
+    for c in np.unique(y):
+        indices = np.where(y == c)[0]
+        position[indices] = (np.arange(len(indices)) + 0.5) / len(indices)
+    return np.argsort(position, kind="stable")
@@ -0,0 +1,203 @@
+'''
+Cache of the transformed inputs of a measure. The images fed to the model depend only on the dataset
+(its parameters, adaptation and normalization) and the transformation set, so they are computed once, stored as a
+(samples x transformations x C x H x W) memmap, and read back when measuring any other model with them.
+The cache folder has a total size budget; the least recently used entries are deleted to make room for new ones.
+
+The measure is evaluated on a dataset of sample indices, with each transformation replaced by a CachedTransformation
+that reads the transformed sample from the memmap instead of warping it. Only measures that feed every input
+through the given transformation set can use the cache (see `supports_input_cache`).
+'''
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+import tmeasures as tm
+from torch.utils.data import Dataset
+from tmeasures.pytorch.transformations import PyTorchTransformationSet
+
+from pytorch.pytorch_image_dataset import transform_batch
+
+from .grid import supports_grid
+from .parameters import PyTorchParameters
+
+
+def supports_input_cache(measure: tm.pytorch.PyTorchMeasure) -> bool:
+    # the variance measures (and their quotients) only see transformed inputs; others, like
+    # GoodfellowInvariance, also transform the samples with their own transformation sets
+    return supports_grid(measure)
+
+
+def input_cache_key(p: PyTorchParameters, x: np.ndarray) -> str:
+    # the digest covers the subset, adaptation, normalization and order of the samples
+    digest = hashlib.sha256(np.ascontiguousarray(x).data).hexdigest()[:16]
+    shape = "x".join(str(d) for d in x.shape)
+    return f"{p.dataset.id()}_{shape}_normalized_{digest}_{p.transformations.id()}"
+
+
+class InputCache:
+    '''
+    Transformed inputs stored in `folder`, as an .npy file named after the hash of `key` and a .json file with the key.
+    Pickling an InputCache sends only its path; unpickling maps the file again (read-only).
+    '''
+    def __init__(self, folder: Path, key: str):
+        self.key = key
+        self.path = Path(folder) / f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.npy"
+        self.array = None
+
+    def metadata_path(self) -> Path:
+        return self.path.with_suffix(".json")
+
+    def exists(self) -> bool:
+        if not self.path.exists() or not self.metadata_path().exists():
+            return False
+        return json.loads(self.metadata_path().read_text())["key"] == self.key
+
+    def open(self):
+        self.array = np.load(self.path, mmap_mode="r")
+        return self
+
+    def touch(self):
+        # the modification time of an entry is the time it was last used (see evict)
+        os.utime(self.path)
+        self.metadata_path().touch()
+
+    def create(self, x: np.ndarray, transformations: PyTorchTransformationSet, batch_size: int = 256, verbose=False):
+        n, t = len(x), len(transformations)
+        if verbose:
+            print(f"Caching {n} samples x {t} transformations ({n * t * x[0].nbytes / 2 ** 30:.2f}GB) to {self.path}")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so that concurrent jobs never open a partially written file
+        tmp_path = self.path.parent / f"{self.path.stem}.{os.getpid()}.tmp.npy"
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n, t, *x.shape[1:]))
+        for start in range(0, n, batch_size):
+            batch = torch.from_numpy(np.ascontiguousarray(x[start:start + batch_size], dtype=np.float32))
+            for j, transformation in enumerate(transformations):
+                array[start:start + len(batch), j] = transform_batch(transformation, batch).numpy()
+        array.flush()
+        del array
+        self.metadata_path().write_text(json.dumps({"key": self.key, "samples": n, "transformations": t}))
+        os.replace(tmp_path, self.path)
+        return self.open()
+
+    def get(self, sample: int, transformation: int) -> torch.Tensor:
+        return torch.from_numpy(np.array(self.array[sample, transformation]))
+
+    def __getstate__(self):
+        return {"key": self.key, "path": self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+
+class IndexDataset(Dataset):
+    '''
+    Dataset of sample indices, to be transformed by CachedTransformations
+    '''
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, i):
+        return torch.tensor(i)
+
+    def __len__(self):
+        return self.n
+
+
+class CachedTransformation:
+    '''
+    Replaces `transformation` (the `index`-th of its set): maps a sample index to the cached transformed sample
+    '''
+    def __init__(self, cache: InputCache, index: int, transformation):
+        self.cache = cache
+        self.index = index
+        self.transformation = transformation
+
+    def __call__(self, s: torch.Tensor):
+        return self.cache.get(int(s), self.index).to(s.device)
+
+    def inverse(self):
+        # inverses are applied to activations, not inputs
+        return self.transformation.inverse()
+
+    def parameters(self):
+        return self.transformation.parameters()
+
+    def __repr__(self):
+        return f"Cached({self.transformation})"
+
+
+class CachedTransformationSet(PyTorchTransformationSet):
+    def __init__(self, cache: InputCache, transformations: PyTorchTransformationSet):
+        super().__init__([CachedTransformation(cache, j, t) for j, t in enumerate(transformations)])
+        self.cache = cache
+        self.transformations = transformations
+
+    def id(self):
+        return self.transformations.id()
+
+    def valid_input(self, shape):
+        return self.transformations.valid_input(shape)
+
+    def copy(self):
+        return CachedTransformationSet(self.cache, self.transformations)
+
+
+def cache_entries(folder: Path) -> list[Path]:
+    # finished entries only; temporary files of entries being created are not counted
+    return [f for f in Path(folder).glob("*.npy") if not f.name.endswith(".tmp.npy")]
+
+
+def evict(folder: Path, max_bytes: int, verbose=False):
+    '''
+    Deletes the least recently used entries of the cache in `folder` until the rest take at most `max_bytes`.
+    Processes that already mapped a deleted entry keep reading it.
+    '''
+    entries = []
+    for f in cache_entries(folder):
+        try:
+            stat = f.stat()
+        except FileNotFoundError:
+            # deleted by another job
+            continue
+        entries.append((stat.st_mtime, stat.st_size, f))
+    entries.sort(key=lambda e: e[0])
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in entries:
+        if total <= max_bytes:
+            break
+        if verbose:
+            print(f"Evicting cached inputs {f} ({size / 2 ** 30:.2f}GB)")
+        f.unlink(missing_ok=True)
+        f.with_suffix(".json").unlink(missing_ok=True)
+        total -= size
+
+
+def cached_inputs(p: PyTorchParameters, x: np.ndarray, folder: Path, max_bytes: int = 64 * 2 ** 30, verbose=False):
+    '''
+    :param max_bytes: budget of the whole cache in `folder`; least recently used entries are deleted to make room
+    for a new one
+    :return: the dataset and transformation set to evaluate the measure of `p` on samples `x` through the cache in `folder`
+    (created if needed), or None if the measure doesn't support it or its inputs alone would take more than `max_bytes`
+    '''
+    if not supports_input_cache(p.measure):
+        return None
+    size = len(x) * len(p.transformations) * x[0].size * np.dtype(np.float32).itemsize
+    if size > max_bytes:
+        if verbose:
+            print(f"Not caching inputs: {size / 2 ** 30:.2f}GB exceeds the cache size of {max_bytes / 2 ** 30:.2f}GB")
+        return None
+    cache = InputCache(folder, input_cache_key(p, x))
+    if cache.exists():
+        cache.touch()
+        cache.open()
+    else:
+        evict(folder, max_bytes - size, verbose=verbose)
+        cache.create(x, p.transformations, verbose=verbose)
+    return IndexDataset(len(x)), CachedTransformationSet(cache, p.transformations)
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import csv
+import json
+import math
+import time
+from pathlib import Path
+
+import torch
+import tmeasures as tm
+
+
+def synchronize(x: torch.Tensor):
+    if x.is_cuda:
+        torch.cuda.synchronize(x.device)
+
+
+def reset_peak_memory(x: torch.Tensor):
+    if x.is_cuda:
+        torch.cuda.reset_peak_memory_stats(x.device)
+
+
+def peak_memory(x: torch.Tensor) -> int | None:
+    '''
+    Peak memory in bytes allocated on the device of `x` since the last `reset_peak_memory`,
+    or None for cpu tensors, since the peak of the process can't be reset for each layer.
+    '''
+    if x.is_cuda:
+        return torch.cuda.max_memory_allocated(x.device)
+    return None
+
+
+class LayerProfile:
+    def __init__(self, name: str):
+        self.name = name
+        self.shape = None
+        self.batches = 0
+        self.samples = 0
+        self.bytes = 0
+        self.forward_seconds = 0.0
+        # None if not measured (cpu, or activations not computed by a module of their own)
+        self.peak_memory = None
+
+    def update(self, activations: torch.Tensor, forward_seconds: float, memory: int | None):
+        self.shape = tuple(activations.shape[1:])
+        self.batches += 1
+        self.samples += activations.shape[0]
+        self.bytes += activations.numel() * activations.element_size()
+        self.forward_seconds += forward_seconds
+        if memory is not None:
+            self.peak_memory = memory if self.peak_memory is None else max(self.peak_memory, memory)
+
+    def bytes_per_batch(self) -> float:
+        return self.bytes / max(self.batches, 1)
+
+    def to_dict(self) -> dict:
+        return {"layer": self.name,
+                "shape": "x".join(str(d) for d in self.shape) if self.shape is not None else "",
+                "batches": self.batches,
+                "samples": self.samples,
+                "bytes_per_batch": self.bytes_per_batch(),
+                "total_bytes": self.bytes,
+                "forward_seconds": self.forward_seconds,
+                "peak_memory_bytes": self.peak_memory,
+                }
+
+
+class ActivationsProfile:
+    '''
+    Per layer activation sizes, forward times and peak memory (cuda only) collected while evaluating a measure.
+    The time spent in the measure itself (reduction of the activations, data loading and transformations) is
+    only available for the whole evaluation, since the reduction runs in the measure's own threads; `eval_seconds`
+    is NaN if the evaluation was not timed.
+    '''
+    def __init__(self, layer_names: list[str]):
+        self.layers = [LayerProfile(n) for n in layer_names]
+        self.forward_seconds = 0.0
+        self.eval_seconds = math.nan
+        self.batches = 0
+
+    def reduction_seconds(self) -> float:
+        return max(self.eval_seconds - self.forward_seconds, 0.0) if not math.isnan(self.eval_seconds) else math.nan
+
+    def summary(self) -> dict:
+        memory = [l.peak_memory for l in self.layers if l.peak_memory is not None]
+        return {"batches": self.batches,
+                "eval_seconds": self.eval_seconds,
+                "forward_seconds": self.forward_seconds,
+                "reduction_seconds": self.reduction_seconds(),
+                "peak_memory_bytes": max(memory, default=None),
+                }
+
+    def save(self, path: Path):
+        '''
+        Writes the profile to `path` + .json (summary and layers) and `path` + .csv (layers only)
+        '''
+        path.parent.mkdir(exist_ok=True, parents=True)
+        rows = [l.to_dict() for l in self.layers]
+        fieldnames = list(LayerProfile("").to_dict().keys())
+        with open(path.parent / f"{path.name}.json", "w") as f:
+            json.dump({"summary": self.summary(), "layers": rows}, f, indent=2)
+        with open(path.parent / f"{path.name}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def __repr__(self):
+        s = self.summary()
+        return f"ActivationsProfile(layers={len(self.layers)},batches={s['batches']},eval={s['eval_seconds']:.2f}s,forward={s['forward_seconds']:.2f}s)"
+
+
+def leaf_modules(m: torch.nn.Module) -> list[torch.nn.Module]:
+    return [c for c in m.modules() if len(list(c.children())) == 0]
+
+
+class ProfiledActivationsModule(tm.pytorch.ActivationsModule):
+    '''
+    Wraps an ActivationsModule and records an ActivationsProfile for each call to forward_activations.
+    Leaf modules are timed with forward hooks; their outputs are matched, in execution order, with the activations
+    returned by the inner model, so that filtered models (FilteredActivationsModule) are supported as well.
+    Activations not produced directly by a leaf module (ie, the output of an Add) are recorded with zero forward time.
+    On cuda, the allocator's peak is reset before each leaf module, so each layer records the peak memory of its own forward.
+    '''
+    def __init__(self, inner_model: tm.pytorch.ActivationsModule):
+        super().__init__()
+        self.inner_model = inner_model
+        self.profile = ActivationsProfile(inner_model.activation_names())
+        self.executed = []
+        self.starts = {}
+        self.handles = []
+        for m in leaf_modules(inner_model):
+            self.handles.append(m.register_forward_pre_hook(self.start_hook))
+            self.handles.append(m.register_forward_hook(self.end_hook))
+
+    def start_hook(self, module, input):
+        if len(input) > 0 and isinstance(input[0], torch.Tensor):
+            synchronize(input[0])
+            reset_peak_memory(input[0])
+        self.starts[id(module)] = time.perf_counter()
+
+    def end_hook(self, module, input, output):
+        if not isinstance(output, torch.Tensor):
+            return
+        synchronize(output)
+        elapsed = time.perf_counter() - self.starts.pop(id(module))
+        self.executed.append((output.data_ptr(), output.shape, elapsed, peak_memory(output)))
+
+    def match_executed(self, activations: list[torch.Tensor]) -> list[tuple[float, int]]:
+        matched = []
+        j = 0
+        for a in activations:
+            k = j
+            while k < len(self.executed) and self.executed[k][:2] != (a.data_ptr(), a.shape):
+                k += 1
+            if k < len(self.executed):
+                matched.append(self.executed[k][2:])
+                j = k + 1
+            else:
+                matched.append((0.0, None))
+        return matched
+
+    def forward(self, x):
+        return self.inner_model.forward(x)
+
+    def forward_activations(self, x) -> list[torch.Tensor]:
+        self.executed = []
+        synchronize(x)
+        start = time.perf_counter()
+        activations = self.inner_model.forward_activations(x)
+        if len(activations) > 0:
+            synchronize(activations[-1])
+        self.profile.forward_seconds += time.perf_counter() - start
+        self.profile.batches += 1
+        for layer, a, (seconds, memory) in zip(self.profile.layers, activations, self.match_executed(activations)):
+            layer.update(a, seconds, memory)
+        self.executed = []
+        return activations
+
+    def activation_names(self) -> list[str]:
+        return self.inner_model.activation_names()
+
+    def eval(self):
+        self.inner_model.eval()
+        return self
+
+    def remove_hooks(self):
+        for h in self.handles:
+            h.remove()
+        self.handles = []
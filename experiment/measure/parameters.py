@@ -98,7 +98,21 @@ class PyTorchParameters:
     def __init__(self, model_id:str, dataset:DatasetParameters, transformations:tm.pytorch.PyTorchTransformationSet,
                  measure:tm.pytorch.PyTorchMeasure,options:tm.pytorch.PyTorchMeasureOptions,
                  adapt_dataset=False,
-                 stratified:bool=False,suffix=None,model_filter:tm.pytorch.model.ActivationFilter=non_filter):
+                 stratified:bool=False,suffix=None,model_filter:tm.pytorch.model.ActivationFilter=non_filter,
+                 activation_aggregation=None,precision=None,adaptive=None,block_statistics:int=None):
+        '''
+        :param activation_aggregation: a SpatialAggregation (experiments.models.util) applied to the feature maps
+        as they are captured, before they reach the measure. This is not equivalent to aggregating the result of the
+        measure (ie, a measure with ca_mean): the measure is computed on the spatial means of the feature maps
+        (variance of means), instead of averaging the measure of each spatial position (mean of variances).
+        Results have their own ids (tagged _capture_ca=).
+        :param precision: a PrecisionPolicy (experiment.measure.precision) for captured activations and stored results
+        :param adaptive: an AdaptiveSampling (experiment.measure.blocks); samples are measured in stratified blocks
+        until the estimates are precise enough, and the dataset size acts as the maximum
+        :param block_statistics: measure in stratified blocks of this many samples and keep the state of the measure
+        for each block with the result, to compute bootstrap confidence intervals afterwards (see experiment.measure.blocks).
+        The result is the same as without blocks. Only for variance measures and their quotients.
+        '''
         self.model_id=model_id
         self.dataset=dataset
         self.measure=measure
@@ -108,9 +122,26 @@ class PyTorchParameters:
         self.options=options
         self.adapt_dataset=adapt_dataset
         self.model_filter=model_filter
+        self.activation_aggregation=activation_aggregation
+        self.precision=precision
+        self.adaptive=adaptive
+        self.block_statistics=block_statistics
 
     def id(self):
         measure=self.measure.id()
+        aggregation = getattr(self, "activation_aggregation", None)
+        if aggregation is not None:
+            # not the same as the measure's own conv aggregation (see __init__), so it has a distinct tag
+            measure=f"{measure}_capture_ca={aggregation.value}"
+        precision = getattr(self, "precision", None)
+        if precision is not None and precision.id() != "c-s-":
+            measure=f"{measure}_p={precision.id()}"
+        adaptive = getattr(self, "adaptive", None)
+        if adaptive is not None:
+            measure=f"{measure}_{adaptive.id()}"
+        block_statistics = getattr(self, "block_statistics", None)
+        if block_statistics is not None:
+            measure=f"{measure}_blockstats={block_statistics}"
 
         if self.stratified:
             measure=f"Stratified({measure})"
@@ -126,9 +157,15 @@ class PyTorchParameters:
 
 
 class PyTorchMeasureExperimentResult:
-    def __init__(self, parameters:PyTorchParameters, measure_result: tm.pytorch.PyTorchMeasureResult):
+    def __init__(self, parameters:PyTorchParameters, measure_result: tm.pytorch.PyTorchMeasureResult,profile=None,samples:int=None,block_results=None):
         self.parameters=parameters
         self.measure_result=measure_result
+        # ActivationsProfile, only if the measure was evaluated with profiling enabled
+        self.profile=profile
+        # number of samples actually measured (with adaptive sampling it can be less than the dataset size)
+        self.samples=samples
+        # BlockResults, only if the parameters asked for block statistics
+        self.block_results=block_results
 
     def __repr__(self):
         return f"{PyTorchMeasureExperimentResult.__name__}({self.parameters})"
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import numpy as np
+import texttable
+import torch
+import tmeasures as tm
+
+dtype_abbreviations = {torch.float16: "f16", torch.bfloat16: "bf16", torch.float32: "f32", torch.float64: "f64"}
+# numpy has no bfloat16, so results can't be stored with it
+storage_dtypes = {torch.float16: np.float16, torch.float32: np.float32, torch.float64: np.float64}
+
+
+class PrecisionPolicy:
+    '''
+    Precision used by the measurement pipeline.
+    :param capture_dtype: activations are cast to this dtype as soon as they are captured, so that they are queued
+    and transported to the measure in reduced precision (None: keep the model's dtype). The statistics of the measures
+    are still accumulated in float64.
+    :param storage_dtype: per unit result arrays are stored with this dtype (None: keep the measure's dtype).
+    '''
+    def __init__(self, capture_dtype: torch.dtype = None, storage_dtype: torch.dtype = None):
+        assert storage_dtype is None or storage_dtype in storage_dtypes, f"Unsupported storage dtype {storage_dtype}"
+        self.capture_dtype = capture_dtype
+        self.storage_dtype = storage_dtype
+
+    def id(self):
+        capture = "-" if self.capture_dtype is None else dtype_abbreviations[self.capture_dtype]
+        storage = "-" if self.storage_dtype is None else dtype_abbreviations[self.storage_dtype]
+        return f"c{capture}s{storage}"
+
+    def store(self, result: tm.pytorch.PyTorchMeasureResult) -> tm.pytorch.PyTorchMeasureResult:
+        '''
+        Converts the layers of `result` (and of its partial results, for quotient measures) to the storage dtype, in place
+        '''
+        if self.storage_dtype is None:
+            return result
+        result.layers = [convert(l, self.storage_dtype) for l in result.layers]
+        for partial in ["x_result", "y_result"]:
+            if hasattr(result, partial):
+                self.store(getattr(result, partial))
+        return result
+
+    def __repr__(self):
+        return f"PrecisionPolicy(capture={self.capture_dtype},storage={self.storage_dtype})"
+
+
+def convert(layer, dtype: torch.dtype):
+    if isinstance(layer, torch.Tensor):
+        return layer.to(dtype)
+    # results already converted to numpy
+    return np.asarray(layer).astype(storage_dtypes[dtype])
+
+
+full_precision = PrecisionPolicy()
+half_precision = PrecisionPolicy(torch.float16, torch.float16)
+bfloat16_precision = PrecisionPolicy(torch.bfloat16, torch.float16)
+
+
+def as_numpy(layer) -> np.ndarray:
+    if isinstance(layer, torch.Tensor):
+        layer = layer.detach().cpu().double().numpy()
+    return np.asarray(layer, dtype=np.float64)
+
+
+def error_report(reference: tm.MeasureResult, result: tm.MeasureResult) -> list[dict]:
+    '''
+    Per layer error of `result` with respect to the full precision `reference`.
+    Relative errors are computed only for units where the reference is finite and non zero.
+    '''
+    rows = []
+    for name, r, x in zip(reference.layer_names, reference.layers, result.layers):
+        r, x = as_numpy(r), as_numpy(x)
+        valid = np.isfinite(r) & np.isfinite(x)
+        abs_error = np.abs(r[valid] - x[valid])
+        nonzero = np.abs(r[valid]) > 0
+        rel_error = abs_error[nonzero] / np.abs(r[valid][nonzero])
+        rows.append({"layer": name,
+                     "units": r.size,
+                     "max_abs_error": abs_error.max(initial=0),
+                     "max_rel_error": rel_error.max(initial=0),
+                     "mean_rel_error": rel_error.mean() if rel_error.size > 0 else 0.0,
+                     # units that are finite in only one of the results
+                     "mismatched": int((np.isfinite(r) != np.isfinite(x)).sum()),
+                     })
+    return rows
+
+
+def print_error_report(rows: list[dict]):
+    table = texttable.Texttable(max_width=160)
+    table.header(["layer", "units", "max abs error", "max rel error", "mean rel error", "non finite mismatches"])
+    for r in rows:
+        table.add_row([r["layer"], r["units"], f"{r['max_abs_error']:.2e}", f"{r['max_rel_error']:.2e}",
+                       f"{r['mean_rel_error']:.2e}", r["mismatched"]])
+    print(table.draw())
@@ -1,4 +1,6 @@
+import copy
 import os
+import time
 import typing
 
 import datasets
@@ -13,8 +15,12 @@ from experiments.tasks import train
 
 from utils.profiler import Profiler
 
-from .parameters import  Parameters,Options,DatasetParameters,MeasureExperimentResult,PyTorchParameters,PyTorchMeasureExperimentResult
+from .parameters import  Parameters,Options,DatasetParameters,MeasureExperimentResult,PyTorchParameters,PyTorchMeasureExperimentResult,DatasetSize,DatasetSizeFixed
+from .grid import TransformationGrid, eval_grid, interleave_classes
+from .blocks import eval_blocks
+from .input_cache import cached_inputs
 from .adapt import adapt_dataset
+from .instrumentation import ProfiledActivationsModule
 
 def experiment(p: Parameters, o: Options,model_path:Path):
     
@@ -84,11 +90,12 @@ def experiment(p: Parameters, o: Options,model_path:Path):
 
 
 
-from tmeasures.pytorch.model import FilteredActivationsModule
-
-def experiment_pytorch(p: PyTorchParameters,model_path:Path,verbose=False):
-    assert(len(p.transformations)>0)
+from experiments.models.util import TruncatedActivationsModule
 
+def prepare_measure(p: PyTorchParameters,model_path:Path,verbose=False):
+    '''
+    Loads the model of `p`, truncated to the layers of its filter, and the (full) dataset it is measured on
+    '''
     dataset = datasets.get_classification(p.dataset.name)
     if verbose:
         print(dataset.summary())
@@ -97,7 +104,9 @@ def experiment_pytorch(p: PyTorchParameters,model_path:Path,verbose=False):
 
     model, training_parameters, scores = train.load_model(model_path, p.options.model_device)
     
-    model = FilteredActivationsModule(model,p.model_filter)
+    # only compute the network up to the deepest layer observed by the filter
+    capture_dtype = None if p.precision is None else p.precision.capture_dtype
+    model = TruncatedActivationsModule(model,p.model_filter,aggregation=p.activation_aggregation,capture_dtype=capture_dtype)
 
     if training_parameters.dataset_name != p.dataset.name:
         if p.adapt_dataset:
@@ -116,40 +125,151 @@ def experiment_pytorch(p: PyTorchParameters,model_path:Path,verbose=False):
         for k,v in scores.items():
             print(f"{k} --→ {v:.3f}")
 
-    
-    from pytorch.numpy_dataset import NumpyDataset
+    return model, dataset
+
+
+def experiment_pytorch(p: PyTorchParameters,model_path:Path,verbose=False,profile=False,input_cache:Path=None,input_cache_max_bytes:int=64 * 2 ** 30):
+    '''
+    :param input_cache: folder of the transformed inputs cache (see experiment.measure.input_cache); None to transform them on the fly
+    '''
+    assert(len(p.transformations)>0)
+
+    model, dataset = prepare_measure(p, model_path, verbose=verbose)
+    if profile:
+        model = ProfiledActivationsModule(model)
+
+    adaptive = getattr(p, "adaptive", None)
     new_size = p.dataset.size.get_size(dataset.size(p.dataset.subset))
-    dataset = dataset.reduce_size_stratified_fixed(new_size,p.dataset.subset)
-    dataset.normalize_features()
+    if adaptive is not None and adaptive.max_samples is not None:
+        new_size = adaptive.max_samples
+    # only the measured samples (and the train samples of the normalization statistics) are copied
+    x,y = dataset.subset_stratified_fixed(new_size,p.dataset.subset,normalize=True)
 
-    x,y=dataset.get_subset(p.dataset.subset)
+    from pytorch.numpy_dataset import NumpyDataset
+    block_statistics = getattr(p, "block_statistics", None)
+    block_size = adaptive.block_size if adaptive is not None else block_statistics
+    assert block_size is None or not p.stratified, "Block evaluation is not supported for stratified measures"
+    if block_size is not None:
+        # every block of consecutive samples keeps the class proportions
+        x = x[interleave_classes(y.ravel())]
     numpy_dataset = NumpyDataset(x)
-
-    if not p.stratified:
+    transformations = p.transformations
+    if input_cache is not None and not p.stratified:
+        cached = cached_inputs(p, x, input_cache, input_cache_max_bytes, verbose=verbose)
+        if cached is not None:
+            numpy_dataset, transformations = cached
+    samples = len(numpy_dataset)
+    block_results = None
+
+    start = time.perf_counter()
+    if block_size is not None:
+        if verbose:
+            mode = f"adaptively ({adaptive})" if adaptive is not None else f"in blocks of {block_size}"
+            print(f"Calculating measure {p.measure} {mode}, at most {len(numpy_dataset)} samples...")
+        block_results = eval_blocks(p.measure, numpy_dataset, block_size, model, p.options, transformations, adaptive=adaptive, verbose=verbose)
+        measure_result = block_results.result()
+        samples = block_results.samples
+        if block_statistics is None:
+            block_results = None
+    elif not p.stratified:
         if verbose:
             print(f"Calculating measure {p.measure} dataset size {len(numpy_dataset)}...")
-        measure_result = p.measure.eval(numpy_dataset, p.transformations, model, p.options)
+        measure_result = p.measure.eval(numpy_dataset, transformations, model, p.options)
     else:
         if verbose:
             print(f"Calculating stratified version of measure {p.measure}...")
         stratified_numpy_datasets = numpy_dataset.stratify_dataset(y)
         measure_result = p.measure.eval_stratified(stratified_numpy_datasets,dataset.labels)
 
+    activations_profile = None
+    if profile:
+        model.remove_hooks()
+        activations_profile = model.profile
+        # stratified measures don't evaluate the profiled model, so their time is not comparable
+        if not p.stratified:
+            activations_profile.eval_seconds = time.perf_counter() - start
+        if verbose:
+            print(activations_profile)
+
+    if p.precision is not None:
+        measure_result = p.precision.store(measure_result)
+
     del model
     del dataset
     torch.cuda.empty_cache()
 
-    return PyTorchMeasureExperimentResult(p, measure_result)
+    return PyTorchMeasureExperimentResult(p, measure_result, profile=activations_profile, samples=samples, block_results=block_results)
 
 
-def main_pytorch(p:PyTorchParameters,model_path:Path,verbose=False)->MeasureExperimentResult:
+def main_pytorch(p:PyTorchParameters,model_path:Path,verbose=False,profile=False,input_cache:Path=None,input_cache_max_bytes:int=64 * 2 ** 30)->MeasureExperimentResult:
     profiler= Profiler()
     profiler.event("start")
     
     if verbose:
         print(f"Experimenting with parameters: {p}")
-    measures_results=experiment_pytorch(p,model_path,verbose=verbose)
+    measures_results=experiment_pytorch(p,model_path,verbose=verbose,profile=profile,input_cache=input_cache,input_cache_max_bytes=input_cache_max_bytes)
     profiler.event("end")
     print(profiler.summary(human=True))
     # config.save_experiment_results(measures_results)
-    return measures_results
\ No newline at end of file
+    return measures_results
+
+
+def grid_parameters(p: PyTorchParameters, dataset_sizes: list, transformation_sets: list) -> list[list[PyTorchParameters]]:
+    '''
+    Parameters of each cell of a measure grid; they are marked with the `grid` suffix since their samples are
+    prefixes of the largest one and not independent stratified subsets.
+    :param dataset_sizes: DatasetSize objects, or ints for fixed sizes
+    '''
+    suffix = "grid" if p.suffix is None else f"{p.suffix}_grid"
+    ps = []
+    for size in dataset_sizes:
+        size = size if isinstance(size, DatasetSize) else DatasetSizeFixed(size)
+        p_dataset = DatasetParameters(p.dataset.name, p.dataset.subset, size)
+        row = []
+        for transformations in transformation_sets:
+            cell = copy.copy(p)
+            cell.dataset, cell.transformations, cell.suffix = p_dataset, transformations, suffix
+            row.append(cell)
+        ps.append(row)
+    return ps
+
+
+def experiment_pytorch_grid(p: PyTorchParameters, dataset_sizes: list, transformation_sets: list, model_path: Path, verbose=False) -> list[list[PyTorchMeasureExperimentResult]]:
+    '''
+    Evaluates the measure of `p` for every combination of dataset size and transformation set in a single pass
+    over the largest sample and the union of the transformation sets (see experiment.measure.grid).
+    The samples are ordered by a fixed stratified permutation, so that the sample of each size is a prefix of the larger ones.
+    The dataset size of `p` is ignored.
+    :param dataset_sizes: DatasetSize objects, or ints for fixed sizes
+    :return: results[i][j] for dataset_sizes[i] and transformation_sets[j]
+    '''
+    from pytorch.numpy_dataset import NumpyDataset
+    ps = grid_parameters(p, dataset_sizes, transformation_sets)
+    model, dataset = prepare_measure(p, model_path, verbose=verbose)
+
+    original_size = dataset.size(p.dataset.subset)
+    sample_sizes = [row[0].dataset.size.get_size(original_size) for row in ps]
+    x,y = dataset.subset_stratified_fixed(max(sample_sizes), p.dataset.subset, normalize=True)
+    # the stratified reduction may leave slightly fewer samples than requested
+    sample_sizes = [min(n, len(x)) for n in sample_sizes]
+    sizes = sorted(set(sample_sizes))
+    # order the samples so that every prefix keeps the class proportions
+    order = interleave_classes(y.ravel())[:sizes[-1]]
+    numpy_dataset = NumpyDataset(x[order])
+
+    grid = TransformationGrid(transformation_sets)
+    if verbose:
+        print(f"Calculating measure {p.measure} for sample sizes {sizes} and {len(grid)} transformation sets ({len(grid.union)} transformations)...")
+    results = eval_grid(p.measure, numpy_dataset, sizes, grid, model, p.options)
+
+    experiment_results = []
+    for row_ps, sample_size in zip(ps, sample_sizes):
+        row = results[sizes.index(sample_size)]
+        if p.precision is not None:
+            row = [p.precision.store(r) for r in row]
+        experiment_results.append([PyTorchMeasureExperimentResult(cell, r, samples=sample_size) for cell, r in zip(row_ps, row)])
+
+    del model
+    del dataset
+    torch.cuda.empty_cache()
+    return experiment_results
@@ -1,2 +1,10 @@
 from .base import Experiment
-from .tm_experiment import TMExperiment
\ No newline at end of file
+
+
+def __getattr__(name):
+    # TMExperiment imports torch, tmeasures and matplotlib; only load them when it is used,
+    # so that listing experiments (see registry.py) stays fast
+    if name == "TMExperiment":
+        from .tm_experiment import TMExperiment
+        return TMExperiment
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
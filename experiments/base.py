@@ -6,13 +6,29 @@ from datetime import datetime
 import texttable
 import os
 import argparse,argcomplete
+import multiprocessing
+import typing
 
+from .runner import JobError, JobFailure, JobLimits
+
+if typing.TYPE_CHECKING:
+    from .registry import ExperimentRegistry, ExperimentEntry
 
 
 class Options:
-    def __init__(self, show_list: bool, force: bool):
+    def __init__(self, show_list: bool, force: bool, profile: bool = False, isolate_jobs: bool = False,
+                 job_limits: JobLimits = None, job_retries: int = 1, prerender: bool = False, prerender_max_bytes: int = None,
+                 input_cache: bool = False, input_cache_max_bytes: int = None):
         self.show_list = show_list
         self.force = force
+        self.profile = profile
+        self.isolate_jobs = isolate_jobs
+        self.job_limits = JobLimits() if job_limits is None else job_limits
+        self.job_retries = job_retries
+        self.prerender = prerender
+        self.prerender_max_bytes = prerender_max_bytes
+        self.input_cache = input_cache
+        self.input_cache_max_bytes = input_cache_max_bytes
 
 class Experiment(abc.ABC):
 
@@ -35,7 +51,15 @@ class Experiment(abc.ABC):
         if not self.has_finished() or force:
             self.mark_as_unfinished()
             print(f"[{dt_started_string}] {stars} Running experiment {self.id()}  {stars}")
-            self.run()
+            try:
+                self.run()
+            except JobError as e:
+                # a job failed even after retrying; leave the experiment unfinished and continue with the next one
+                self.print_date(f"Experiment {self.id()} failed, job {e}")
+                return
+            finally:
+                self.close_jobs()
+            self.render_plots()
 
             # time elapsed and finished
             dt_finished = datetime.now()
@@ -71,43 +95,61 @@ class Experiment(abc.ABC):
     def run(self):
         pass
 
+    def close_jobs(self):
+        '''
+        Stops the worker processes used to run the jobs of the experiment, if any
+        '''
+        pass
+
+    def render_plots(self):
+        '''
+        Renders the figures queued during `run`, if the experiment queues them
+        '''
+        pass
+
     @abc.abstractmethod
     def description(self) -> str:
         pass
 
     def experiment_fork(self, message, function):
+        '''
+        Runs `function` in a forked process and waits for it.
+        :raises JobError: if the process fails
+        '''
         self.print_date(message)
-        new_pid = os.fork()
-        if new_pid == 0:
-            function()
-            sys.exit(0)
-        else:
-            pid, status = os.waitpid(0, 0)
-            if status != 0:
-                self.print_date(f" Error in: {message}")
-                sys.exit(status)
+        start = datetime.now()
+        process = multiprocessing.get_context("fork").Process(target=function)
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            elapsed = (datetime.now() - start).total_seconds()
+            failure = JobFailure(message, "crash", 1, elapsed, exitcode=process.exitcode)
+            self.print_date(f" Error in: {message}")
+            raise JobError([failure])
     @classmethod
-    def print_table(cls, experiments: list['Experiment']):
-        table = texttable.Texttable()
-        header = ["Experiment", "Finished"]
+    def print_table(cls, experiments: list[ExperimentEntry]):
+        table = texttable.Texttable(max_width=120)
+        header = ["Experiment", "Group", "Finished", "Description"]
         table.header(header)
-        experiments.sort(key=lambda e: e.__class__.__name__)
+        experiments.sort(key=lambda e: e.id())
         for e in experiments:
             status = "Y" if e.has_finished() else "N"
-            name = e.__class__.__name__
+            name = e.id()
             name = name[:40]
-            table.add_row((name, status))
+            table.add_row((name, e.group, status, e.description()))
             # print(f"{name:40}     {status}")
         print(table.draw())
 
     @classmethod
-    def parse_args(cls, experiments: Dict[str, list[Experiment]]) -> tuple[list[Experiment], Options]:
+    def parse_args(cls, experiments: ExperimentRegistry) -> tuple[list[ExperimentEntry], Options]:
+        '''
+        :return: the registry entries of the selected experiments (see ExperimentEntry.create) and the options
+        '''
         parser = argparse.ArgumentParser(description="Run invariance with transformation measures.")
-        group_names = list(experiments.keys())
+        group_names = list(experiments.groups.keys())
 
-        experiments_plain = [e for g in experiments.values() for e in g]
-        experiment_names = [e.id() for e in experiments_plain]
-        experiment_dict = dict(zip(experiment_names, experiments_plain))
+        experiments_plain = experiments.entries()
+        experiment_names = experiments.names()
 
         parser.add_argument('-experiment',
                             help=f'Choose an experiment to run',
@@ -125,6 +167,33 @@ class Experiment(abc.ABC):
         parser.add_argument('-list',
                             help=f'List invariance and status',
                             action="store_true")
+        parser.add_argument('-profile',
+                            help=f'Write a per layer profile (activation shapes, bytes, times and peak memory) next to each new measure result',
+                            action="store_true")
+        parser.add_argument('-isolate',
+                            help=f'Run each training and measure job in a separate worker process',
+                            action="store_true")
+        parser.add_argument('-job_memory',
+                            help=f'Memory limit of the worker process in GB (only with -isolate)',
+                            type=float, default=None)
+        parser.add_argument('-job_time',
+                            help=f'Time limit of each job in hours (only with -isolate)',
+                            type=float, default=None)
+        parser.add_argument('-job_retries',
+                            help=f'Times a failed job is retried (only with -isolate)',
+                            type=int, default=1)
+        parser.add_argument('-prerender',
+                            help=f'Train with datasets prerendered with every transformation of the training set, when they fit in -prerender_disk',
+                            action="store_true")
+        parser.add_argument('-prerender_disk',
+                            help=f'Disk space available for each prerendered dataset (train and test) in GB (only with -prerender)',
+                            type=float, default=32)
+        parser.add_argument('-input_cache',
+                            help=f'Store the transformed inputs of the measures on disk, and reuse them for other models measured with the same dataset and transformations',
+                            action="store_true")
+        parser.add_argument('-input_cache_disk',
+                            help=f'Disk space available for the transformed inputs in GB; the least recently used are deleted when it is exceeded (only with -input_cache)',
+                            type=float, default=64)
 
         argcomplete.autocomplete(parser)
         args = parser.parse_args()
@@ -132,9 +201,15 @@ class Experiment(abc.ABC):
             sys.exit("Cant specify both experiment and experiment group")
         selected_experiments = experiments_plain
         if not args.experiment is None:
-            selected_experiments = [experiment_dict[args.experiment]]
+            selected_experiments = [experiments[args.experiment]]
         if not args.group is None:
-            selected_experiments = experiments[args.group]
-
-        return selected_experiments, Options(args.list, args.force)
+            selected_experiments = experiments.groups[args.group]
+
+        memory = None if args.job_memory is None else int(args.job_memory * 2 ** 30)
+        time = None if args.job_time is None else args.job_time * 3600
+        job_limits = JobLimits(memory, time)
+        prerender_max_bytes = int(args.prerender_disk * 2 ** 30)
+        input_cache_max_bytes = int(args.input_cache_disk * 2 ** 30)
+        return selected_experiments, Options(args.list, args.force, args.profile, args.isolate, job_limits, args.job_retries,
+                                             args.prerender, prerender_max_bytes, args.input_cache, input_cache_max_bytes)
 
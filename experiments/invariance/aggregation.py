@@ -40,8 +40,7 @@ class AggregationBeforeAfter(InvarianceExperiment):
             all_results = normal_results + ca_none_results
             labels = [f"{l.aggregation}: {ca.f}, {l.after_normalization}." for ca in before_functions] + [
                 f"{l.aggregation}: {ca.f}, {l.before_normalization}." for ca in after_functions ]
-            tmv.plot_collapsing_layers_same_model(all_results, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_collapsing_layers_same_model, all_results, labels=labels)
 
 
 
@@ -74,8 +73,7 @@ class AggregationFunctionsVariance(InvarianceExperiment):
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             labels = [f"{l.aggregation}: {l.format_aggregation(ca.f)}, {l.before_normalization}." for ca in before_functions]
 
-            tmv.plot_collapsing_layers_same_model(results, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_collapsing_layers_same_model, results, labels=labels)
 
 
 class AggregationFunctionsDistance(InvarianceExperiment):
@@ -111,5 +109,4 @@ class AggregationFunctionsDistance(InvarianceExperiment):
             experiment_name = f"{model_config.name}_{dataset}_{transformation.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
 
-            tmv.plot_collapsing_layers_same_model(results, plot_filepath, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_collapsing_layers_same_model, results, plot_filepath, labels=labels)
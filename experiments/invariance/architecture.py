@@ -31,16 +31,14 @@ class BatchNormalization(InvarianceExperiment):
             # single
             experiment_name = f"{model_config.name}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
-            tmv.plot_average_activations_same_model([bn_result],  mark_layers=bn_indices)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, [bn_result],  mark_layers=bn_indices)
 
             # comparison
             experiment_name = f"{model_config.name}_{dataset}_{transformation.id()}_{measure.id()}_comparison"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             bn_result = bn_result.remove_layers(bn_indices)
             labels = [l.with_bn,l.without_bn]
-            tmv.plot_average_activations_same_model([bn_result, result], labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, [bn_result, result], labels=labels,ylim=get_ylim_normalized(measure))
 
 
 class ActivationFunctionComparison(InvarianceExperiment):
@@ -66,8 +64,7 @@ class ActivationFunctionComparison(InvarianceExperiment):
             experiment_name = f"{SimpleConvConfig.__name__}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             labels = [a.value for a in activation_functions]
-            tmv.plot_average_activations_same_model(results, labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels,ylim=get_ylim_normalized(measure))
 
 
 class KernelSize(InvarianceExperiment):
@@ -93,8 +90,7 @@ class KernelSize(InvarianceExperiment):
             experiment_name = f"{SimpleConvConfig.__name__}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             labels = [f"k={k}" for k in kernel_sizes]
-            tmv.plot_collapsing_layers_same_model(results, labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_collapsing_layers_same_model, results, labels=labels,ylim=get_ylim_normalized(measure))
 
 
 class MaxPooling(InvarianceExperiment):
@@ -121,6 +117,5 @@ class MaxPooling(InvarianceExperiment):
             experiment_name = f"{SimpleConvConfig.__name__}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             labels = [l.maxpooling,l.strided_convolution]
-            tmv.plot_collapsing_layers_same_model(results, plot_filepath, labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_collapsing_layers_same_model, results, plot_filepath, labels=labels,ylim=get_ylim_normalized(measure))
 
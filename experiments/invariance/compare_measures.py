@@ -5,7 +5,6 @@ import tmeasures.visualization as tmv
 
 
 class MeasureCorrelationWithTransformation(InvarianceExperiment):
-
     def description(self):
         return """Train models M1, M2, Mn with transformation of scales X1,X2,..Xn respectively and then test all models with scale Xn, where Xi<Xi+1. Ie, train with rotations of 0, 30, 60, 90,.. 360 degrees, and then test with rotations of 360 degrees. """
 
@@ -51,8 +50,7 @@ class MeasureCorrelationWithTransformation(InvarianceExperiment):
                 experiment_name = f"{mc.id()}_{dataset}_{measure.id()}_{test_transformation.id()}"
                 plot_filepath = self.folderpath / f"{experiment_name}.jpg"
                 #title = f" transformation: {train_transformation.id()}"
-                tmv.plot_average_activations_same_model(results, labels=set_labels,ylim=1.4)
-                self.savefig(plot_filepath)
+                self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=set_labels,ylim=1.4)
 
 
 class InvarianceMeasureCorrelation(InvarianceExperiment):
@@ -117,8 +115,7 @@ class InvarianceMeasureCorrelation(InvarianceExperiment):
             colors = np.vstack([color, color])
             linestyles = ["--" for i in range(n)] + ["-" for i in range(n)]
             # ylim = self.get_ylim(measure_set_name, dataset)
-            tmv.plot_average_activations_same_model(results, labels=labels,linestyles=linestyles,colors=colors)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels,linestyles=linestyles,colors=colors)
             #TODO also plot conv only
 
     # def get_ylim(self, measure_set_name, dataset):
@@ -206,8 +203,7 @@ class CompareMeasures(InvarianceExperiment):
             colors = np.vstack([color, color])
       #      linestyles = ["--" for i in range(n)] + ["-" for i in range(n)]
             ylim = self.get_ylim(measure_set_name, dataset)
-            tmv.plot_average_activations_same_model(results,  labels=labels, ylim=ylim)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results,  labels=labels, ylim=ylim)
 
     def get_ylim(self, measure_set_name, dataset):
         if measure_set_name == "Distance":
@@ -246,8 +242,7 @@ class CompareGoodfellowAlpha(InvarianceExperiment):
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             results = self.load_measure_results(self.results_paths(variance_parameters))
             labels = [f"α={alpha}" for alpha in alphas]
-            tmv.plot_average_activations_same_model(results, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels)
 
 
 class CompareGoodfellow(InvarianceExperiment):
@@ -270,8 +265,7 @@ class CompareGoodfellow(InvarianceExperiment):
             local_result, global_result = result.extra_values[tm.GoodfellowNormalInvariance.l_key], result.extra_values[
                 tm.GoodfellowNormalInvariance.g_key]
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
-            tmv.plot_average_activations_same_model([local_result, global_result], labels=labels, ylim=0.1)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, [local_result, global_result], labels=labels, ylim=0.1)
 
 
 
@@ -303,8 +297,7 @@ class CompareSameEquivarianceSimple(InvarianceExperiment):
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             results = self.load_measure_results(self.results_paths(variance_parameters))
 
-            tmv.plot_average_activations_same_model(results, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels)
             
 class CompareSameEquivariance(InvarianceExperiment):
 
@@ -330,8 +323,7 @@ class CompareSameEquivariance(InvarianceExperiment):
             transformation_results=normalized_results.extra_values[tm.NormalizedVarianceSameEquivariance.transformation_key]
             sample_results=normalized_results.extra_values[tm.NormalizedVarianceSameEquivariance.sample_key]
             results=[transformation_results,sample_results]
-            tmv.plot_average_activations_same_model(results, labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels)
 
 
 
@@ -385,5 +377,4 @@ class DistanceApproximation(InvarianceExperiment):
             colors = np.vstack([color])
             linestyles = ["--"] + ["-" for b in batch_sizes]
 
-            tmv.plot_average_activations_same_model(results, labels=labels,linestyles=linestyles,colors=colors)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels,linestyles=linestyles,colors=colors)
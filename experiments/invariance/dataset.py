@@ -9,7 +9,7 @@ class DatasetSize(InvarianceExperiment):
         return '''Vary the test dataset size and see how it affects the numpy's value. That is, vary the size of the dataset used to compute the invariance (not the training dataset) and see how it affects the calculation of the numpy.'''
 
     def run(self):
-        dataset_percentages = [0.01, 0.05] #, 0.1, 0.5, 1.0]
+        dataset_percentages = [0.01, 0.05, 0.1, 0.5, 1.0]
         model_names = simple_models_generators
         measures = normalized_measures_validation
         combinations = list(itertools.product(
@@ -18,11 +18,11 @@ class DatasetSize(InvarianceExperiment):
         for i, (model, dataset, transformation, measure) in enumerate(combinations):
             
             mc,tc,p,model_path = self.train_default(Task.Classification,dataset,transformation,model)
-            results = []
-            for p in dataset_percentages:
-                result = self.measure_default(dataset,mc.id(),model_path,transformation,measure,default_measure_options,DatasetSizePercentage(p))
-                
-                results.append(result)
+            # all percentages are measured in one pass, the smaller samples being prefixes of the larger ones
+            sizes = [DatasetSizePercentage(p) for p in dataset_percentages]
+            p_dataset = DatasetParameters(dataset, default_subset, sizes[-1])
+            mp = PyTorchParameters(mc.id(), p_dataset, transformation, measure, default_measure_options)
+            results = [r.numpy() for r in self.measure_sweep(model_path, mp, sizes)]
 
             labels = [f"{d * 100:2}%" for d in dataset_percentages]
             experiment_name = f"{mc.id()}_{dataset}_{transformation.id()}_{measure.id()}"
@@ -33,8 +33,7 @@ class DatasetSize(InvarianceExperiment):
             values.reverse()
             colors = tmv.get_sequential_colors(values)
             
-            tmv.plot_average_activations_same_model(results, colors=colors,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, colors=colors,ylim=get_ylim_normalized(measure))
 
 
 
@@ -63,8 +62,7 @@ class DatasetSubset(InvarianceExperiment):
             labels = [f"{l.format_subset(subset)}" for subset in dataset_subsets]
             experiment_name = f"{mc.id()}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
-            tmv.plot_average_activations_same_model(results, labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels,ylim=get_ylim_normalized(measure))
 
 
 class DatasetTransfer(InvarianceExperiment):
@@ -102,5 +100,4 @@ class DatasetTransfer(InvarianceExperiment):
             experiment_name = f"{mc.id()}_{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             labels = dataset_names
-            tmv.plot_average_activations_same_model(results, labels=labels,ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels,ylim=get_ylim_normalized(measure))
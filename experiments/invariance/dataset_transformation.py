@@ -41,18 +41,16 @@ class TransformationSampleSizes(InvarianceExperiment):
             results = np.empty((s_n, t_n), dtype=tm.pytorch.PyTorchMeasureResult)
             experiment_name = f"{mc.id()}_{dataset}_{train_transformation.id()}_{measure}"
 
-            for i, sample_size in enumerate(sample_sizes):
-                p_dataset = DatasetParameters(dataset, default_subset, DatasetSizeFixed(sample_size))
-                for j, transformation in enumerate(test_transformations):
-                    mp = PyTorchParameters(mc.id(), p_dataset, transformation, measure, default_measure_options)
-                    results[i, j] = self.measure(model_path, mp, verbose=False).numpy()
-
-                # PLOT
-                
+            # all cells are measured in one pass over the largest sample and transformation sets
+            p_dataset = DatasetParameters(dataset, default_subset, DatasetSizeFixed(sample_sizes[-1]))
+            mp = PyTorchParameters(mc.id(), p_dataset, test_transformations[-1], measure, default_measure_options)
+            grid = self.measure_grid(model_path, mp, sample_sizes, test_transformations, verbose=False)
+            for i, j in itertools.product(range(s_n), range(t_n)):
+                results[i, j] = grid[i][j].numpy()
+
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
 
             labels_transformations = [f"{len(ts)}" for ts in test_transformations]
             heatmap = tmv.get_relative_errors(results, results[-1, -1])
-            tmv.plot_relative_error_heatmap(heatmap, labels_samples,labels_transformations)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_relative_error_heatmap, heatmap, labels_samples,labels_transformations)
                 
\ No newline at end of file
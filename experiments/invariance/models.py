@@ -39,8 +39,7 @@ class TrainModels(InvarianceExperiment):
                 
             experiment_name = f"{dataset}_{model_config_generator}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
-            accuracies.plot_metrics_single_model( transformation_scores, transformation_labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, accuracies.plot_metrics_single_model, transformation_scores, transformation_labels)
 
 class SimpleConvAccuracies(InvarianceExperiment):
     def description(self):
@@ -101,8 +100,7 @@ class ModelAccuracies(InvarianceExperiment):
             experiment_name = f"{dataset}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             transformation_scores = np.array(transformation_scores)
-            accuracies.plot_accuracies(transformation_scores, transformation_labels, model_names)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, accuracies.plot_accuracies, transformation_scores, transformation_labels, model_names)
 
 
 class CompareModels(InvarianceExperiment):
@@ -144,9 +142,8 @@ class CompareModels(InvarianceExperiment):
             experiment_name = f"{dataset}_{transformation.id()}_{measure.id()}"
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
             results = self.load_measure_results(self.results_paths(variance_parameters))
-            tmv.plot_average_activations_different_models(results, labels=model_names,
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_different_models, results, labels=model_names,
                                                                   markers=self.fc_layers_indices(results),ylim=get_ylim_normalized(measure))
-            self.savefig(plot_filepath)
 
     def fc_layers_indices(self, results: list[tm.MeasureResult]) -> list[list[int]]:
         indices = []
@@ -42,8 +42,7 @@ class TransformationSetSize(InvarianceExperiment):
                 experiment_name = f"{mc.id()}_{dataset}_{measure.id()}_{train_transformation.id()}"
                 plot_filepath = self.folderpath / f"{experiment_name}.jpg"
                 
-                tmv.plot_average_activations_same_model(results,  labels=set_labels,ylim=1.4)
-                self.savefig(plot_filepath)
+                self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results,  labels=set_labels,ylim=1.4)
 
 
 
@@ -94,8 +93,7 @@ class TransformationComplexity(InvarianceExperiment):
                 plot_filepath = self.folderpath / f"{experiment_name}.jpg"
                 
 
-                tmv.plot_average_activations_same_model(results, labels=set_labels,ylim=1.4)
-                self.savefig(plot_filepath)
+                self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=set_labels,ylim=1.4)
 
 
 # class TransformationComplexityDetailed(Experiment):
@@ -146,7 +144,6 @@ class TransformationComplexity(InvarianceExperiment):
 
 
 class TransformationDiversity(InvarianceExperiment):
-
     def description(self):
         return '''Vary the type of transformation both when training and computing the numpy, and see how it affects the invariance. For example, train with rotations, then test with translations. Train with translations, test with scales, and so on. '''
 
@@ -170,6 +167,5 @@ class TransformationDiversity(InvarianceExperiment):
                 experiment_name = f"{mc.id()}_{dataset}_{train_transformation}_{measure.id()}"
                 plot_filepath = self.folderpath / f"{experiment_name}.jpg"
                 # title = f"Train transformation: {train_transformation.id()}"
-                tmv.plot_average_activations_same_model(results, labels=labels)
-                self.savefig(plot_filepath)
+                self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, labels=labels)
 
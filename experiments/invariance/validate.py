@@ -25,7 +25,5 @@ class VisualizeMeasures(InvarianceExperiment):
             bylayer_filepath = self.folderpath / f"{experiment_name}_bylayer.jpg"
             heatmap_filepath = self.folderpath / f"{experiment_name}_heatmap.jpg"
 
-            tmv.plot_average_activations_same_model([result], )
-            self.savefig(bylayer_filepath)
-            tmv.plot_heatmap(result)
-            self.savefig(heatmap_filepath)
\ No newline at end of file
+            self.queue_plot(bylayer_filepath, tmv.plot_average_activations_same_model, [result])
+            self.queue_plot(heatmap_filepath, tmv.plot_heatmap, result)
\ No newline at end of file
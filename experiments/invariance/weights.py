@@ -2,6 +2,7 @@ from torch import save
 
 from .common import *
 import experiment.measure as measure_package
+from ..visualization.intervals import plot_average_activations_intervals
 import datasets
 
 class RandomWeights(InvarianceExperiment):
@@ -22,6 +23,7 @@ class RandomWeights(InvarianceExperiment):
         for model_config_generator, dataset, transformations, measure in combinations:
             mc: train.ModelConfig = model_config_generator.for_dataset(task,dataset)
             results = []
+            intervals = []
             for i in range(random_model_n):
                 suffix = f"random_weight{i:03}"
                 tc,metric = self.get_train_config(mc,dataset,task,transformations,suffix=suffix,savepoints=False,epochs=0)
@@ -30,8 +32,10 @@ class RandomWeights(InvarianceExperiment):
                 model_path = self.model_path_new(p)
                 
 
-                result = self.measure_default(dataset,mc.id()+suffix,model_path,transformations,measure,default_measure_options,default_dataset_percentage)
+                result, mp = self.measure_default(dataset,mc.id()+suffix,model_path,transformations,measure,default_measure_options,default_dataset_percentage,return_parameters=True)
                 results.append(result)
+                if mp.block_statistics is not None:
+                    intervals.append(self.layer_intervals(mp))
 
             # plot results
             experiment_name = f"{mc.id()}_{dataset}_{transformations.id()}_{measure}"
@@ -43,11 +47,12 @@ class RandomWeights(InvarianceExperiment):
             import matplotlib.pyplot as plt
             color = plt.cm.hsv(np.linspace(0.1, 0.9, n))
             color[:, 3] = 0.5
-            tmv.plot_average_activations_same_model(results, plot_mean=True, labels=labels,colors=color,plot_p_values=True)
-            self.savefig(plot_filepath)
-            tmv.scatter_same_model(results,colors=color)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, plot_mean=True, labels=labels,colors=color,plot_p_values=True)
             plot_filepath = self.folderpath / f"{experiment_name}_scatter.jpg"
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.scatter_same_model, results, colors=color)
+            if len(intervals) > 0:
+                plot_filepath = self.folderpath / f"{experiment_name}_intervals.jpg"
+                self.queue_plot(plot_filepath, plot_average_activations_intervals, intervals, colors=color)
 
 
 class DuringTraining(InvarianceExperiment):
@@ -129,6 +134,7 @@ class RandomInitialization(InvarianceExperiment):
         for model_config_generator, dataset, transformations, measure in combinations:
             mc: train.ModelConfig = model_config_generator.for_dataset(task,dataset)
             results = []
+            intervals = []
             for i in range(random_model_n):
                 suffix = f"random{i:03}"
                 tc,metric = self.get_train_config(mc,dataset,task,transformations,suffix=suffix,savepoints=False)
@@ -136,8 +142,10 @@ class RandomInitialization(InvarianceExperiment):
                 self.train(p)
                 model_path = self.model_path_new(p)
 
-                result = self.measure_default(dataset,mc.id()+suffix,model_path,transformations,measure,default_measure_options,default_dataset_percentage)
+                result, mp = self.measure_default(dataset,mc.id()+suffix,model_path,transformations,measure,default_measure_options,default_dataset_percentage,return_parameters=True)
                 results.append(result)
+                if mp.block_statistics is not None:
+                    intervals.append(self.layer_intervals(mp))
 
             # plot results
             experiment_name = f"{mc.id()}_{dataset}_{transformations.id()}_{measure}"
@@ -154,8 +162,9 @@ class RandomInitialization(InvarianceExperiment):
             # percentage_p = (p_value<alpha).mean()
             # print(f"{experiment_name}: p_value {percentage_p}")
             # plt.annotate(f"Percentage of layers with different means:{percentage_p:.2f}", (100,100))
-            tmv.plot_average_activations_same_model(results, plot_mean=True, labels=labels,colors=color,plot_p_values=True)
-            self.savefig(plot_filepath)
-            tmv.scatter_same_model(results,colors=color)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results, plot_mean=True, labels=labels,colors=color,plot_p_values=True)
             plot_filepath = self.folderpath / f"{experiment_name}_scatter.jpg"
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.scatter_same_model, results, colors=color)
+            if len(intervals) > 0:
+                plot_filepath = self.folderpath / f"{experiment_name}_intervals.jpg"
+                self.queue_plot(plot_filepath, plot_average_activations_intervals, intervals, colors=color)
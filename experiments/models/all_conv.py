@@ -4,6 +4,7 @@ import numpy as np
 from .util import SequentialWithIntermediates, task_to_head
 from tmeasures.pytorch import ActivationsModule
 import tmeasures as tm
+import datasets
 
 from ..tasks import Task
 from ..tasks.train import ModelConfig
@@ -15,7 +16,7 @@ class AllConvolutionalConfig(ModelConfig):
     @classmethod
     def for_dataset(cls,task:Task,dataset:str,bn:bool=False,dropout=False):        
         filters = {"mnist": 32, "cifar10": 96, "fashion_mnist": 96,"lsa16":32,"rwth":96}
-        return AllConvolutionalConfig(task,filters=filters[dataset],bn=bn,dropout=dropout)
+        return AllConvolutionalConfig(task,filters=filters[datasets.base_name(dataset)],bn=bn,dropout=dropout)
 
     def epochs(self,dataset:str,task:Task,transformations:tm.TransformationSet):
         
@@ -25,7 +26,7 @@ class AllConvolutionalConfig(ModelConfig):
             epochs_dataset = {'cifar10': 30, 'mnist': 15, 'fashion_mnist': 12, "lsa16": 25, "rwth": 10}
         else:
             raise ValueError(task)
-        epochs = epochs_dataset[dataset]
+        epochs = epochs_dataset[datasets.base_name(dataset)]
         epochs = self.scale_by_transformations(epochs,transformations)
         return epochs
     
@@ -69,6 +70,9 @@ class ConvBNAct(ActivationsModule):
 
     def forward_activations(self,x):
         return self.model.forward_activations(x)
+
+    def iter_activations(self,x):
+        return self.model.iter_activations(x)
     def activation_names(self)->list[str]:
         return self.model.activation_names()
 
@@ -112,6 +116,9 @@ class AllConvolutional( ActivationsModule):
     def forward_activations(self, x):
         return self.layers.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.layers.iter_activations(x)
+
     def activation_names(self)->list[str]:
         return self.layers.activation_names()
 
@@ -4,6 +4,7 @@ import numpy as np
 from tmeasures.pytorch import ActivationsModule
 from .util import SequentialWithIntermediates,Flatten,Add,GlobalAvgPool2d,task_to_head
 import tmeasures as tm
+import datasets
 
 from ..tasks import Task
 from ..tasks.train import ModelConfig
@@ -24,7 +25,7 @@ class ResNetConfig(ModelConfig):
 
     @classmethod
     def for_dataset(cls,task:Task,dataset:str,bn:bool=False,):
-        if dataset == "cifar10":
+        if datasets.base_name(dataset) == "cifar10":
             v = 32
         else:
             v = 18
@@ -38,7 +39,7 @@ class ResNetConfig(ModelConfig):
             epochs_dataset = {'cifar10': 40, 'mnist': 7, 'fashion_mnist': 12,"lsa16":20,"rwth":20}
         else:
             raise ValueError(task)
-        epochs = epochs_dataset[dataset]
+        epochs = epochs_dataset[datasets.base_name(dataset)]
         epochs = self.scale_by_transformations(epochs,transformations)
         return epochs
 
@@ -89,6 +90,9 @@ class Block(ActivationsModule):
     def forward_activations(self,x):
         return self.add.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.add.iter_activations(x)
+
     def activation_names(self)->list[str]:
         return self.add.activation_names()
 
@@ -132,6 +136,9 @@ class Bottleneck(ActivationsModule):
     def forward_activations(self,x):
         return self.add.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.add.iter_activations(x)
+
     def activation_names(self)->list[str]:
         return self.add.activation_names()
 
@@ -200,6 +207,9 @@ class ResNet( ActivationsModule):
     def forward_activations(self,x):
         return self.layers.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.layers.iter_activations(x)
+
     def activation_names(self)->list[str]:
         return self.conv.activation_names()+self.linear.activation_names()
 
@@ -12,6 +12,7 @@ from ..tasks.train import ModelConfig
 from enum import Enum
 
 import tmeasures as tm
+import datasets
 
 class ActivationFunction(Enum):
     ELU="ELU"
@@ -37,6 +38,7 @@ class SimpleConvConfig(ModelConfig):
     @classmethod
     def for_dataset(cls,task:Task,dataset:str,bn:bool=False,k=3, activation=ActivationFunction.ELU,max_pooling=True):
 
+        dataset = datasets.base_name(dataset)
         conv = {"mnist": 128, "cifar10": 128, "fashion_mnist": 64,"lsa16":128,"rwth":128}
         fc = {"mnist": 128, "cifar10": 128, "fashion_mnist": 128,"lsa16":64,"rwth":128}
         return SimpleConvConfig(task,conv=conv[dataset], fc=fc[dataset],bn=bn,kernel_size=k,activation=activation,max_pooling=max_pooling)
@@ -48,7 +50,7 @@ class SimpleConvConfig(ModelConfig):
             epochs_dataset = {'cifar10': 15, 'mnist': 5, 'fashion_mnist': 4, "lsa16": 5, "rwth": 3}
         else:
             raise ValueError(task)
-        epochs = epochs_dataset[dataset]
+        epochs = epochs_dataset[datasets.base_name(dataset)]
         epochs = self.scale_by_transformations(epochs,transformations)
         return epochs
 
@@ -148,6 +150,9 @@ class SimpleConv(ActivationsModule):
     def forward_activations(self, x)->list[torch.Tensor]:
         return  self.layers.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.layers.iter_activations(x)
+
     def conv_layers(self):
         return self.conv.layer_names()
     def fc_layers(self):
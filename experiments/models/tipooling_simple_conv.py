@@ -3,9 +3,7 @@ import torch.nn.functional as F
 from tmeasures.pytorch import ActivationsModule
 from tmeasures import TransformationSet,Transformation
 import torch
-from models import SequentialWithIntermediates
-
-from models.util import Flatten
+from .util import SequentialWithIntermediates
 
 class TIPoolingSimpleConvConfig():
     def __init__(self,transformations:TransformationSet,conv_filters=32,fc_filters=128,bn=False):
@@ -15,13 +13,22 @@ class TIPoolingSimpleConvConfig():
         self.bn=False
 
 class TIPoolingSimpleConv(ActivationsModule):
-    def __init__(self, input_shape, num_classes, transformations:TransformationSet,conv_filters=32, fc_filters=128,bn=False):
+    def __init__(self, input_shape, num_classes, transformations:TransformationSet,conv_filters=32, fc_filters=128,bn=False,
+                 batched=True,chunk_size:int=None):
+        '''
+        :param batched: transform the batch with all transformations at once and run the conv layers over the
+        expanded batch of size B*T, instead of once per transformation.
+        :param chunk_size: maximum number of transformations per conv forward in batched mode (None: all),
+        to bound memory usage to chunk_size*B samples.
+        '''
         super().__init__()
         self.name = self.__class__.__name__
         self.bn = bn
         h, w, channels = input_shape
 
         self.transformations=transformations
+        self.batched=batched
+        self.chunk_size=chunk_size
 
         conv_filters2=conv_filters*2
         conv_filters4 = conv_filters * 4
@@ -69,35 +76,56 @@ class TIPoolingSimpleConv(ActivationsModule):
 
 
     def forward(self, x):
-        results=[]
-        for t in self.transformations:
-            transformed_x = t(x)
-            feature_maps = self.conv(transformed_x)
-            flattened_feature_maps = feature_maps.view(feature_maps.shape[0], -1)
-            results.append(flattened_feature_maps)
-        x=torch.stack(results,dim=1)
-        x, _ =x.max(dim=1)
-        x = self.fc(x)
+        if self.batched:
+            pooled = self.pooled_batched(x)
+        else:
+            results=[]
+            for t in self.transformations:
+                transformed_x = transform_batch(t,x)
+                feature_maps = self.conv(transformed_x)
+                flattened_feature_maps = feature_maps.view(feature_maps.shape[0], -1)
+                results.append(flattened_feature_maps)
+            x=torch.stack(results,dim=1)
+            pooled, _ =x.max(dim=1)
+        x = self.fc(pooled)
         return x
 
-    def forward_activations(self, x)->tuple[object,list]:
-        results = []
-        conv_intermediates = []
-
-        for t in self.transformations:
-            transformed_x = t(x)
-            intermediates = self.conv.forward_activations(transformed_x)
-            feature_maps= intermediates[-1]
-            conv_intermediates.extend(intermediates)
-            flattened_feature_maps = feature_maps.view(feature_maps.shape[0], -1)
-            results.append(flattened_feature_maps)
-
+    def transformation_chunks(self)->list[list[Transformation]]:
+        transformations = list(self.transformations)
+        chunk_size = len(transformations) if self.chunk_size is None else self.chunk_size
+        return [transformations[i:i+chunk_size] for i in range(0,len(transformations),chunk_size)]
 
-        x = torch.stack(results, dim=1)
+    def pooled_batched(self, x):
+        pooled = None
+        for chunk in self.transformation_chunks():
+            feature_maps = self.conv(transform_batch_all(chunk,x))
+            pooled = max_over_transformations(feature_maps, len(chunk), pooled)
+        return pooled
 
-        pooled, _ = x.max(dim=1)
-
-        x, fc_activations = self.fc.forward_activations(pooled)
+    def forward_activations(self, x)->list[torch.Tensor]:
+        conv_intermediates = []
+        if self.batched:
+            pooled = None
+            b = x.shape[0]
+            for chunk in self.transformation_chunks():
+                intermediates = self.conv.forward_activations(transform_batch_all(chunk,x))
+                # activations of each transformation are views of the intermediates of the expanded batch
+                for i in range(len(chunk)):
+                    conv_intermediates.extend([a[i*b:(i+1)*b] for a in intermediates])
+                pooled = max_over_transformations(intermediates[-1], len(chunk), pooled)
+        else:
+            results = []
+            for t in self.transformations:
+                transformed_x = transform_batch(t,x)
+                intermediates = self.conv.forward_activations(transformed_x)
+                feature_maps= intermediates[-1]
+                conv_intermediates.extend(intermediates)
+                flattened_feature_maps = feature_maps.view(feature_maps.shape[0], -1)
+                results.append(flattened_feature_maps)
+            x = torch.stack(results, dim=1)
+            pooled, _ = x.max(dim=1)
+
+        fc_activations = self.fc.forward_activations(pooled)
         return conv_intermediates+[pooled]+fc_activations
 
     def layer_before_pooling_each_transformation(self)->int:
@@ -117,3 +145,34 @@ class TIPoolingSimpleConv(ActivationsModule):
             conv_names.extend(t_names)
 
         return conv_names+["Pool+Flatten"]+self.fc.activation_names()
+
+
+def transform_batch(t:Transformation,x:torch.Tensor)->torch.Tensor:
+    # transformations are defined for single samples
+    return torch.stack([t(s) for s in x])
+
+
+def transform_batch_all(transformations:list[Transformation],x:torch.Tensor)->torch.Tensor:
+    '''
+    Applies each transformation to the batch x (B,C,H,W) and returns the concatenated results,
+    transformation-major: (T*B,C,H,W). Affine transformations are applied with a single grid_sample.
+    '''
+    if all(hasattr(t,"transformation_matrix") for t in transformations):
+        b = x.shape[0]
+        # same sampling as tm.pytorch.AffineTransformation, for all transformations and samples at once
+        matrices = torch.cat([t.transformation_matrix for t in transformations]).to(x.device,x.dtype)
+        matrices = matrices.repeat_interleave(b,dim=0)
+        expanded = x.repeat(len(transformations),1,1,1)
+        grid = F.affine_grid(matrices,list(expanded.shape),align_corners=False)
+        return F.grid_sample(expanded,grid,align_corners=False,padding_mode="border")
+    else:
+        return torch.cat([transform_batch(t,x) for t in transformations])
+
+
+def max_over_transformations(feature_maps:torch.Tensor,n_transformations:int,pooled:torch.Tensor=None)->torch.Tensor:
+    '''
+    Max of the flattened feature maps (T*B,...) over the transformation axis, combined with the max of previous chunks.
+    '''
+    flattened = feature_maps.view(n_transformations,feature_maps.shape[0]//n_transformations,-1)
+    chunk_max, _ = flattened.max(dim=0)
+    return chunk_max if pooled is None else torch.maximum(pooled,chunk_max)
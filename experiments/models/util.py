@@ -1,8 +1,10 @@
 import torch.nn as nn
 import torch
 from tmeasures.pytorch import ActivationsModule
+from tmeasures.pytorch.model import FilteredActivationsModule, ActivationFilter
 
 import torch.nn.functional as F
+from enum import Enum
 
 from experiments.tasks import Task
 
@@ -17,18 +19,26 @@ class SequentialWithIntermediates(nn.Sequential, ActivationsModule):
         super().__init__(*args)
 
     def forward_activations(self,input_tensor)->list[torch.Tensor]:
+        return list(self.iter_activations(input_tensor))
+
+    def iter_activations(self,input_tensor):
+        '''
+        Yields the activations one by one as they are computed, so that callers can stop the forward pass early.
+        '''
         submodules=self._modules.values()
+        if len(submodules) == 0:
+            # matches the "identity" activation name
+            yield input_tensor
+            return
 
-        activations=[]
         for module in submodules:
             if isinstance(module, ActivationsModule):
-                recursive_activations=module.forward_activations(input_tensor)
-                activations += recursive_activations
-                input_tensor = recursive_activations[-1]
+                for activation in iter_activations(module,input_tensor):
+                    yield activation
+                input_tensor = activation
             else:
                 input_tensor= module(input_tensor)
-                activations.append(input_tensor)
-        return activations
+                yield input_tensor
 
     def activation_names(self)->list[str]:
         submodules = self._modules.values()
@@ -97,10 +107,14 @@ class Add(ActivationsModule):
         return left_x+right_x
 
     def forward_activations(self,x):
-        left_x,left_outputs = self.left.forward_activations(x)
-        right_x,right_outputs = self.right.forward_activations(x)
-        output=left_x + right_x
-        return left_outputs+right_outputs+[output]
+        return list(self.iter_activations(x))
+
+    def iter_activations(self,x):
+        for left_x in iter_activations(self.left,x):
+            yield left_x
+        for right_x in iter_activations(self.right,x):
+            yield right_x
+        yield left_x+right_x
 
     def activation_names(self):
         left_names=self.left.activation_names()
@@ -112,6 +126,147 @@ class Add(ActivationsModule):
         return left_names+right_names+this
 
 
+def iter_activations(module:ActivationsModule,x):
+    if hasattr(module,"iter_activations"):
+        return module.iter_activations(x)
+    else:
+        return iter(module.forward_activations(x))
+
+
+class SpatialAggregation(Enum):
+    '''
+    Collapses the spatial dimensions (H,W) of feature maps of shape (B,C,H,W) into (B,C). Other activations are unchanged.
+    '''
+    mean="mean"
+    max="max"
+    sum="sum"
+
+    def __call__(self, x:torch.Tensor)->torch.Tensor:
+        if x.dim() != 4:
+            return x
+        if self == SpatialAggregation.mean:
+            return x.mean(dim=(2,3))
+        elif self == SpatialAggregation.max:
+            return x.amax(dim=(2,3))
+        else:
+            return x.sum(dim=(2,3))
+
+
+class LayerTable:
+    '''
+    Frozen description of the activations of an ActivationsModule: their names and indices and, if computed for an
+    input shape, the shape of each activation (without the batch dimension) and the qualified name of the module
+    that produces it (None for activations not produced by a module, ie the output of an Add).
+    '''
+    def __init__(self, names:list[str], shapes:list[tuple]=None, modules:list[str]=None):
+        self.names = tuple(names)
+        self.index = {}
+        for i,name in enumerate(self.names):
+            # first occurrence, as list.index
+            self.index.setdefault(name,i)
+        self.shapes = None if shapes is None else tuple(shapes)
+        self.modules = None if modules is None else tuple(modules)
+
+    def __len__(self):
+        return len(self.names)
+
+    def mask(self, model:ActivationsModule, activations_filter:ActivationFilter)->list[int]:
+        '''
+        Indices of the activations selected by `activations_filter`, evaluated once per activation
+        '''
+        return [i for i,name in enumerate(self.names) if activations_filter(model,name)]
+
+    def __repr__(self):
+        return f"LayerTable(activations={len(self)},shapes={self.shapes is not None})"
+
+
+def layer_table(model:ActivationsModule, sample_shape:tuple=None)->LayerTable:
+    '''
+    Computes the LayerTable of `model` once and caches it in the model.
+    :param sample_shape: shape (C,H,W) of a single input. If given, activation shapes and modules are computed
+    with a forward pass of a zero input.
+    '''
+    tables = model.__dict__.setdefault("_layer_tables", {})
+    key = None if sample_shape is None else tuple(sample_shape)
+    if key not in tables:
+        if key is None:
+            tables[key] = LayerTable(model.activation_names())
+        else:
+            tables[key] = trace_layer_table(model, key)
+    return tables[key]
+
+
+def trace_layer_table(model:ActivationsModule, sample_shape:tuple)->LayerTable:
+    names = dict((m,name) for name,m in model.named_modules())
+    outputs = []
+    def hook(module,input,output):
+        outputs.append((output,names[module]))
+    handles = [m.register_forward_hook(hook) for m in names if m is not model]
+    training = model.training
+    parameter = next(model.parameters(), None)
+    device = "cpu" if parameter is None else parameter.device
+    try:
+        model.eval()
+        with torch.no_grad():
+            activations = model.forward_activations(torch.zeros(1,*sample_shape,device=device))
+    finally:
+        for h in handles:
+            h.remove()
+        model.train(training)
+    producers = {}
+    for output,name in outputs:
+        # innermost module first
+        producers.setdefault(id(output),name)
+    shapes = [tuple(a.shape[1:]) for a in activations]
+    modules = [producers.get(id(a)) for a in activations]
+    return LayerTable(model.activation_names(),shapes,modules)
+
+
+class TruncatedActivationsModule(FilteredActivationsModule):
+    '''
+    FilteredActivationsModule that runs the forward pass only up to the deepest selected activation, and keeps
+    only the selected activations. Models that can't yield their activations incrementally (see
+    SequentialWithIntermediates.iter_activations) are run completely.
+    If `aggregation` is given, feature maps are aggregated spatially as soon as they are computed,
+    so that the measure receives a single value per channel. Note that this aggregates *before* the measure,
+    which in general differs from aggregating the measure's result (ie, with AverageFeatureMaps).
+    If `capture_dtype` is given, the selected activations are cast to it (ie, torch.float16) as they are captured.
+    '''
+    def __init__(self, inner_model:ActivationsModule, activations_filter:ActivationFilter, aggregation:SpatialAggregation=None,
+                 capture_dtype:torch.dtype=None):
+        ActivationsModule.__init__(self)
+        self.inner_model = inner_model
+        # the filter is compiled into indices of the layer table, instead of searching each name
+        table = layer_table(inner_model)
+        self.indices = table.mask(inner_model,activations_filter)
+        assert len(self.indices)>0
+        self.names = [table.names[i] for i in self.indices]
+        self.selected = set(self.indices)
+        self.last = max(self.indices)
+        self.aggregation = aggregation
+        self.capture_dtype = capture_dtype
+
+    def forward_activations(self, x) -> list[torch.Tensor]:
+        activations = {}
+        for i,activation in enumerate(iter_activations(self.inner_model,x)):
+            if i in self.selected:
+                activations[i]=self.capture(activation)
+            if i == self.last:
+                break
+        return [activations[i] for i in self.indices]
+
+    def capture(self, activation:torch.Tensor)->torch.Tensor:
+        if self.aggregation is not None:
+            activation = self.aggregation(activation)
+        if self.capture_dtype is not None:
+            activation = activation.to(self.capture_dtype)
+        return activation
+
+    def eval(self):
+        self.inner_model.eval()
+        return self
+
+
 class GlobalAvgPool2d(nn.Module):
 
     def forward(self,x):
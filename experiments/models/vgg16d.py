@@ -4,6 +4,7 @@ import numpy as np
 from .util import Flatten,SequentialWithIntermediates,task_to_head
 from tmeasures.pytorch import ActivationsModule
 import tmeasures as tm
+import datasets
 
 from ..tasks import Task
 from ..tasks.train import ModelConfig
@@ -12,6 +13,7 @@ class VGG16DConfig(ModelConfig):
 
     @classmethod
     def for_dataset(cls,task:Task,dataset:str,bn:bool=False):
+        dataset = datasets.base_name(dataset)
         conv = {"mnist": 16, "cifar10": 64,"lsa16":64,"rwth":64, }
         fc = {"mnist": 64, "cifar10": 512,"lsa16":32,"rwth":512, }
         return VGG16DConfig(task, conv=conv[dataset], fc=fc[dataset],bn=bn)
@@ -24,7 +26,7 @@ class VGG16DConfig(ModelConfig):
             epochs_dataset = {'cifar10': 30, 'mnist': 15, 'fashion_mnist': 12, "lsa16": 25, "rwth": 10}
         else:
             raise ValueError(task)
-        epochs = epochs_dataset[dataset]
+        epochs = epochs_dataset[datasets.base_name(dataset)]
         epochs = self.scale_by_transformations(epochs,transformations)
         return epochs
 
@@ -73,6 +75,9 @@ class ConvBNRelu(ActivationsModule):
     def forward_activations(self,x):
         return self.layers.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.layers.iter_activations(x)
+
 def block(filters_in:int,feature_maps:int,n_conv:int,bn:bool):
     '''
     A block of the VGG model, consists of :param n_conv convolutions followed by a 2x2 MaxPool
@@ -142,5 +147,8 @@ class VGG16D(ActivationsModule):
     def forward_activations(self,x)->list[object,list]:
         return self.layers.forward_activations(x)
 
+    def iter_activations(self,x):
+        return self.layers.iter_activations(x)
+
     def activation_names(self):
         return self.layers.activation_names()
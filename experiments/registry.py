@@ -0,0 +1,84 @@
+'''
+Experiments known by name and group, without importing their modules or creating them.
+Experiment modules import torch, tmeasures and the models, and creating an Experiment creates its folder, so the
+run scripts list and select experiments from the registry, and only import and create the selected ones.
+'''
+from __future__ import annotations
+
+import ast
+import importlib
+import importlib.util
+from pathlib import Path
+
+from .base import Experiment
+
+
+class ExperimentEntry:
+    '''
+    Experiment class `name` of module `module`, in group `group`. Results are in `base_folderpath / name`.
+    '''
+    def __init__(self, name: str, module: str, group: str, base_folderpath: Path):
+        self.name = name
+        self.module = module
+        self.group = group
+        self.base_folderpath = base_folderpath
+
+    def id(self):
+        return self.name
+
+    def has_finished(self):
+        # same as Experiment.has_finished, for the default id and folder
+        return (self.base_folderpath / self.name / "finished").exists()
+
+    def description(self) -> str:
+        '''
+        :return: the string returned by the `description` method of the class, read from the source of its module
+        (without importing it), or "" if it is not a constant
+        '''
+        tree = ast.parse(self.source_path().read_text())
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and node.name == self.name:
+                for f in node.body:
+                    if isinstance(f, ast.FunctionDef) and f.name == "description":
+                        for statement in f.body:
+                            if isinstance(statement, ast.Return) and isinstance(statement.value, ast.Constant):
+                                return " ".join(str(statement.value.value).split())
+        return ""
+
+    def source_path(self) -> Path:
+        # find_spec of a submodule would import its package, which imports all its experiments
+        package, *submodules = self.module.split(".")
+        path = Path(importlib.util.find_spec(package).origin).parent.joinpath(*submodules)
+        return path / "__init__.py" if path.is_dir() else path.with_suffix(".py")
+
+    def create(self) -> Experiment:
+        module = importlib.import_module(self.module)
+        return getattr(module, self.name)()
+
+    def __repr__(self):
+        return f"ExperimentEntry({self.module}.{self.name})"
+
+
+class ExperimentRegistry:
+    '''
+    Groups of experiments, in order. Experiments of a group are registered with the module that defines them.
+    '''
+    def __init__(self, base_folderpath: Path):
+        self.base_folderpath = base_folderpath
+        self.groups: dict[str, list[ExperimentEntry]] = {}
+
+    def add(self, group: str, module: str = None, *names: str):
+        entries = self.groups.setdefault(group, [])
+        entries += [ExperimentEntry(name, module, group, self.base_folderpath) for name in names]
+
+    def entries(self) -> list[ExperimentEntry]:
+        return [e for g in self.groups.values() for e in g]
+
+    def names(self) -> list[str]:
+        return [e.name for e in self.entries()]
+
+    def __getitem__(self, name: str) -> ExperimentEntry:
+        for e in self.entries():
+            if e.name == name:
+                return e
+        raise KeyError(name)
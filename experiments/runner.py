@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import atexit
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class JobLimits:
+    '''
+    Resources available to a single job.
+    :param memory: maximum resident memory of the worker (and its children, if psutil is available), in bytes
+    :param time: maximum duration of a job, in seconds
+    None means no limit.
+    '''
+    def __init__(self, memory: int = None, time: float = None):
+        self.memory = memory
+        self.time = time
+
+    def __repr__(self):
+        memory = "-" if self.memory is None else f"{self.memory / 2 ** 30:.1f}GB"
+        time = "-" if self.time is None else f"{self.time:.0f}s"
+        return f"JobLimits(memory={memory},time={time})"
+
+
+class JobFailure:
+    '''
+    Report of a failed attempt to run a job.
+    :param kind: "error" (the job raised an exception), "out_of_memory" (it raised a MemoryError or a CUDA OOM),
+    "memory_limit" or "time_limit" (the worker was killed for exceeding its limits) or "crash" (the worker died,
+    for example killed by the kernel's OOM killer).
+    '''
+    def __init__(self, job: str, kind: str, attempt: int, elapsed: float, exitcode: int = None,
+                 peak_memory: int = None, error: str = ""):
+        self.job = job
+        self.kind = kind
+        self.attempt = attempt
+        self.elapsed = elapsed
+        self.exitcode = exitcode
+        self.peak_memory = peak_memory
+        self.error = error
+        self.date = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __str__(self):
+        memory = "" if self.peak_memory is None else f", peak memory {self.peak_memory / 2 ** 30:.2f}GB"
+        message = f"{self.job}: {self.kind} (attempt {self.attempt}, {self.elapsed:.0f}s{memory})"
+        if self.error:
+            message += f"\n{self.error}"
+        return message
+
+
+class JobError(Exception):
+    def __init__(self, failures: list[JobFailure]):
+        self.failures = failures
+        super().__init__(str(failures[-1]))
+
+
+def worker_loop(connection):
+    '''
+    Runs jobs received through `connection` until it receives None, or until a job fails: the worker exits after
+    reporting the first failure, since its state can't be trusted afterwards, and the runner starts a new one.
+    '''
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        function, args, kwargs = job
+        # the time limit counts from here, not from the (slow) start of the worker or the unpickling of the job
+        connection.send(("started", None))
+        try:
+            result = function(*args, **kwargs)
+            connection.send(("ok", result))
+        except BaseException as e:
+            name = e.__class__.__name__
+            kind = "out_of_memory" if isinstance(e, MemoryError) or "OutOfMemory" in name else "error"
+            connection.send((kind, traceback.format_exc()))
+            # the state of the worker can't be trusted after a failure
+            break
+    connection.close()
+
+
+def process_memory(pid: int) -> int:
+    '''
+    Resident memory of process `pid` in bytes (including its children, if psutil is available)
+    '''
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes if p.is_running())
+        except psutil.Error:
+            return 0
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class JobRunner:
+    '''
+    Runs jobs in a worker subprocess, so that a crash, an out of memory error or a leak in one job
+    doesn't take down the calling process. The worker is started with spawn (no inherited torch threads or cuda state),
+    reused for `jobs_per_worker` jobs and then recycled. A failed job is retried `retries` times in a new worker;
+    every failed attempt is appended as a json line to `report_path`.
+
+    The worker is not a daemon, so that jobs can start their own processes (ie, DataLoader workers); it is stopped
+    by `close`, or when the calling process exits.
+    The memory limit is checked by sampling the memory of the worker and its children every `poll_interval` seconds,
+    so an allocation spike shorter than that can exceed it (and be stopped by the kernel's OOM killer instead).
+    '''
+    def __init__(self, limits: JobLimits = None, jobs_per_worker: int = 4, retries: int = 1,
+                 report_path: Path = None, poll_interval: float = 1.0):
+        self.limits = JobLimits() if limits is None else limits
+        self.jobs_per_worker = jobs_per_worker
+        self.retries = retries
+        self.report_path = report_path
+        self.poll_interval = poll_interval
+        self.context = multiprocessing.get_context("spawn")
+        self.worker = None
+        self.connection = None
+        self.worker_jobs = 0
+        atexit.register(self.close)
+
+    def start_worker(self):
+        self.connection, worker_connection = self.context.Pipe()
+        self.worker = self.context.Process(target=worker_loop, args=(worker_connection,), daemon=False)
+        self.worker.start()
+        worker_connection.close()
+        self.worker_jobs = 0
+
+    def stop_worker(self, kill=False):
+        if self.worker is None:
+            return
+        if kill:
+            self.worker.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.worker.join(timeout=30)
+            if self.worker.is_alive():
+                self.worker.kill()
+        self.worker.join()
+        self.connection.close()
+        self.worker, self.connection = None, None
+
+    def run(self, name: str, function: Callable, *args, **kwargs):
+        '''
+        Runs `function(*args,**kwargs)` in the worker and returns its result. Function, arguments and result must be picklable.
+        :raises JobError: if every attempt failed
+        '''
+        failures = []
+        for attempt in range(1, self.retries + 2):
+            result, failure = self.attempt(name, attempt, function, args, kwargs)
+            if failure is None:
+                return result
+            failures.append(failure)
+            self.report(failure)
+        raise JobError(failures)
+
+    def attempt(self, name: str, attempt: int, function: Callable, args: tuple, kwargs: dict):
+        if self.worker is None or not self.worker.is_alive() or self.worker_jobs >= self.jobs_per_worker:
+            self.stop_worker()
+            self.start_worker()
+        self.worker_jobs += 1
+        start = time.perf_counter()
+        started = False
+        peak_memory = 0
+
+        def failure(kind, error="", exitcode=None):
+            return None, JobFailure(name, kind, attempt, time.perf_counter() - start, exitcode=exitcode,
+                                    peak_memory=peak_memory if peak_memory > 0 else None, error=error)
+
+        try:
+            self.connection.send((function, args, kwargs))
+        except (BrokenPipeError, OSError):
+            self.stop_worker(kill=True)
+            return failure("crash", "worker died before receiving the job")
+        while True:
+            try:
+                ready = self.connection.poll(self.poll_interval)
+            except (EOFError, OSError):
+                ready = True
+            if ready:
+                try:
+                    status, value = self.connection.recv()
+                except (EOFError, OSError):
+                    self.worker.join(timeout=5)
+                    exitcode = self.worker.exitcode
+                    self.stop_worker(kill=True)
+                    return failure("crash", f"worker exited with code {exitcode}", exitcode)
+                if status == "started":
+                    start, started = time.perf_counter(), True
+                    continue
+                if status == "ok":
+                    return value, None
+                self.stop_worker()
+                return failure(status, value)
+            peak_memory = max(peak_memory, process_memory(self.worker.pid))
+            if self.limits.memory is not None and peak_memory > self.limits.memory:
+                self.stop_worker(kill=True)
+                return failure("memory_limit", f"worker exceeded {self.limits}")
+            if started and self.limits.time is not None and time.perf_counter() - start > self.limits.time:
+                self.stop_worker(kill=True)
+                return failure("time_limit", f"job exceeded {self.limits}")
+            if not self.worker.is_alive():
+                exitcode = self.worker.exitcode
+                self.stop_worker(kill=True)
+                return failure("crash", f"worker exited with code {exitcode}", exitcode)
+
+    def report(self, failure: JobFailure):
+        print(f"Job failed: {failure}")
+        if self.report_path is not None:
+            self.report_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.report_path, "a") as f:
+                f.write(json.dumps(failure.to_dict()) + "\n")
+
+    def close(self):
+        self.stop_worker()
+        atexit.unregister(self.close)
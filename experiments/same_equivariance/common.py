@@ -16,4 +16,4 @@ def get_ylim_normalized(measure: tm.numpy.NumpyMeasure):
         raise ValueError(measure)
 
 
-def simple_conv_sameequivariance_activation_filter(m:ObservableLayersModule,name:str): return m.activation_names().index(name) < 6
\ No newline at end of file
+def simple_conv_sameequivariance_activation_filter(m:ObservableLayersModule,name:str): return layer_table(m).index[name] < 6
\ No newline at end of file
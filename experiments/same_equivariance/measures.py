@@ -38,8 +38,7 @@ class CompareSameEquivarianceNormalized(SameEquivarianceExperiment):
                 results.append(result)
 
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
-            tmv.plot_average_activations_same_model(results,  labels=labels)
-            self.savefig(plot_filepath)
+            self.queue_plot(plot_filepath, tmv.plot_average_activations_same_model, results,  labels=labels)
 
 
 class TransformationSampleSizes(SameEquivarianceExperiment):
@@ -84,11 +83,12 @@ class TransformationSampleSizes(SameEquivarianceExperiment):
             t_n = len(test_transformations)
             results = np.empty((s_n, t_n), dtype=tm.pytorch.PyTorchMeasureResult)
             
-            for i, sample_size in enumerate(sample_sizes):
-                p_dataset = DatasetParameters(dataset, default_subset, DatasetSizeFixed(sample_size))
-                for j, transformation in enumerate(test_transformations):
-                    mp = PyTorchParameters(mc.id(), p_dataset, transformation, measure, default_measure_options,model_filter=simple_conv_sameequivariance_activation_filter)
-                    results[i, j] = self.measure(model_path, mp, verbose=False).numpy()
+            # all cells are measured in one pass over the largest sample and transformation sets
+            p_dataset = DatasetParameters(dataset, default_subset, DatasetSizeFixed(sample_sizes[-1]))
+            mp = PyTorchParameters(mc.id(), p_dataset, test_transformations[-1], measure, default_measure_options,model_filter=simple_conv_sameequivariance_activation_filter)
+            grid = self.measure_grid(model_path, mp, sample_sizes, test_transformations, verbose=False)
+            for i, j in itertools.product(range(s_n), range(t_n)):
+                results[i, j] = grid[i][j].numpy()
 
 
             plot_filepath = self.folderpath / f"{experiment_name}.jpg"
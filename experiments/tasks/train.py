@@ -11,10 +11,11 @@ from pathlib import Path
 from utils.poutyne import TotalProgressCallback
 from poutyne import Model, Callback,EpochProgressionCallback
 
-from pytorch.pytorch_image_dataset import ImageClassificationDataset, TransformationStrategy, \
-    ImageTransformRegressionNormalizedDataset
+from pytorch.pytorch_image_dataset import ImageDataset, ImageClassificationDataset, TransformationStrategy, \
+    ImageTransformRegressionNormalizedDataset, FeatureNormalization
 
 from pytorch.numpy_dataset import NumpyDataset
+from pytorch.prerendered import prerender_classification
 from abc import ABC, abstractmethod
 
 
@@ -45,28 +46,28 @@ class ModelConfig(ABC):
 
         min_accuracies = {"mnist": .90, "cifar10": .5,"lsa16":0.85, "rwth":0.7}
 
-        return min_accuracies[dataset]
+        return min_accuracies[datasets.base_name(dataset)]
 
     def max_smape(self, dataset: str, task: Task, transformations: tm.TransformationSet):
 
         mi, ma = transformations.parameter_range()
         n_parameters = len(mi)
         coefficient = {"mnist": 0.20, "cifar10": 0.20}
-        val = n_parameters * coefficient[dataset]
+        val = n_parameters * coefficient[datasets.base_name(dataset)]
         return val
 
     def max_mae(self, dataset: str, task: Task, transformations: tm.TransformationSet):
         mi, ma = transformations.parameter_range()
         n_parameters = len(mi)
         coefficient = {"mnist": 0.20, "cifar10": 0.20}
-        val = n_parameters * coefficient[dataset]
+        val = n_parameters * coefficient[datasets.base_name(dataset)]
         return val
 
     def max_rae(self, dataset: str, task: Task, transformations: tm.TransformationSet):
         mi, ma = transformations.parameter_range()
         n_parameters = len(mi)
         coefficient = {"mnist": 0.30, "cifar10": 0.30}
-        val = coefficient[dataset]
+        val = coefficient[datasets.base_name(dataset)]
         return val
 
     def max_rmse(self, dataset: str, task: Task, transformations: tm.TransformationSet):
@@ -74,7 +75,7 @@ class ModelConfig(ABC):
         mi, ma = transformations.parameter_range()
         n_parameters = len(mi)
         coefficient = {"mnist": 0.20, "cifar10": 0.20}
-        max_rmse = n_parameters * coefficient[dataset]
+        max_rmse = n_parameters * coefficient[datasets.base_name(dataset)]
         return max_rmse
 
     def scale_by_transformations(self, epochs: int, transformations: tm.TransformationSet):
@@ -141,7 +142,8 @@ class TrainConfig:
     def __init__(self, epochs: int, cc: ConvergenceCriteria, optimizer="adam", save_model=True, max_restarts: int = 5,
                  savepoints: list[int] = None,
                  device=default_device(), suffix="",
-                 verbose=False, num_workers=2, batch_size=64, plots=True):
+                 verbose=False, num_workers=2, batch_size=64, plots=True,
+                 transformation_strategy: TransformationStrategy = TransformationStrategy.random_sample, uint8_inputs=False):
         self.epochs = epochs
         self.optimizer = optimizer
         self.suffix = suffix
@@ -154,6 +156,11 @@ class TrainConfig:
         self.plots = plots
         self.max_restarts = max_restarts
         self.convergence_criteria = cc
+        # iterate_all strategies make each epoch visit every (sample, transformation) pair
+        self.transformation_strategy = transformation_strategy
+        # keep uint8 images up to the model's process, and normalize them there (classification only, with uint8
+        # datasets). The transformed images are rounded, so these models get their own ids.
+        self.uint8_inputs = uint8_inputs
 
 
 class TrainParameters:
@@ -168,6 +175,14 @@ class TrainParameters:
     def id(self, savepoint: float = None)->str:
         result = f"{self.mc.id()}_{self.dataset_name}_{self.transformations.id()}"
 
+        # training settings that change the inputs of the model, only when they differ from the defaults, so that
+        # models trained with other settings don't share ids (and the ids of existing models don't change)
+        strategy = getattr(self.tc, "transformation_strategy", None)
+        if strategy is not None and strategy != TransformationStrategy.random_sample:
+            result += f"_{strategy.value}"
+        if getattr(self.tc, "uint8_inputs", False) and self.task == Task.Classification:
+            result += "_uint8"
+
         suffix = self.tc.suffix
         if len(suffix) > 0:
             result += f"_{suffix}"
@@ -184,9 +199,20 @@ class TrainParameters:
 
     
 
-def prepare_dataset(transformations:tm.TransformationSet, dataset_name:str, task:Task):
-
-    strategy = TransformationStrategy.random_sample
+def prepare_dataset(transformations:tm.TransformationSet, dataset_name:str, task:Task, shared=False, prerender_folder:Path=None, prerender_max_bytes:int=None,
+                    strategy:TransformationStrategy=None, uint8=False):
+    '''
+    :param shared: store the data in shared memory, so that DataLoader workers don't duplicate it.
+    The datasets must then be released with `release_dataset` after use.
+    :param prerender_folder: for classification, render every (sample, transformation) pair to uint8 files in this folder
+    (or reuse them) instead of transforming the samples in every epoch, if they take at most `prerender_max_bytes`.
+    :param strategy: pairing of samples and transformations (default: random_sample)
+    :param uint8: for classification, the datasets return uint8 images and their loaders normalize the batches
+    (see ImageDataset). The images of the dataset must be uint8.
+    '''
+
+    if strategy is None:
+        strategy = TransformationStrategy.random_sample
     if task == Task.TransformationRegression:
         dataset = datasets.get_regression(dataset_name)
         dim_output = len(transformations[0].parameters())
@@ -198,28 +224,51 @@ def prepare_dataset(transformations:tm.TransformationSet, dataset_name:str, task
     elif task == Task.Classification:
         dataset = datasets.get_classification(dataset_name)
         dim_output = dataset.num_classes
-        dataset.normalize_features()
-        
-        train_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_train, dataset.y_train), transformations, strategy)
-        test_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_test, dataset.y_test), transformations, strategy)
+        if uint8 and (dataset.x_train.dtype != np.uint8 or dataset.x_test.dtype != np.uint8):
+            # models trained with uint8 inputs have their own ids, so don't silently train them with float inputs
+            raise ValueError(f"Dataset {dataset_name} has {dataset.x_train.dtype} images, it can't be trained with uint8 inputs")
+        prerendered = None
+        if prerender_folder is not None:
+            prerendered = prerender_classification(dataset, transformations, prerender_folder, prerender_max_bytes, strategy, uint8=uint8)
+        if prerendered is not None:
+            train_dataset, test_dataset = prerendered
+        elif uint8:
+            normalization = FeatureNormalization(*dataset.feature_statistics())
+            train_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_train, dataset.y_train), transformations, strategy, normalization=normalization)
+            test_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_test, dataset.y_test), transformations, strategy, normalization=normalization)
+        else:
+            dataset.normalize_features()
+            train_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_train, dataset.y_train), transformations, strategy)
+            test_dataset = ImageClassificationDataset(NumpyDataset(dataset.x_test, dataset.y_test), transformations, strategy)
     else:
         raise ValueError(task)
+    if shared:
+        train_dataset.dataset.share()
+        test_dataset.dataset.share()
 
     return train_dataset, test_dataset, dataset.input_shape, dim_output
 
 
+def release_dataset(dataset:ImageDataset):
+    dataset.dataset.release()
+
+
 # keep import so that new metrics are registered
 
 
 def prepare_model(p: TrainParameters, input_shape, dim_output):
     task = p.task
+    epoch_metrics = []
     if task == Task.Classification:
         loss_function = "cross_entropy"
         batch_metrics = ['accuracy']
     elif task == Task.TransformationRegression:
         loss_function = "mse"
-        batch_metrics = ["mae", "smape", "rae"] + \
-            p.tc.convergence_criteria.metrics()
+        metrics = sorted(list(set(["mae", "smape", "rae"] + p.tc.convergence_criteria.metrics())))
+        # regression metrics are computed exactly over the whole epoch, in a single pass per batch (except rae, see RegressionMetrics)
+        regression_metrics = [m for m in metrics if m in pytorch.metrics.RegressionMetrics.supported]
+        epoch_metrics = [pytorch.metrics.RegressionMetrics.named(regression_metrics)]
+        batch_metrics = [m for m in metrics if m not in regression_metrics]
     else:
         raise ValueError(task)
     batch_metrics = sorted(list(set(batch_metrics)))
@@ -230,10 +279,17 @@ def prepare_model(p: TrainParameters, input_shape, dim_output):
                           optimizer=p.tc.optimizer,
                           loss_function=loss_function,
                           batch_metrics=batch_metrics,
+                          epoch_metrics=epoch_metrics,
                           device=p.tc.device)
     return model, poutyne_model
 
 
+def evaluate_dataset(model: Model, dataset: ImageDataset, tc: TrainConfig, pin_memory=True) -> dict:
+    # through the dataset's loader, which normalizes uint8 batches
+    loader = dataset.loader(tc.batch_size, num_workers=tc.num_workers, pin_memory=pin_memory, device=tc.device)
+    return model.evaluate_generator(loader, return_dict_format=True, verbose=False)
+
+
 class SavepointCallback(Callback):
 
     def __init__(self, p: TrainParameters, model: Model, test_set, pc):
@@ -253,8 +309,7 @@ class SavepointCallback(Callback):
 
     def save_model_with_scores(self, epoch_number):
         tc = self.p.tc
-        scores = self.model.evaluate_dataset(
-            self.test_set, num_workers=tc.num_workers, batch_size=tc.batch_size, verbose=False, return_dict_format=True)
+        scores = evaluate_dataset(self.model, self.test_set, tc, pin_memory=False)
         # if self.p.tc.verbose:
         #     print(f"Saving model {self.model.network.name} at epoch {epoch_number}/{tc.epochs}.")
         save_model(self.p, self.model.network, scores,
@@ -279,12 +334,30 @@ def replace_in_keys(d:dict,a:str,b:str):
                 del d[k]
 
 def train(p: TrainParameters, path_config):
-    train_dataset, test_dataset, input_shape, dim_output = prepare_dataset(p.transformations, p.dataset_name, p.task)
+    # workers attach to a single shared copy of the data instead of duplicating it
+    shared = p.tc.num_workers > 0
+    prerender_folder, prerender_max_bytes = None, None
+    if getattr(path_config, "prerender_training", False):
+        prerender_folder, prerender_max_bytes = path_config.prerender_folder(), path_config.prerender_max_bytes
+    # models saved before the strategy was configurable don't have it
+    strategy = getattr(p.tc, "transformation_strategy", None)
+    uint8 = getattr(p.tc, "uint8_inputs", False)
+    train_dataset, test_dataset, input_shape, dim_output = prepare_dataset(p.transformations, p.dataset_name, p.task, shared=shared,
+                                                                           prerender_folder=prerender_folder, prerender_max_bytes=prerender_max_bytes,
+                                                                           strategy=strategy, uint8=uint8)
+    try:
+        return train_datasets(p, path_config, train_dataset, test_dataset, input_shape, dim_output)
+    finally:
+        release_dataset(train_dataset)
+        release_dataset(test_dataset)
+
+
+def train_datasets(p: TrainParameters, path_config, train_dataset, test_dataset, input_shape, dim_output):
     if p.tc.epochs == 0:
         print("Warning: epochs chosen = 0, saving model without training..")
         model, poutyne_model = prepare_model(p, input_shape, dim_output)
 
-        metrics = poutyne_model.evaluate_dataset(test_dataset, batch_size=p.tc.batch_size, num_workers=p.tc.num_workers,return_dict_format=True, verbose=False, dataloader_kwargs={"pin_memory": True})
+        metrics = evaluate_dataset(poutyne_model, test_dataset, p.tc)
         save_model(p, model, metrics, path_config.model_path_new(p))
 
         return model,metrics
@@ -302,15 +375,15 @@ def train(p: TrainParameters, path_config):
         savepoint_callback = SavepointCallback(
             p, poutyne_model, test_dataset, path_config)
 
-        history = poutyne_model.fit_dataset(train_dataset, test_dataset, batch_size=p.tc.batch_size, epochs=p.tc.epochs, callbacks=[
-                                                savepoint_callback,progress], verbose=False,
-                                            num_workers=p.tc.num_workers,
-                                            dataloader_kwargs={"shuffle": True, "pin_memory": True,"drop_last":True})
+        # the datasets build their loaders, so that iterate_all strategies use their batch sampler
+        loader_kwargs = {"num_workers": p.tc.num_workers, "pin_memory": True, "device": p.tc.device}
+        train_loader = train_dataset.loader(p.tc.batch_size, shuffle=True, drop_last=True, **loader_kwargs)
+        valid_loader = test_dataset.loader(p.tc.batch_size, shuffle=True, drop_last=True, **loader_kwargs)
+        history = poutyne_model.fit_generator(train_loader, valid_loader, epochs=p.tc.epochs, callbacks=[
+                                                savepoint_callback,progress], verbose=False)
 
-        metrics = poutyne_model.evaluate_dataset(test_dataset, batch_size=p.tc.batch_size, num_workers=p.tc.num_workers,
-                                                 return_dict_format=True, verbose=False, dataloader_kwargs={"pin_memory": True})
-        train_metrics = poutyne_model.evaluate_dataset(train_dataset, batch_size=p.tc.batch_size, num_workers=p.tc.num_workers,
-                                                       return_dict_format=True, verbose=False, dataloader_kwargs={"pin_memory": True})
+        metrics = evaluate_dataset(poutyne_model, test_dataset, p.tc)
+        train_metrics = evaluate_dataset(poutyne_model, train_dataset, p.tc)
 
         replace_in_keys(train_metrics,"test","train")
 
@@ -1,6 +1,7 @@
 
 from re import A
 from experiment.measure.parameters import DatasetParameters, PyTorchParameters
+from experiment.measure.blocks import supports_blocks
 from experiments.language import Spanish,English
 import pickle
 import tmeasures as tm
@@ -14,6 +15,8 @@ from typing import Union,Type
 import matplotlib.pyplot as plt
 
 from .base import Experiment
+from .visualization.jobs import PlotJob, PlotQueue
+from .runner import JobRunner, JobLimits
 
 import datasets
 
@@ -21,11 +24,60 @@ import datasets
 
 class TMExperiment(Experiment):
 
-    
+    # write a per layer profile (activation sizes, times, memory) next to each new measure result
+    profile_measures = False
+    # processes used to render the figures queued with `queue_plot` (None: one per cpu)
+    plot_workers = None
+    # run training and measure jobs in a worker process (see JobRunner), with these limits and retries
+    isolate_jobs = False
+    job_limits = JobLimits()
+    job_retries = 1
+    jobs_per_worker = 4
+    # measure variance measures in stratified blocks of this many samples and keep their state, for bootstrap intervals (None: disabled)
+    block_statistics = None
+    # store the transformed inputs of each measure in the commons folder, and reuse them for the other models measured with them;
+    # the least recently used inputs are deleted when the cache takes more than input_cache_max_bytes
+    cache_inputs = False
+    input_cache_max_bytes = 64 * 2 ** 30
+    # train classification models on datasets prerendered with every transformation (see pytorch.prerendered),
+    # if the rendered train and test sets take at most prerender_max_bytes
+    prerender_training = False
+    prerender_max_bytes = 32 * 2 ** 30
+
+    def __getstate__(self):
+        # the experiment is sent to job workers; the runner and queued plots stay in this process
+        state = self.__dict__.copy()
+        state.pop("job_runner", None)
+        state.pop("plot_queue", None)
+        return state
+
+    def failures_path(self) -> Path:
+        return self.folderpath / "failures.jsonl"
+
+    def run_job(self, name: str, function, *args, **kwargs):
+        '''
+        Runs `function(*args,**kwargs)`, in a worker process if `isolate_jobs` is set.
+        :raises JobError: if the job failed in every attempt
+        '''
+        if not self.isolate_jobs:
+            return function(*args, **kwargs)
+        if not hasattr(self, "job_runner"):
+            self.job_runner = JobRunner(self.job_limits, self.jobs_per_worker, self.job_retries, self.failures_path())
+        return self.job_runner.run(name, function, *args, **kwargs)
+
+    def close_jobs(self):
+        if hasattr(self,"job_runner"):
+            self.job_runner.close()
+            del self.job_runner
+
     def base_path(self,):
         return self.base_folderpath
     def commons_folder(self,):
         return self.base_folderpath / ".common"
+    def prerender_folder(self,):
+        return self.commons_folder() / "prerendered"
+    def input_cache_folder(self,):
+        return self.commons_folder() / "inputs"
     def models_folder(self,):
         model_folderpath = self.commons_folder() / "models"
         model_folderpath.mkdir(parents=True, exist_ok=True)
@@ -72,6 +124,10 @@ class TMExperiment(Experiment):
         custom_results_folder = self.results_folder() if custom_results_folder is None else custom_results_folder
         return custom_results_folder / f"{p.id()}.pickle"
 
+    def profile_path(self,p: measure.Parameters, custom_results_folder = None) -> Path:
+        custom_results_folder = self.results_folder() if custom_results_folder is None else custom_results_folder
+        return custom_results_folder / f"{p.id()}_profile"
+
     def save_experiment_results(self,r: measure.MeasureExperimentResult, custom_results_folder=None):
         custom_results_folder = self.results_folder() if custom_results_folder is None else custom_results_folder
         path = self.results_path(r.parameters, custom_results_folder)
@@ -151,21 +207,80 @@ class TMExperiment(Experiment):
 
         message = f"Measuring:\n{p}\n{p.options}"
         self.print_date(message)
-        measure_experiment_result = measure.main_pytorch(p,model_path,verbose=verbose)
+        if self.isolate_jobs:
+            # the worker saves the result, so it is not sent back through the pipe
+            self.run_job(f"Measure {p.id()}", self.measure_job, model_path, p, verbose, False)
+            return self.load_measure_result(results_path)
+        return self.measure_job(model_path, p, verbose)
+
+    def measure_job(self,model_path:str,p:PyTorchParameters,verbose=False,return_result=True):
+        input_cache = self.input_cache_folder() if self.cache_inputs else None
+        measure_experiment_result = measure.main_pytorch(p,model_path,verbose=verbose,profile=self.profile_measures,input_cache=input_cache,
+                                                         input_cache_max_bytes=self.input_cache_max_bytes)
         self.save_experiment_results(measure_experiment_result)
-        return measure_experiment_result.measure_result
+        if self.profile_measures:
+            measure_experiment_result.profile.save(self.profile_path(p))
+        if return_result:
+            return measure_experiment_result.measure_result
+
+    def measure_grid(self,model_path:str,p:PyTorchParameters,dataset_sizes:list,transformation_sets:list,verbose=False)->list[list[tm.pytorch.PyTorchMeasureResult]]:
+        '''
+        Measures `p` for every combination of `dataset_sizes` (DatasetSize objects or ints) and `transformation_sets`.
+        If the measure supports it, all the cells are computed in a single pass over the largest sample (see experiment.measure.grid);
+        otherwise each cell is measured independently.
+        :return: results[i][j] for dataset_sizes[i] and transformation_sets[j]
+        '''
+        ps = measure.grid_parameters(p, dataset_sizes, transformation_sets)
+        if not measure.supports_grid(p.measure):
+            return [[self.measure(model_path, cell, verbose=verbose) for cell in row] for row in ps]
+        paths = [self.results_path(cell) for row in ps for cell in row]
+        if not all(path.exists() for path in paths):
+            self.print_date(f"Measuring grid of {len(dataset_sizes)} dataset sizes x {len(transformation_sets)} transformation sets:\n{p}\n{p.options}")
+            self.run_job(f"Measure grid {p.id()}", self.measure_grid_job, model_path, p, dataset_sizes, transformation_sets, verbose)
+        return [[self.load_measure_result(self.results_path(cell)) for cell in row] for row in ps]
+
+    def measure_grid_job(self,model_path:str,p:PyTorchParameters,dataset_sizes:list,transformation_sets:list,verbose=False):
+        results = measure.experiment_pytorch_grid(p, dataset_sizes, transformation_sets, model_path, verbose=verbose)
+        for row in results:
+            for r in row:
+                self.save_experiment_results(r)
+
+    def measure_sweep(self,model_path:str,p:PyTorchParameters,dataset_sizes:list,verbose=False)->list[tm.pytorch.PyTorchMeasureResult]:
+        '''
+        Measures `p` for each of `dataset_sizes`, in a single pass over the largest one if the measure supports it
+        '''
+        grid = self.measure_grid(model_path, p, dataset_sizes, [p.transformations], verbose=verbose)
+        return [row[0] for row in grid]
 
     def train(self,p:TrainParameters):
         if not self.model_trained(p):
             print(f"Training model {p.id()} for {p.tc.epochs} epochs ({p.tc.convergence_criteria}), savepoints at epochs: {p.tc.savepoints})...")
-            train.train(p, self)
+            self.run_job(f"Train {p.id()}", self.train_job, p)
         else:
             print(f"Model {p.id()} (savepoints {p.tc.savepoints}) already trained.")
+
+    def train_job(self,p:TrainParameters):
+        # the trained model is saved to disk; don't return it (to the caller process, if isolated)
+        train.train(p, self)
     
     def savefig(self,path:Path):
         plt.savefig(path,bbox_inches='tight')
         plt.close()
 
+    def queue_plot(self,path:Path,function,*args,**kwargs):
+        '''
+        Queues the figure drawn by `function(*args,**kwargs)` to be saved to `path` once `run` finishes.
+        The arguments are copied when queued, so later changes to them don't affect the figure.
+        Figures whose function and arguments didn't change since they were last rendered are skipped.
+        '''
+        if not hasattr(self,"plot_queue"):
+            self.plot_queue = PlotQueue(self.plot_workers)
+        self.plot_queue.add(PlotJob(path,function,args,kwargs))
+
+    def render_plots(self):
+        if hasattr(self,"plot_queue"):
+            self.plot_queue.render()
+
     def train_default(self,task:Task,dataset:str,transformations:tm.pytorch.PyTorchTransformationSet,mc:Union[ModelConfig,type[ModelConfig]]):
         if not isinstance(mc, ModelConfig):
             mc: train.ModelConfig = mc.for_dataset(task,dataset)
@@ -175,7 +290,24 @@ class TMExperiment(Experiment):
         model_path = self.model_path_new(p)
         return mc,tc,p,model_path
 
-    def measure_default(self,dataset:str,model_id:str,model_path:Path,transformation:tm.pytorch.PyTorchTransformationSet,measure:tm.pytorch.PyTorchMeasure,measure_options:tm.pytorch.PyTorchMeasureOptions,dataset_percentage:float,subset = datasets.DatasetSubset.test,adapt_dataset=False):
+    def measure_default(self,dataset:str,model_id:str,model_path:Path,transformation:tm.pytorch.PyTorchTransformationSet,measure:tm.pytorch.PyTorchMeasure,measure_options:tm.pytorch.PyTorchMeasureOptions,dataset_percentage:float,subset = datasets.DatasetSubset.test,adapt_dataset=False,return_parameters=False):
+        '''
+        :param return_parameters: also return the PyTorchParameters of the result, ie to get its `layer_intervals`
+        '''
         p_dataset = DatasetParameters(dataset,subset, dataset_percentage)
-        mp = PyTorchParameters(model_id, p_dataset, transformation, measure, measure_options,adapt_dataset=adapt_dataset)
-        return self.measure(model_path, mp, verbose=False).numpy()
\ No newline at end of file
+        # only variance measures can keep their block state
+        block_statistics = self.block_statistics if supports_blocks(measure) else None
+        mp = PyTorchParameters(model_id, p_dataset, transformation, measure, measure_options,adapt_dataset=adapt_dataset,block_statistics=block_statistics)
+        result = self.measure(model_path, mp, verbose=False).numpy()
+        return (result, mp) if return_parameters else result
+
+    def layer_intervals(self,p:PyTorchParameters,replicates=1000,confidence=0.95):
+        '''
+        Bootstrap confidence intervals of the average value of each layer, from the block statistics stored with the result of `p`.
+        :return: a LayerIntervals, or None if the result has no block statistics
+        '''
+        result = self.load_experiment_result(self.results_path(p))
+        block_results = getattr(result, "block_results", None)
+        if block_results is None:
+            return None
+        return block_results.bootstrap(replicates, confidence)
\ No newline at end of file
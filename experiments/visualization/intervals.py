@@ -0,0 +1,29 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from tmeasures.visualization.layers import get_colors, get_dpi, default_y_lim
+
+from experiment.measure.blocks import LayerIntervals
+from ..language import l
+
+
+def plot_average_activations_intervals(intervals:[LayerIntervals], labels:[str]=None, colors=None, ylim=None, alpha=0.25):
+    '''
+    Plots the average value of each layer for several results, with a band for their bootstrap confidence interval
+    '''
+    if ylim is None:
+        ylim = default_y_lim
+    n = len(intervals)
+    colors = get_colors(colors, n)
+    f, ax = plt.subplots(dpi=get_dpi(n))
+    for i, interval in enumerate(intervals):
+        x = np.arange(len(interval.estimate)) + 1
+        label = None if labels is None else labels[i]
+        color = colors[i, :]
+        ax.plot(x, interval.estimate, label=label, color=color, marker="o", markersize=3)
+        ax.fill_between(x, interval.low, interval.high, color=color, alpha=alpha, linewidth=0)
+    ax.set_ylim(0, ylim)
+    ax.set_xlabel(l.layer)
+    ax.set_ylabel(l.measure)
+    if labels is not None:
+        ax.legend(fontsize=8)
+    return f
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from pathlib import Path
+from typing import Callable
+
+import matplotlib
+
+
+class PlotJob:
+    '''
+    A figure to render: `function(*args,**kwargs)` draws it with pyplot, and it is saved to `path`.
+    The hash of the function and its arguments is stored beside the image (`path`.sha256), so that the
+    figure is only rendered again if its inputs change.
+    The arguments are pickled (and hashed) when the job is created, and the figure is drawn from that snapshot.
+    '''
+    def __init__(self, path: Path, function: Callable, args: tuple = (), kwargs: dict = None):
+        self.path = Path(path)
+        self.function = function
+        kwargs = {} if kwargs is None else kwargs
+        self.arguments = pickle.dumps((args, sorted(kwargs.items())), protocol=4)
+        function_name = f"{function.__module__}.{function.__qualname__}"
+        self.digest = hashlib.sha256(function_name.encode() + self.arguments).hexdigest()
+
+    def hash(self) -> str:
+        return self.digest
+
+    def hash_path(self) -> Path:
+        return self.path.parent / f"{self.path.name}.sha256"
+
+    def up_to_date(self, hash: str) -> bool:
+        hash_path = self.hash_path()
+        return self.path.exists() and hash_path.exists() and hash_path.read_text() == hash
+
+    def render(self, hash: str):
+        import matplotlib.pyplot as plt
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        args, kwargs = pickle.loads(self.arguments)
+        self.function(*args, **dict(kwargs))
+        plt.savefig(self.path, bbox_inches='tight')
+        plt.close("all")
+        self.hash_path().write_text(hash)
+
+    def __repr__(self):
+        return f"PlotJob({self.path})"
+
+
+def init_worker():
+    matplotlib.use("Agg")
+
+
+def render_job(job: PlotJob, hash: str) -> Path:
+    job.render(hash)
+    return job.path
+
+
+class PlotQueue:
+    '''
+    Collects PlotJobs and renders the ones whose inputs changed, in parallel on a process pool with the Agg backend.
+    Starting the workers takes a few seconds (they import torch to unpickle results), so a few jobs are
+    rendered in this process instead.
+    '''
+    min_parallel_jobs = 8
+
+    def __init__(self, workers: int = None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.jobs: list[PlotJob] = []
+
+    def add(self, job: PlotJob):
+        self.jobs.append(job)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def render(self, verbose=True) -> list[Path]:
+        '''
+        Renders the pending jobs and empties the queue.
+        :return: paths of the figures that were rendered (skipped ones are not included)
+        '''
+        jobs, self.jobs = self.jobs, []
+        pending = []
+        for job in jobs:
+            hash = job.hash()
+            if not job.up_to_date(hash):
+                pending.append((job, hash))
+        if verbose and len(jobs) > 0:
+            print(f"Rendering {len(pending)} plots ({len(jobs) - len(pending)} up to date)")
+        workers = min(self.workers, len(pending))
+        if workers <= 1 or len(pending) < self.min_parallel_jobs:
+            for job, hash in pending:
+                job.render(hash)
+        else:
+            # spawn, so that workers don't inherit torch's threads or cuda state
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker) as executor:
+                futures = [executor.submit(render_job, job, hash) for job, hash in pending]
+                for f in futures:
+                    f.result()
+        return [job.path for job, hash in pending]
@@ -1,93 +1,53 @@
 #!/usr/bin/env python3
 # PYTHON_ARGCOMPLETE_OK
-from experiments.invariance import *
-from experiments import language
+from pathlib import Path
 from experiments.base import Experiment
+from experiments.registry import ExperimentRegistry
+
+# only the selected experiments are imported and created; listing and completion stay fast
+all_experiments = ExperimentRegistry(Path("~/invariance").expanduser())
+package = "experiments.invariance"
+all_experiments.add("Initial", f"{package}.models", "TrainModels")
+all_experiments.add("SamplePlots", f"{package}.transformation_samples", "DatasetTransformationPlots", "STMatrixSamples")
+# f"{package}.data_augmentation": "DataAugmentationClassical", "DataAugmentationHandshape"
+all_experiments.add("Accuracies")
+# f"{package}.models": "SimpleConvAccuracies", "ModelAccuracies"
+all_experiments.add("Measures", f"{package}.validate", "VisualizeMeasures")
+all_experiments.add("Measures", f"{package}.dataset_transformation", "TransformationSampleSizes")
+all_experiments.add("Measures", f"{package}.compare_measures", "MeasureCorrelationWithTransformation")
+# f"{package}.compare_measures": "InvarianceMeasureCorrelation", "CompareMeasures", "DistanceApproximation",
+# "CompareSameEquivariance", "CompareSameEquivarianceNormalized", "CompareSameEquivarianceSimple"
+all_experiments.add("Weights", f"{package}.weights", "RandomInitialization", "RandomWeights", "DuringTraining")
+all_experiments.add("Dataset", f"{package}.dataset", "DatasetSize", "DatasetSubset", "DatasetTransfer")
+# "Variants":
+# f"{package}.aggregation": "AggregationFunctionsVariance", "AggregationBeforeAfter", "AggregationFunctionsDistance"
+# f"{package}.stratified": "Stratified"
+# f"{package}.normalization": "SameEquivarianceNormalization"
+all_experiments.add("Transformations", f"{package}.transformation",
+                    "TransformationDiversity", "TransformationComplexity", "TransformationSetSize")
+all_experiments.add("Hiperparameters", f"{package}.architecture",
+                    "BatchNormalization", "ActivationFunctionComparison", "MaxPooling", "KernelSize")
+# "Goodfellow": f"{package}.compare_measures": "CompareGoodfellowAlpha", "CompareGoodfellow"
+# "Models": f"{package}.models": "CompareModels"; f"{package}.tipooling": "TIPooling"
+all_experiments.add("Validate")
+# f"{package}.feature_maps": "VisualizeInvariantFeatureMaps"
 
 
 if __name__ == '__main__':
-    language.set_language(language.English())
-    todo = [
-
-    ]
-    if len(todo)>0:
-        print("TODO implement invariance:", ",".join([e.__class__.__name__ for e in todo]))
-
-
-    all_experiments = {
-        "Initial":[
-        TrainModels(),
-        ],
-        "SamplePlots":[
-        DatasetTransformationPlots(),
-        STMatrixSamples(),
-
-        # DataAugmentationClassical(),
-        # DataAugmentationHandshape(),
-        ],
-        "Accuracies":[
-        # SimpleConvAccuracies(),
-        # ModelAccuracies(),
-        ],
-        "Measures":[
-        VisualizeMeasures(),
-        TransformationSampleSizes(),            
-        # # # InvarianceMeasureCorrelation(),
-        
-        MeasureCorrelationWithTransformation(),
-        # # CompareMeasures(),
-        # # DistanceApproximation(),
-        # # # CompareSameEquivariance(),
-        # # #   CompareSameEquivarianceNormalized(),
-        # # # CompareSameEquivarianceSimple(),
-        ],
-        "Weights":[
-        RandomInitialization(),
-        RandomWeights(),
-        DuringTraining(),
-
-        ],
-        "Dataset":[
-        DatasetSize(),
-        DatasetSubset(),
-        DatasetTransfer(),
-        # # # #
-        ],
-        # # ,"Variants":[
-        # # AggregationFunctionsVariance(),
-        # # AggregationBeforeAfter(),
-        # # # AggregationFunctionsDistance(),
-        # # Stratified(),
-        # # # SameEquivarianceNormalization(),
-        # # #
-        
-        "Transformations":[
-        TransformationDiversity(),
-        TransformationComplexity(),
-        TransformationSetSize(),
-        ]
-        ,"Hiperparameters":[
-        BatchNormalization(),
-        ActivationFunctionComparison(),
-        MaxPooling(),
-        KernelSize(),
-        ],
-        # # "Goodfellow":[
-        # #     CompareGoodfellowAlpha(),
-        # #     CompareGoodfellow(),
-        # # ]
-        # # ,"Models":[
-        # # CompareModels(),
-        # # TIPooling(),
-        # ],
-        "Validate":[
-        # VisualizeInvariantFeatureMaps(),
-        ]
-    }
-
     experiments, o = Experiment.parse_args(all_experiments)
     if o.show_list:
         Experiment.print_table(experiments)
     else:
-        for e in experiments:
-            e(force=o.force)
\ No newline at end of file
+        from experiments import language
+        language.set_language(language.English())
+        for entry in experiments:
+            e = entry.create()
+            e.profile_measures = o.profile
+            e.isolate_jobs = o.isolate_jobs
+            e.job_limits = o.job_limits
+            e.job_retries = o.job_retries
+            e.prerender_training = o.prerender
+            e.prerender_max_bytes = o.prerender_max_bytes
+            e.cache_inputs = o.input_cache
+            e.input_cache_max_bytes = o.input_cache_max_bytes
+            e(force=o.force)
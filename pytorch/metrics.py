@@ -1,4 +1,4 @@
-from poutyne import register_metric_func
+from poutyne import register_metric_func, Metric
 import torch
 import math
 
@@ -149,3 +149,121 @@ def smape(y_pred, y_true, feature_normalize=False, eps=default_eps):
     ae = absolute_error(y_pred, y_true, feature_normalize=feature_normalize)
     scale = norm1(y_pred, feature_normalize) + norm1(y_true,feature_normalize)
     return torch.mean(ae/scale)
+
+
+class RegressionMetrics(Metric):
+    '''
+    Epoch metric that computes several of the regression metrics above in a single pass over each batch.
+    Each batch only updates sufficient statistics (sums of e², |e|, y, y² and of per sample ratios), from which
+    the metrics are computed exactly over the whole dataset at the end of the epoch, instead of averaging
+    per batch values as batch metrics do. In particular, rse uses the mean of y over the whole dataset.
+    rae is not supported: its scale sum(|y-mean(y)|) needs the dataset mean before the first batch is summed, which
+    would require keeping every target or a second pass, so it remains a batch metric (with per batch means).
+
+    Use as `Model(..., epoch_metrics=[RegressionMetrics.named(["mae","rae"])])`.
+    Features are not normalized (feature_normalize=False). mape averages the per element ratios |e|/|y| over all
+    samples and features, like its batch function.
+    '''
+    supported = ["mse2", "rmse", "mnrmse", "rnrmse", "mae", "rse", "mape", "amape", "smape"]
+
+    def __init__(self, metrics: list[str], eps=default_eps):
+        super().__init__()
+        for m in metrics:
+            if m not in self.supported:
+                raise ValueError(f"Metric {m} not supported. Options: {', '.join(self.supported)}.")
+        self.metrics = list(metrics)
+        self.eps = eps
+        self.reset()
+
+    @classmethod
+    def named(cls, metrics: list[str], eps=default_eps):
+        '''
+        Returns the (names, metric) tuple that poutyne expects for a metric with several values
+        '''
+        return tuple(metrics), cls(metrics, eps=eps)
+
+    def requires(self, *metrics):
+        return any(m in self.metrics for m in metrics)
+
+    def reset(self) -> None:
+        self.n = 0
+        self.n_elements = 0
+        self.stats = {}
+        self.norm_min = math.inf
+        self.norm_max = -math.inf
+
+    def accumulate(self, key: str, value: torch.Tensor):
+        value = value.detach().double()
+        if key in self.stats:
+            self.stats[key] += value
+        else:
+            self.stats[key] = value.clone()
+
+    def update(self, y_pred, y_true) -> None:
+        with torch.no_grad():
+            y_pred = y_pred.reshape(y_pred.shape[0], -1)
+            y_true = y_true.reshape(y_true.shape[0], -1).to(y_pred.dtype)
+            self.n += y_true.shape[0]
+            self.n_elements += y_true.numel()
+            e = y_pred - y_true
+            if self.requires("mae", "amape", "smape", "mape"):
+                abs_e = e.abs()
+                ae = abs_e.sum(1)
+                self.accumulate("ae", ae.sum())
+            if self.requires("mse2", "rmse", "mnrmse", "rnrmse", "rse"):
+                self.accumulate("se", (e * e).sum())
+            if self.requires("rse"):
+                self.accumulate("y", y_true.sum(0))
+                self.accumulate("y2", (y_true * y_true).sum(0))
+            if self.requires("mnrmse", "rnrmse"):
+                norms = y_true.norm(dim=1)
+                self.accumulate("norm", norms.sum())
+                self.norm_min = min(self.norm_min, norms.min().item())
+                self.norm_max = max(self.norm_max, norms.max().item())
+            if self.requires("mape"):
+                scale = y_true.abs().clamp_min(self.eps)
+                self.accumulate("ape", (abs_e / scale).sum())
+            if self.requires("amape"):
+                scale = (y_pred + y_true).abs().sum(1).clamp_min(self.eps)
+                self.accumulate("aape", (ae / scale).sum())
+            if self.requires("smape"):
+                scale = y_pred.abs().sum(1) + y_true.abs().sum(1)
+                self.accumulate("sape", (ae / scale).sum())
+
+    def stat(self, key: str) -> torch.Tensor:
+        return self.stats[key].cpu()
+
+    def compute_metric(self, m: str) -> float:
+        n = max(self.n, 1)
+        if m in ["mse2", "rmse", "mnrmse", "rnrmse"]:
+            rmse = math.sqrt(self.stat("se").item() / n)
+            if m == "mse2":
+                return rmse ** 2
+            elif m == "rmse":
+                return rmse
+            elif m == "mnrmse":
+                return rmse / (self.stat("norm").item() / n)
+            else:
+                return rmse / (self.norm_max - self.norm_min)
+        elif m == "mae":
+            return self.stat("ae").item() / n
+        elif m == "rse":
+            y, y2 = self.stat("y"), self.stat("y2")
+            # sum of (y-mean(y))² over the dataset
+            scale = (y2 - y * y / n).sum().item()
+            return self.stat("se").item() / safe_scale(scale, self.eps)
+        elif m == "mape":
+            return self.stat("ape").item() / max(self.n_elements, 1)
+        elif m == "amape":
+            return self.stat("aape").item() / n
+        elif m == "smape":
+            return self.stat("sape").item() / n
+        raise ValueError(m)
+
+    def compute(self):
+        # always a tuple, matching the names returned by `named`
+        return tuple(self.compute_metric(m) for m in self.metrics)
+
+
+def safe_scale(scale: float, eps: float):
+    return math.copysign(eps, scale) if abs(scale) < eps else scale
@@ -1,10 +1,103 @@
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, DataLoader, Sampler
 import torch
 import numpy as np
+import os
+import hashlib
+import json
+from pathlib import Path
+from multiprocessing import shared_memory
 def check_equal(lst):
     return not lst or lst.count(lst[0]) == len(lst)
 
 
+class SharedArray:
+    '''
+    Numpy array stored in a named shared memory block, or in a .npy file if `path` is given, so that other
+    processes (DataLoader workers, or other jobs on the same node for files) map the same pages instead of
+    holding their own copy. Pickling a SharedArray sends only its name; unpickling attaches to it read-only.
+
+    Files are named after `path` and a digest of the array's contents, which is also stored in a .json file next to
+    them; an existing file is only reused if its digest matches, so different data never shares a file.
+
+    The process that creates the array owns it, and must call `release` to free the memory (or delete the file).
+    Processes that attached to it only unmap it on `release`.
+    '''
+    def __init__(self, array:np.ndarray, path:Path=None):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.path = path
+        self.shm = None
+        self.owner = True
+        if path is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.name = self.shm.name
+            self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+            self.array[...] = array
+        else:
+            self.digest = self.content_digest(array)
+            path = path.with_name(f"{path.stem}_{self.digest[:16]}.npy")
+            self.path = path
+            self.name = str(path)
+            if self.compatible_file(path):
+                # created by another job with the same data; attach to it
+                self.owner = False
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # write and rename, so that concurrent jobs never attach to a partially written file
+                tmp_path = path.parent / f"{path.stem}.{os.getpid()}.tmp.npy"
+                np.save(tmp_path, array)
+                self.metadata_path().write_text(json.dumps({"digest": self.digest}))
+                os.replace(tmp_path, path)
+            self.array = np.load(path, mmap_mode="r")
+
+    @staticmethod
+    def content_digest(array:np.ndarray)->str:
+        h = hashlib.sha256(f"{array.shape}_{array.dtype}".encode())
+        h.update(np.ascontiguousarray(array).data)
+        return h.hexdigest()
+
+    def metadata_path(self)->Path:
+        return self.path.with_suffix(".json")
+
+    def compatible_file(self, path:Path)->bool:
+        if not path.exists() or not self.metadata_path().exists():
+            return False
+        if json.loads(self.metadata_path().read_text())["digest"] != self.digest:
+            return False
+        header = np.load(path, mmap_mode="r")
+        return header.shape == self.shape and header.dtype == self.dtype
+
+    def __getstate__(self):
+        return {"shape": self.shape, "dtype": self.dtype, "path": self.path, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+        if self.path is None:
+            # workers share the resource tracker of the owner, so the block is only unlinked once
+            self.shm = shared_memory.SharedMemory(name=self.name)
+            self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+        else:
+            self.shm = None
+            self.array = np.load(self.path, mmap_mode="r")
+        self.array.flags.writeable = False
+
+    def release(self):
+        self.array = None
+        if self.shm is not None:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+            self.shm = None
+        elif self.owner and self.path is not None and self.path.exists():
+            # processes that already mapped the file keep their mapping
+            self.path.unlink()
+            self.metadata_path().unlink(missing_ok=True)
+        self.owner = False
+
+    def __repr__(self):
+        return f"SharedArray({self.name},shape={self.shape},dtype={self.dtype},owner={self.owner})"
+
 
 class NumpyDataset(Dataset):
 
@@ -37,6 +130,7 @@ class NumpyDataset(Dataset):
     def __init__(self, *data_sources):
         assert(len(data_sources)>0)
         self.data_sources=data_sources
+        self.shared_sources=None
 
         for d in self.data_sources:
             assert len(d.shape)>=2, "all arrays must have at least 2 dimensions (batch,features1,..,featuresN)"
@@ -44,28 +138,125 @@ class NumpyDataset(Dataset):
         assert(check_equal(lengths))
 
     def __getitem__(self, idx):
-        # print("__getitem__ idx:",idx)
+        '''
+        :param idx: an int for a single sample, or a slice/array of indices for a whole batch.
+        Slices are views of the data sources, so contiguous ranges are returned without copying.
+        '''
         batch = tuple(torch.from_numpy(s[idx,]) for s in self.data_sources)
         if len(batch)==1:
             batch=batch[0]
         return batch
 
+    def __getitems__(self, indices):
+        '''
+        Batch fetch used by DataLoader when automatic batching is enabled. Indexes each data source once
+        and returns the samples as views of the resulting batch, which the default collate_fn then stacks again
+        (copying them). Use `batch_loader` to get the batches without that copy.
+        '''
+        batch = self[as_batch_index(indices)]
+        if len(self.data_sources)==1:
+            return list(batch)
+        return list(zip(*batch))
+
     def __len__(self):
         return self.data_sources[0].shape[0]
 
-    # def get_batch(self, idx):
-    #     if isinstance(idx, int):
-    #         idx = [idx]
-    #     batch=tuple( torch.from_numpy(d[idx,]) for d in self.data_sources)
-    #     return batch
-    #
-    # def get_all(self):
-    #     ids = list(range(len(self)))
-    #     return self.get_batch(ids)
+    def share(self, folderpath:Path=None, prefix="data"):
+        '''
+        Moves the data sources to shared memory (or to memory mapped files `folderpath`/`prefix`_i_<digest>.npy),
+        so that DataLoader workers use a single copy of the data. Call `release` when the dataset is no longer needed.
+        '''
+        if self.shared_sources is not None:
+            return self
+        if folderpath is None:
+            self.shared_sources = [SharedArray(d) for d in self.data_sources]
+        else:
+            self.shared_sources = [SharedArray(d, folderpath / f"{prefix}_{i}.npy") for i, d in enumerate(self.data_sources)]
+        self.data_sources = tuple(s.array for s in self.shared_sources)
+        return self
+
+    def release(self):
+        if self.shared_sources is None:
+            return
+        for s in self.shared_sources:
+            s.release()
+        self.shared_sources = None
+        self.data_sources = ()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared_sources is not None:
+            # workers attach to the shared data instead of receiving a copy
+            del state["data_sources"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared_sources is not None:
+            self.data_sources = tuple(s.array for s in self.shared_sources)
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
 
+    def batch_loader(self, batch_size:int, shuffle=False, drop_last=False, seed=0, **kwargs)->DataLoader:
+        '''
+        DataLoader that fetches each batch with a single indexing operation per data source
+        (see SliceBatchSampler). With batch_size=None the DataLoader passes the batches through without collating
+        them, so sequential batches are views of the data.
+        '''
+        sampler = SliceBatchSampler(len(self), batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+        return DataLoader(self, sampler=sampler, batch_size=None, **kwargs)
+
+
+def as_batch_index(indices):
+    '''
+    Converts a list of indices to a slice if they form a contiguous increasing range, or to an index array otherwise.
+    '''
+    if isinstance(indices, slice):
+        return indices
+    indices = np.asarray(indices, dtype=np.int64)
+    n = len(indices)
+    if n > 0 and indices[-1] - indices[0] == n - 1 and (n == 1 or np.all(np.diff(indices) == 1)):
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
 
 
+class SliceBatchSampler(Sampler):
+    '''
+    Samples batches of indices to be fetched with a single indexing operation.
+    Without shuffling, each batch is a slice of a contiguous range of samples. With shuffling, each batch is a
+    sorted array of random indices, which keeps the memory access of fancy indexing sequential.
+    Use with `DataLoader(dataset, sampler=SliceBatchSampler(...), batch_size=None)`.
+    '''
+    def __init__(self, n:int, batch_size:int, shuffle=False, drop_last=False, seed=0):
+        assert batch_size > 0, "batch_size must be positive"
+        self.n = n
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n // self.batch_size
+        return (self.n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            # a different permutation each epoch, reproducible given the seed
+            permutation = np.random.default_rng([self.seed, self.epoch]).permutation(self.n)
+            self.epoch += 1
+        for i in range(len(self)):
+            start = i * self.batch_size
+            end = min(start + self.batch_size, self.n)
+            if self.shuffle:
+                yield np.sort(permutation[start:end])
+            else:
+                yield slice(start, end)
 
 
 class NumpyKeyValueDataset(Dataset):
@@ -0,0 +1,140 @@
+'''
+Augmented datasets with every (sample, transformation) pair rendered once to a uint8 memmap, for training with small
+finite transformation sets without warping each image again in every epoch.
+'''
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+import tmeasures as tm
+
+from .numpy_dataset import NumpyDataset
+from .pytorch_image_dataset import ImageDataset, TransformationStrategy, FeatureNormalization, transform_batch
+
+
+def prerendered_bytes(x: np.ndarray, transformations: tm.TransformationSet) -> int:
+    return len(x) * len(transformations) * int(np.prod(x.shape[1:]))
+
+
+class PrerenderedImages:
+    '''
+    uint8 array of shape (samples, transformations, C, H, W) with every sample of `x` (uint8, NCHW) transformed by
+    every transformation, stored in `folder` as an .npy file named after the hash of `key` and a .json file with the key.
+    The file is reused if it already exists. Pickling sends only its path; unpickling maps the file again (read-only).
+    '''
+    def __init__(self, folder: Path, key: str, x: np.ndarray, transformations: tm.TransformationSet, batch_size=256):
+        assert x.dtype == np.uint8, f"Only uint8 images can be prerendered (got {x.dtype})"
+        self.key = key
+        self.path = Path(folder) / f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.npy"
+        self.shape = (len(x), len(transformations), *x.shape[1:])
+        if not self.exists():
+            self.render(x, transformations, batch_size)
+        self.open()
+
+    def metadata_path(self) -> Path:
+        return self.path.with_suffix(".json")
+
+    def exists(self) -> bool:
+        if not self.path.exists() or not self.metadata_path().exists():
+            return False
+        if json.loads(self.metadata_path().read_text())["key"] != self.key:
+            return False
+        array = np.load(self.path, mmap_mode="r")
+        return array.shape == self.shape and array.dtype == np.uint8
+
+    def render(self, x: np.ndarray, transformations: tm.TransformationSet, batch_size: int):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # write and rename, so that concurrent jobs never open a partially written file
+        tmp_path = self.path.parent / f"{self.path.stem}.{os.getpid()}.tmp.npy"
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=self.shape)
+        for start in range(0, len(x), batch_size):
+            batch = torch.from_numpy(x[start:start + batch_size].astype(np.float32))
+            for j, t in enumerate(transformations):
+                rendered = transform_batch(t, batch).round_().clamp_(0, 255)
+                array[start:start + len(batch), j] = rendered.to(torch.uint8).numpy()
+        array.flush()
+        del array
+        self.metadata_path().write_text(json.dumps({"key": self.key, "shape": self.shape}))
+        os.replace(tmp_path, self.path)
+
+    def open(self):
+        self.array = np.load(self.path, mmap_mode="r")
+
+    def __getstate__(self):
+        return {"key": self.key, "path": self.path, "shape": self.shape}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def __repr__(self):
+        return f"PrerenderedImages({self.path},shape={self.shape})"
+
+
+class PrerenderedClassificationDataset(ImageDataset):
+    '''
+    Same samples as ImageClassificationDataset (normalized with `mean` and `std`, one transformation chosen
+    by the strategy for each sample), read from the prerendered images instead of transformed on the fly.
+    Rendering before normalizing is equivalent, since the (bilinear, border padded) warps commute with per channel
+    affine maps; only the rounding to uint8 differs.
+
+    Only the labels are a NumpyDataset, so `share` and `release` only move the labels to shared memory. The images
+    are never copied: each DataLoader worker maps the prerendered file again when unpickling the dataset, and the
+    workers share its pages through the OS page cache.
+    '''
+    def __init__(self, images: PrerenderedImages, y: np.ndarray, mean: np.ndarray, std: np.ndarray,
+                 transformations: tm.TransformationSet, transformation_scheme: TransformationStrategy = None, uint8=False):
+        # the labels are the data source, so that sharing and releasing the dataset work as for the other datasets;
+        # the images are shared through the page cache instead
+        self.feature_normalization = FeatureNormalization(mean, std)
+        super().__init__(NumpyDataset(y), transformations, transformation_scheme,
+                         normalization=self.feature_normalization if uint8 else None)
+        self.images = images
+
+    def normalize(self, x: np.ndarray) -> torch.Tensor:
+        x = torch.from_numpy(x)
+        # with uint8 output, the loader normalizes the batches
+        return x if self.normalization is not None else self.feature_normalization(x)
+
+    def get_item(self, idx):
+        i_sample, i_transformation = self.transformation_strategy.get_index(idx, self.n_samples, self.n_transformations)
+        x = self.normalize(np.array(self.images.array[i_sample, i_transformation]))
+        y = self.dataset[i_sample].type(dtype=torch.LongTensor)
+        return x, y[0]
+
+    def get_batch(self, idx):
+        # a single read of the memmap for the whole batch (with index arrays, since a slice would select all pairs)
+        i_samples, i_transformations = self.transformation_strategy.get_indices(idx, self.n_samples, self.n_transformations)
+        x = self.normalize(self.images.array[i_samples, i_transformations])
+        y = self.dataset[i_samples].type(dtype=torch.LongTensor)
+        return x, y[:, 0]
+
+
+def prerender_classification(dataset, transformations: tm.TransformationSet, folder: Path, max_bytes: int,
+                             strategy: TransformationStrategy = None, uint8=False, verbose=True):
+    '''
+    Prerendered train and test datasets of a (not normalized) ClassificationDataset,
+    or None if its images are not uint8 or the rendered train and test sets would take more than `max_bytes` (None: no limit).
+    :param uint8: return the images as uint8, to be normalized by the datasets' loaders
+    '''
+    if dataset.x_train.dtype != np.uint8 or dataset.x_test.dtype != np.uint8:
+        if verbose:
+            print(f"Not prerendering {dataset.name}: images are {dataset.x_train.dtype}, not uint8")
+        return None
+    size = prerendered_bytes(dataset.x_train, transformations) + prerendered_bytes(dataset.x_test, transformations)
+    if max_bytes is not None and size > max_bytes:
+        if verbose:
+            print(f"Not prerendering {dataset.name} with {transformations.id()}: {size / 2 ** 30:.2f}GB exceeds the limit of {max_bytes / 2 ** 30:.2f}GB")
+        return None
+    mean, std = dataset.feature_statistics()
+    result = []
+    for subset, x, y in [("train", dataset.x_train, dataset.y_train), ("test", dataset.x_test, dataset.y_test)]:
+        key = f"{dataset.name}_{subset}_{dataset.dataformat}_{transformations.id()}"
+        images = PrerenderedImages(folder, key, np.ascontiguousarray(x), transformations)
+        result.append(PrerenderedClassificationDataset(images, y, mean, std, transformations, strategy, uint8=uint8))
+    return tuple(result)
@@ -1,46 +1,192 @@
+import abc
 import torch
 
-from torch.utils.data import Dataset
+from torch.nn import functional as F
+from torch.utils.data import Dataset, DataLoader, Sampler
 
 import numpy as np
 import tmeasures as tm
 from enum import Enum
 
+from .numpy_dataset import as_batch_index, SliceBatchSampler
+
 class TransformationStrategy(Enum):
+    '''
+    How the indices of an ImageDataset map to samples and transformations.
+    random_sample: an index per sample, transformed by a random transformation each time it is fetched.
+    iterate_all: an index per (sample, transformation) pair, index = i_transformation * n_samples + i_sample.
+    iterate_all_shuffled: same indices as iterate_all, visited in a different random order every epoch
+    by the dataset's `loader` (see TransformationBatchSampler).
+    '''
     random_sample="random_sample"
     iterate_all="iterate_all"
+    iterate_all_shuffled="iterate_all_shuffled"
+
+    def iterates_all(self):
+        return self != TransformationStrategy.random_sample
 
     def samples(self,n_samples,n_transformations):
         if self == TransformationStrategy.random_sample:
             return n_samples
-        elif self.transformation_strategy == TransformationStrategy.iterate_all:
+        elif self.iterates_all():
             return n_samples * n_transformations
         else:
             raise ValueError(f"Unsupported TransformationStrategy {self}")
 
     def get_index(self,idx,n_samples,n_transformations):
-        if self == TransformationStrategy.iterate_all:
-            i_sample = idx % self.n_samples
+        if self.iterates_all():
+            i_sample = idx % n_samples
             i_transformation = idx // n_samples
         else: # self == TransformationStrategy.random_sample:
             i_sample = idx
             i_transformation = np.random.randint(0, n_transformations)
         return i_sample, i_transformation
-    
+
     def get_indices(self, idx,n_samples,n_transformations):
-        if self == TransformationStrategy.iterate_all:
-            i_sample = [i % self.n_samples for i in idx]
-            i_transformation = [i // n_samples for i in idx]
+        '''
+        :param idx: an array or a slice of indices
+        :return: arrays of sample and transformation indices
+        '''
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(self.samples(n_samples, n_transformations)))
+        idx = np.asarray(idx, dtype=np.int64)
+        if self.iterates_all():
+            i_sample = idx % n_samples
+            i_transformation = idx // n_samples
         else: # self == TransformationStrategy.random_sample:
             i_sample = idx
             i_transformation = np.random.randint(0, n_transformations, size=(len(idx),))
         return i_sample, i_transformation
 
 
+class TransformationBatchSampler(Sampler):
+    '''
+    Samples batches of indices of an iterate_all dataset without materializing the n_samples * n_transformations indices.
+    Without shuffling, each batch is a slice of consecutive indices (mostly a single transformation).
+    With shuffling, an epoch consists of n_transformations rounds; in round r each sample appears once, in a
+    random order, paired with transformation (offset[sample] + r) % n_transformations for a random offset per sample,
+    so that every pair is visited exactly once per epoch. The indices of each batch are grouped by transformation.
+    Use with `DataLoader(dataset, sampler=TransformationBatchSampler(...), batch_size=None)`.
+    '''
+    def __init__(self, n_samples:int, n_transformations:int, batch_size:int, shuffle=False, drop_last=False, seed=0):
+        assert batch_size > 0, "batch_size must be positive"
+        self.n_samples = n_samples
+        self.n_transformations = n_transformations
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        n = self.n_samples * self.n_transformations
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = self.n_samples * self.n_transformations
+        if self.shuffle:
+            # reproducible given the seed; the order of each round is generated when the round is reached
+            epoch_seed = [self.seed, self.epoch]
+            self.epoch += 1
+            offsets = np.random.default_rng(epoch_seed).integers(0, self.n_transformations, size=self.n_samples)
+            orders = {}
+        for i in range(len(self)):
+            start = i * self.batch_size
+            end = min(start + self.batch_size, n)
+            if not self.shuffle:
+                yield slice(start, end)
+                continue
+            positions = np.arange(start, end)
+            rounds, positions = positions // self.n_samples, positions % self.n_samples
+            samples = np.empty_like(positions)
+            for r in np.unique(rounds):
+                if r not in orders:
+                    orders = {r: np.random.default_rng(epoch_seed + [int(r) + 1]).permutation(self.n_samples)}
+                mask = rounds == r
+                samples[mask] = orders[r][positions[mask]]
+            transformations = (offsets[samples] + rounds) % self.n_transformations
+            order = np.argsort(transformations, kind="stable")
+            yield transformations[order] * self.n_samples + samples[order]
+
+
+def transform_batch(transformation, batch: torch.Tensor) -> torch.Tensor:
+    '''
+    Applies `transformation` to every sample of `batch`; affine transformations are applied to the whole batch at once
+    (with the same sampling grid, and therefore the same result, as tmeasures' AffineTransformation)
+    '''
+    with torch.no_grad():
+        matrix = getattr(transformation, "transformation_matrix", None)
+        if matrix is None:
+            return torch.stack([transformation(s) for s in batch])
+        grid = F.affine_grid(matrix, [1, *batch.shape[1:]], align_corners=False)
+        grid = grid.expand(len(batch), *grid.shape[1:])
+        return F.grid_sample(batch, grid, align_corners=False, padding_mode="border")
+
 
+def transform_groups(transformations:tm.TransformationSet, batch: torch.Tensor, i_transformations: np.ndarray) -> torch.Tensor:
+    '''
+    Transforms each sample of `batch` by transformations[i_transformations[i]], with a single batched warp per transformation
+    '''
+    result = torch.empty_like(batch)
+    for j in np.unique(i_transformations):
+        group = torch.from_numpy(np.flatnonzero(i_transformations == j))
+        result[group] = transform_batch(transformations[j], batch[group])
+    return result
+
+
+def to_uint8(x: torch.Tensor) -> torch.Tensor:
+    return x.round().clamp_(0, 255).to(torch.uint8)
+
+
+class FeatureNormalization:
+    '''
+    Per channel normalization (x - mean) / std of images or batches of images, converted to float first
+    '''
+    def __init__(self, mean: np.ndarray, std: np.ndarray):
+        # (C,1,1), to normalize both single images and batches
+        self.mean = torch.from_numpy(np.asarray(mean, dtype=np.float32).reshape(-1, 1, 1))
+        self.std = torch.from_numpy(np.asarray(std, dtype=np.float32).reshape(-1, 1, 1))
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.mean.device != x.device:
+            self.mean, self.std = self.mean.to(x.device), self.std.to(x.device)
+        return (x.float() - self.mean) / self.std
+
+
+class NormalizedLoader:
+    '''
+    Iterates the (x, y) batches of `loader`, with x moved to `device` (if given) and normalized there, so that the
+    workers and the transfer to this process only handle uint8 images
+    '''
+    def __init__(self, loader: DataLoader, normalization: FeatureNormalization, device=None):
+        self.loader = loader
+        self.normalization = normalization
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
 
-class ImageDataset(Dataset):
-    def __init__(self, image_dataset:Dataset, transformations:tm.TransformationSet=None, transformation_scheme:TransformationStrategy=None,normalize=False):
+    def __iter__(self):
+        for x, y in self.loader:
+            if self.device is not None:
+                x = x.to(self.device, non_blocking=True)
+            yield self.normalization(x), y
+
+
+class ImageDataset(Dataset, abc.ABC):
+    '''
+    Samples of `image_dataset` (a NumpyDataset) transformed by the transformations chosen by `transformation_scheme`.
+    Subclasses implement `get_item` and `get_batch`; indexing with an int returns a single sample, and indexing with a
+    slice or an array of indices returns a whole batch, with the samples of each transformation warped together.
+
+    If `normalization` is given, the images of `image_dataset` are uint8 (not normalized) and the samples are
+    returned as uint8 too, rounded after the transformation; `loader` then normalizes the batches with it once
+    they reach the model's process.
+    '''
+    def __init__(self, image_dataset:Dataset, transformations:tm.TransformationSet=None, transformation_scheme:TransformationStrategy=None,normalize=False,
+                 normalization:FeatureNormalization=None):
 
         if transformation_scheme is None:
             transformation_scheme = TransformationStrategy.random_sample
@@ -54,25 +200,75 @@ class ImageDataset(Dataset):
             self.transformations=transformations
         self.n_transformations=len(self.transformations)
         self.n_samples = len(self.dataset)
+        self.normalization = normalization
 
 
 
     def __len__(self):
         return self.transformation_strategy.samples(self.n_samples,self.n_transformations)
 
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.get_item(int(idx))
+        return self.get_batch(idx)
+
+    def __getitems__(self, indices):
+        # batch fetch used by DataLoader when automatic batching is enabled
+        return list(zip(*self.get_batch(indices)))
+
+    def get_indices(self, idx):
+        i_samples, i_transformations = self.transformation_strategy.get_indices(idx, self.n_samples, self.n_transformations)
+        return as_batch_index(i_samples), i_transformations
+
+    @abc.abstractmethod
+    def get_item(self, idx:int):
+        pass
+
+    @abc.abstractmethod
+    def get_batch(self, idx):
+        pass
+
+    def output(self, x: torch.Tensor) -> torch.Tensor:
+        return x if self.normalization is None else to_uint8(x)
+
+    def loader(self, batch_size:int, shuffle=False, drop_last=False, seed=0, device=None, **kwargs):
+        '''
+        DataLoader over the dataset that fetches each batch with a single `get_batch` call. Batches are sampled by a
+        SliceBatchSampler, or for the iterate_all strategies by a TransformationBatchSampler (shuffled if the strategy
+        is iterate_all_shuffled, regardless of `shuffle`).
+        If the dataset returns uint8 images, its batches are normalized (on `device`, if given) by a NormalizedLoader.
+        '''
+        if not self.transformation_strategy.iterates_all():
+            sampler = SliceBatchSampler(len(self), batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+        else:
+            shuffle = self.transformation_strategy == TransformationStrategy.iterate_all_shuffled
+            sampler = TransformationBatchSampler(self.n_samples, self.n_transformations, batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+        # batches are already stacked by get_batch, so the DataLoader doesn't collate them again
+        loader = DataLoader(self, sampler=sampler, batch_size=None, **kwargs)
+        if self.normalization is not None:
+            loader = NormalizedLoader(loader, self.normalization, device)
+        return loader
+
+
 class ImageClassificationDataset(ImageDataset):
-    def __getitem__(self,idx):
+    def get_item(self,idx):
         i_sample,i_transformation=self.transformation_strategy.get_index(idx,self.n_samples,self.n_transformations)
         x,y = self.dataset[i_sample]
         t = self.transformations[i_transformation]
-        x= t(x.float())
+        x= self.output(t(x.float()))
         y=y.type(dtype=torch.LongTensor)
         return x, y[0]
 
+    def get_batch(self, idx):
+        i_samples, i_transformations = self.get_indices(idx)
+        x, y = self.dataset[i_samples]
+        x = self.output(transform_groups(self.transformations, x.float(), i_transformations))
+        y = y.type(dtype=torch.LongTensor)
+        return x, y[:, 0]
+
 
 class ImageTransformRegressionDataset(ImageDataset):
-    def __getitem__(self, idx):
-        assert(isinstance(idx,int))
+    def get_item(self, idx):
         i_sample,i_transformation=self.transformation_strategy.get_index(idx,self.n_samples,self.n_transformations)
         # print(self.dataset)
         s = self.dataset[i_sample]
@@ -82,6 +278,12 @@ class ImageTransformRegressionDataset(ImageDataset):
         # print(t.parameters())
         return ts,t.parameters().float()
 
+    def get_batch(self, idx):
+        i_samples, i_transformations = self.get_indices(idx)
+        x = transform_groups(self.transformations, self.dataset[i_samples].float(), i_transformations)
+        targets = torch.stack([self.transformations[j].parameters().float() for j in i_transformations])
+        return x, targets
+
 class ImageTransformRegressionNormalizedDataset(ImageDataset):
 
     def __init__(self, image_dataset: Dataset, transformations: tm.TransformationSet = None,
@@ -90,8 +292,7 @@ class ImageTransformRegressionNormalizedDataset(ImageDataset):
         self.min,self.max=self.transformations.parameter_range()
         self.delta = self.max - self.min
 
-    def __getitem__(self, idx):
-        assert(isinstance(idx,int))
+    def get_item(self, idx):
         i_sample,i_transformation=self.transformation_strategy.get_index(idx,self.n_samples,self.n_transformations)
         # print(self.dataset)
         # print(self.dataset[i_sample])
@@ -106,4 +307,10 @@ class ImageTransformRegressionNormalizedDataset(ImageDataset):
         target -= self.min
         target /= self.delta
         # print("old, target,mi,ma", old_target,target, mi, ma)
-        return ts,target
\ No newline at end of file
+        return ts,target
+
+    def get_batch(self, idx):
+        i_samples, i_transformations = self.get_indices(idx)
+        x = transform_groups(self.transformations, self.dataset[i_samples].float(), i_transformations)
+        targets = torch.stack([self.transformations[j].parameters().float() for j in i_transformations])
+        return x, (targets - self.min) / self.delta
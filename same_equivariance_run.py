@@ -1,24 +1,32 @@
 #!/usr/bin/env python3
 # PYTHON_ARGCOMPLETE_OK
+from pathlib import Path
+from experiments.base import Experiment
+from experiments.registry import ExperimentRegistry
 
-from experiments.same_equivariance import *
-from experiments import language,Experiment
-
-if __name__ == '__main__':
-    language.set_language(language.English())
+# only the selected experiments are imported and created; listing and completion stay fast
+all_experiments = ExperimentRegistry(Path("~/same_equivariance").expanduser())
+package = "experiments.same_equivariance"
+all_experiments.add("Initial", f"{package}.training", "TrainModels")
+# f"{package}.measures": "CompareSameEquivarianceNormalized"
+all_experiments.add("Initial", f"{package}.measures", "TransformationSampleSizes")
 
 
-    all_experiments = {
-        "Initial":[
-        TrainModels(),
-        # CompareSameEquivarianceNormalized(),
-        TransformationSampleSizes(),
-
-        ],
-    }
+if __name__ == '__main__':
     experiments, o = Experiment.parse_args(all_experiments)
     if o.show_list:
         Experiment.print_table(experiments)
     else:
-        for e in experiments:
+        from experiments import language
+        language.set_language(language.English())
+        for entry in experiments:
+            e = entry.create()
+            e.profile_measures = o.profile
+            e.isolate_jobs = o.isolate_jobs
+            e.job_limits = o.job_limits
+            e.job_retries = o.job_retries
+            e.prerender_training = o.prerender
+            e.prerender_max_bytes = o.prerender_max_bytes
+            e.cache_inputs = o.input_cache
+            e.input_cache_max_bytes = o.input_cache_max_bytes
             e(force=o.force)
@@ -1,17 +1,34 @@
 #!/usr/bin/env python3
 # PYTHON_ARGCOMPLETE_OK
+'''
+Generates a heatmap for each measure result of an experiment (and one per class for stratified results) in its
+heatmaps folder. By default only new or modified results are processed: the mtime, size and hash of each result
+and the images produced from it are recorded in heatmaps/manifest.json.
+
+    python -m scripts.generate_heatmaps Invariance
+    python -m scripts.generate_heatmaps SameEquivariance -full -workers 8
+'''
+import argparse
+import hashlib
+import json
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import tmeasures.measure
 from tmeasures import MeasureResult
-import config
 import matplotlib as mpl
 mpl.use('Agg')
 import matplotlib.pyplot as plt
 
 plt.rcParams['image.cmap'] = 'gray'
 import numpy as np
+import pickle
 from tmeasures import visualization
 
 import tmeasures as tm
+from experiments.tm_experiment import TMExperiment
 
 # def plot_last_layers_per_class(results,folderpath):
 #
@@ -61,37 +78,139 @@ import tmeasures as tm
 #         stratified_name = f"{detail}_stratified.png"
 #         visualization.plot_heatmap(detail, r.measure_result.numpy.id(), r.measure_result.activation_names, vmin=vmin, vmax=vmax, savefig=folderpath, savefig_name=name)
 
-heatmaps_folder=config.heatmaps_folder()
-heatmaps_folder.mkdir(exist_ok=True,parents=True)
-
-folder = config.results_folder()
-for f in sorted(folder.iterdir()):
-    if not f.is_file():
-        continue
-    result=config.load_experiment_result(f)
-    if "savepoint=" in result.parameters.model_name():
-        continue
-    if "rep=" in result.parameters.model_name():
-        continue
-    full_model_name=result.parameters.model_name()
-    index = full_model_name.index("(")
-    model_name = full_model_name[:index]
-    model_folderpath = heatmaps_folder / model_name / full_model_name
-    model_folderpath.mkdir(exist_ok=True,parents=True)
-    filepath= model_folderpath / f"{result.id()}.jpg"
-    visualization.plot_heatmap(result.measure_result,filepath)
-
-    measure_result= result.measure_result
-    if measure_result.__class__ == transformational_measures.measure.StratifiedMeasureResult:
-        stratified_folderpath = model_folderpath / f"{result.id()}_stratified"
-        stratified_folderpath.mkdir(exist_ok=True,parents=True)
-        measure_result: transformational_measures.measure.StratifiedMeasureResult = measure_result
-        n = len(measure_result.class_labels)
-        for i,class_name,measure in zip(range(n),measure_result.class_labels,measure_result.class_measures):
-            title = f"{i:02}_{class_name}"
-            filepath = stratified_folderpath / f"{title}.jpg"
-            visualization.plot_heatmap(measure,filepath)
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def save_heatmap(m: MeasureResult, filepath: Path):
+    visualization.plot_heatmap(m)
+    plt.savefig(filepath, bbox_inches='tight')
+    plt.close("all")
+
+
+def generate_heatmaps(result_path: Path, heatmaps_folder: Path) -> list[str]:
+    '''
+    :return: paths of the generated images, relative to `heatmaps_folder`
+    '''
+    with open(result_path, "rb") as f:
+        result = pickle.load(f)
+    p = result.parameters
+    if "savepoint=" in p.model_id or "rep=" in p.model_id:
+        return []
+    model_folderpath = heatmaps_folder / p.model_id
+    filepath = model_folderpath / f"{p.id()}.jpg"
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    images = [filepath]
+    measure_result = result.measure_result
+    if isinstance(measure_result, tm.StratifiedMeasureResult):
+        stratified_folderpath = model_folderpath / f"{p.id()}_stratified"
+        stratified_folderpath.mkdir(exist_ok=True, parents=True)
+        for i, (class_name, class_result) in enumerate(zip(measure_result.labels, measure_result.results)):
+            class_filepath = stratified_folderpath / f"{i:02}_{class_name}.jpg"
+            save_heatmap(class_result, class_filepath)
+            images.append(class_filepath)
+    save_heatmap(measure_result, filepath)
+    return [str(i.relative_to(heatmaps_folder)) for i in images]
+
+
+class HeatmapManifest:
+    '''
+    Records, for each result file, its mtime, size and hash and the images generated from it.
+    '''
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = json.loads(path.read_text()) if path.exists() else {}
+
+    def up_to_date(self, key: str, result_path: Path, heatmaps_folder: Path) -> bool:
+        entry = self.entries.get(key)
+        if entry is None or not all((heatmaps_folder / i).exists() for i in entry["images"]):
+            return False
+        stat = result_path.stat()
+        if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return True
+        # the file was rewritten; compare contents
+        if entry["size"] == stat.st_size and entry["sha256"] == file_hash(result_path):
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def update(self, key: str, result_path: Path, images: list[str]):
+        stat = result_path.stat()
+        self.entries[key] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                             "sha256": file_hash(result_path), "images": images}
+
+    def remove_missing(self, keys: set[str]):
+        for key in list(self.entries.keys()):
+            if key not in keys:
+                del self.entries[key]
+
+    def save(self):
+        tmp_path = self.path.parent / f"{self.path.name}.tmp"
+        tmp_path.write_text(json.dumps(self.entries, indent=1))
+        os.replace(tmp_path, self.path)
+
+
+def init_worker():
+    mpl.use('Agg')
+    plt.rcParams['image.cmap'] = 'gray'
+
+
+# base folders of experiments.invariance and experiments.same_equivariance
+base_folderpaths = {"Invariance": Path("~/invariance").expanduser(),
+                    "SameEquivariance": Path("~/same_equivariance").expanduser()}
+
+
+class ResultsFolders(TMExperiment):
+    '''
+    Access to the results and heatmaps folders of experiments with base folder `base_folderpath`,
+    without importing (and instantiating) the experiments themselves.
+    '''
+    def __init__(self, base_folderpath: Path):
+        self.base_folderpath = base_folderpath
+
+    def run(self):
+        pass
+
+    def description(self):
+        return ""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate heatmaps of measure results")
+    parser.add_argument('experiment', choices=list(base_folderpaths.keys()), type=str, help="Experiment's results")
+    parser.add_argument('-folder', type=Path, default=None, help="Base folder of the experiments (default depends on the experiment)")
+    parser.add_argument('-full', action="store_true", help="Regenerate all heatmaps, even if their results did not change")
+    parser.add_argument('-workers', type=int, default=os.cpu_count(), help="Processes used to render heatmaps")
+    args = parser.parse_args()
+    experiment = ResultsFolders(base_folderpaths[args.experiment] if args.folder is None else args.folder)
+
+    heatmaps_folder = experiment.heatmaps_folder()
+    heatmaps_folder.mkdir(exist_ok=True, parents=True)
+    folder = experiment.results_folder()
+    manifest = HeatmapManifest(heatmaps_folder / "manifest.json")
+
+    result_paths = {str(f.relative_to(folder)): f for f in sorted(folder.rglob("*.pickle"))}
+    pending = {k: f for k, f in result_paths.items() if args.full or not manifest.up_to_date(k, f, heatmaps_folder)}
+    print(f"Generating heatmaps for {len(pending)} results ({len(result_paths) - len(pending)} up to date)")
+    manifest.remove_missing(set(result_paths.keys()))
 
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max(args.workers, 1), mp_context=context, initializer=init_worker) as executor:
+        futures = {k: executor.submit(generate_heatmaps, f, heatmaps_folder) for k, f in pending.items()}
+        for i, (k, future) in enumerate(futures.items()):
+            try:
+                manifest.update(k, pending[k], future.result())
+            except Exception as e:
+                print(f"Error generating heatmaps for {k}: {e}")
+            if (i + 1) % 100 == 0:
+                # save progress, so that interrupted runs can resume
+                manifest.save()
+                print(f"{i + 1}/{len(futures)}")
+    manifest.save()
 
 
 def pearson_outlier_range(values,iqr_away):
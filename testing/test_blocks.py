@@ -0,0 +1,79 @@
+'''
+Measures evaluated in blocks: the pooled state of all blocks gives the plain result, and the bootstrap and jackknife
+estimates are consistent with it.
+Run with `python -m pytest testing/test_blocks.py`
+'''
+import pickle
+
+import numpy as np
+import pytest
+import torch
+import tmeasures as tm
+from tmeasures.pytorch.transformations.affine import RotationGenerator
+from tmeasures.transformations.parameters import UniformRotation
+
+from experiment.measure.blocks import eval_blocks, AdaptiveSampling
+from pytorch.numpy_dataset import NumpyDataset
+
+from test_grid import classifier, feature_maps, max_relative_error
+
+block_measures = [
+    (classifier, tm.pytorch.SampleVarianceInvariance()),
+    (classifier, tm.pytorch.TransformationVarianceInvariance()),
+    (classifier, tm.pytorch.NormalizedVarianceInvariance()),
+    (classifier, tm.pytorch.NormalizedVarianceInvariance(tm.pytorch.AverageFeatureMaps())),
+    (feature_maps, tm.pytorch.NormalizedVarianceSameEquivariance()),
+]
+
+
+def setup(make_model, samples=128):
+    torch.manual_seed(0)
+    model = make_model().eval()
+    x = np.random.default_rng(0).random((samples, 1, 12, 12)).astype(np.float32)
+    transformations = RotationGenerator(UniformRotation(8, 1.0))
+    o = tm.pytorch.PyTorchMeasureOptions(batch_size=16, verbose=False)
+    return model, x, transformations, o
+
+
+@pytest.mark.parametrize("make_model,measure", block_measures)
+def test_pooled_blocks_equal_plain_result(make_model, measure):
+    model, x, transformations, o = setup(make_model)
+    expected = measure.eval(NumpyDataset(x), transformations, model, o)
+    # the last block is smaller than the others
+    results = eval_blocks(measure, NumpyDataset(x), 48, model, o, transformations)
+    assert len(results) == 3 and results.samples == len(x)
+    assert max_relative_error(expected, results.result()) < 1e-12
+    # the stacked state is rebuilt after pickling
+    results = pickle.loads(pickle.dumps(results))
+    assert max_relative_error(expected, results.result()) < 1e-12
+
+
+@pytest.mark.parametrize("make_model,measure", block_measures)
+def test_bootstrap(make_model, measure):
+    model, x, transformations, o = setup(make_model)
+    results = eval_blocks(measure, NumpyDataset(x), 16, model, o, transformations)
+    expected = [layer.mean() for layer in results.result().layers]
+    intervals = results.bootstrap(200, seed=1)
+    assert np.allclose(intervals.estimate, expected, rtol=1e-12)
+    assert np.all((intervals.low <= intervals.estimate) & (intervals.estimate <= intervals.high))
+    # reproducible given the seed
+    again = results.bootstrap(200, seed=1)
+    assert np.array_equal(intervals.low, again.low) and np.array_equal(intervals.high, again.high)
+
+    relative = results.relative_half_width(1.96)
+    assert relative.shape == intervals.estimate.shape
+    assert np.all(relative >= 0)
+
+
+@pytest.mark.parametrize("relative_error,samples", [(10.0, 64), (1e-9, 128)])
+def test_adaptive_stops_when_precise_enough(relative_error, samples):
+    model, x, transformations, o = setup(classifier)
+    measure = tm.pytorch.NormalizedVarianceInvariance()
+    adaptive = AdaptiveSampling(relative_error, block_size=16, min_samples=64)
+    results = eval_blocks(measure, NumpyDataset(x), adaptive.block_size, model, o, transformations, adaptive=adaptive)
+    assert results.samples == samples
+    if samples < len(x):
+        assert np.all(results.relative_half_width(adaptive.z()) <= relative_error)
+    # the estimate is the plain measure on the samples used
+    expected = measure.eval(NumpyDataset(x[:samples]), transformations, model, o)
+    assert max_relative_error(expected, results.result()) < 1e-12
@@ -0,0 +1,73 @@
+'''
+Measuring every (sample size, transformation set) pair of a grid in a single pass gives the same results as
+measuring each of them separately.
+Run with `python -m pytest testing/test_grid.py`
+'''
+import numpy as np
+import pytest
+import torch
+import tmeasures as tm
+from tmeasures.pytorch import ActivationsModule
+from tmeasures.pytorch.transformations.affine import RotationGenerator, ScaleGenerator
+from tmeasures.transformations.parameters import UniformRotation, ScaleUniform
+
+from experiment.measure.grid import TransformationGrid, eval_grid
+from experiments.models.util import SequentialWithIntermediates
+from pytorch.numpy_dataset import NumpyDataset
+
+
+class SmallModel(ActivationsModule):
+    def __init__(self, *layers):
+        super().__init__()
+        self.layers = SequentialWithIntermediates(*layers)
+
+    def forward(self, x):
+        return self.layers(x)
+
+    def forward_activations(self, x):
+        return self.layers.forward_activations(x)
+
+    def activation_names(self):
+        return self.layers.activation_names()
+
+
+def classifier():
+    return SmallModel(torch.nn.Conv2d(1, 4, 3, padding=1), torch.nn.ELU(), torch.nn.Flatten(), torch.nn.Linear(4 * 12 * 12, 5))
+
+
+def feature_maps():
+    # same equivariance needs activations with the shape of the input
+    return SmallModel(torch.nn.Conv2d(1, 4, 3, padding=1), torch.nn.ELU())
+
+
+def max_relative_error(expected: tm.pytorch.PyTorchMeasureResult, result: tm.pytorch.PyTorchMeasureResult):
+    error = 0
+    for a, b in zip(expected.layers, result.layers):
+        a, b = a.double(), b.double()
+        finite = torch.isfinite(a)
+        assert torch.equal(finite, torch.isfinite(b))
+        error = max(error, ((a[finite] - b[finite]).abs() / (a[finite].abs() + 1e-12)).max().item())
+    return error
+
+
+@pytest.mark.parametrize("make_model,measure", [
+    (classifier, tm.pytorch.NormalizedVarianceInvariance(tm.pytorch.AverageFeatureMaps())),
+    (classifier, tm.pytorch.TransformationVarianceInvariance()),
+    (feature_maps, tm.pytorch.NormalizedVarianceSameEquivariance()),
+])
+def test_grid_equals_separate_measures(make_model, measure):
+    torch.manual_seed(0)
+    model = make_model().eval()
+    x = np.random.default_rng(0).random((30, 1, 12, 12)).astype(np.float32)
+    sample_sizes = [5, 13, 30]
+    # overlapping sets: the rotations of the smaller sets are also in the larger ones
+    sets = [RotationGenerator(UniformRotation(n, 1.0)) for n in [3, 5, 9]] + [ScaleGenerator(ScaleUniform(1, 0.5, 1.25))]
+    grid = TransformationGrid(sets)
+    assert len(grid.union) < sum(len(s) for s in sets)
+    o = tm.pytorch.PyTorchMeasureOptions(batch_size=7, verbose=False)
+
+    results = eval_grid(measure, NumpyDataset(x), sample_sizes, grid, model, o)
+    for i, n in enumerate(sample_sizes):
+        for j, transformations in enumerate(sets):
+            expected = measure.eval(NumpyDataset(x[:n]), transformations, model, o)
+            assert max_relative_error(expected, results[i][j]) < 1e-6
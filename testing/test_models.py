@@ -0,0 +1,34 @@
+'''
+Activations of the models with branches (see experiments.models.util.Add) match their outputs and names.
+Run with `python -m pytest testing/test_models.py`
+'''
+import torch
+
+from experiments.tasks import Task
+from experiments.models import ResNetConfig
+from experiments.models.util import Add, SequentialWithIntermediates
+
+
+def test_add_activations():
+    torch.manual_seed(0)
+    identity = SequentialWithIntermediates()
+    model = Add(SequentialWithIntermediates(torch.nn.Linear(4, 4)), SequentialWithIntermediates())
+    x = torch.randn(5, 4)
+    activations = model.forward_activations(x)
+    assert len(activations) == len(model.activation_names())
+    assert torch.equal(activations[-1], model(x))
+    # an empty branch is the identity
+    assert torch.equal(identity.forward_activations(x)[0], x)
+
+
+def test_resnet_activations():
+    torch.manual_seed(0)
+    mc = ResNetConfig.for_dataset(Task.Classification, "mnist")
+    model = mc.make((28, 28, 1), 10)
+    model.eval()
+    x = torch.randn(2, 1, 28, 28)
+    with torch.no_grad():
+        activations = model.forward_activations(x)
+        output = model(x)
+    assert len(activations) == len(model.activation_names())
+    assert torch.allclose(activations[-1], output)
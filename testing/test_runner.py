@@ -0,0 +1,56 @@
+'''
+JobRunner retries failed jobs in new workers and reports every failed attempt.
+Run with `python -m pytest testing/test_runner.py`
+'''
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from experiments.runner import JobRunner, JobLimits, JobError
+
+
+def double(x):
+    return 2 * x
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def fail_once(marker: Path):
+    # fails in the first attempt only
+    if not marker.exists():
+        marker.touch()
+        raise ValueError("first attempt")
+    return os.getpid()
+
+
+def crash():
+    os._exit(3)
+
+
+def test_retries(tmp_path):
+    report_path = tmp_path / "failures.jsonl"
+    runner = JobRunner(JobLimits(), jobs_per_worker=2, retries=1, report_path=report_path, poll_interval=0.1)
+    try:
+        assert [runner.run("double", double, i) for i in range(3)] == [0, 2, 4]
+
+        runner.run("fail_once", fail_once, tmp_path / "marker")
+        failures = [json.loads(line) for line in report_path.read_text().splitlines()]
+        assert [(f["job"], f["kind"], f["attempt"]) for f in failures] == [("fail_once", "error", 1)]
+
+        with pytest.raises(JobError) as e:
+            runner.run("fail", fail)
+        assert [(f.kind, f.attempt) for f in e.value.failures] == [("error", 1), ("error", 2)]
+
+        with pytest.raises(JobError) as e:
+            runner.run("crash", crash)
+        assert [(f.kind, f.exitcode) for f in e.value.failures] == [("crash", 3), ("crash", 3)]
+        assert len(report_path.read_text().splitlines()) == 5
+
+        # a new worker takes the next job
+        assert runner.run("double", double, 5) == 10
+    finally:
+        runner.close()
@@ -0,0 +1,62 @@
+'''
+Stratified subsets computed from indices are the same as splitting each class with copies of its samples.
+Run with `python -m pytest testing/test_stratified.py`
+'''
+import copy
+
+import numpy as np
+import pytest
+
+import datasets
+from datasets.util import reduce_size_subset_stratified
+
+
+def split_by_class(percentage, x, y, random=False):
+    # reference: copies the samples of each class, then splits them
+    x1, y1, x2, y2 = [], [], [], []
+    for i in range(y.max() + 1):
+        class_indices = np.squeeze(y == i)
+        class_x, class_y = x[class_indices], y[class_indices]
+        class_n = len(class_y)
+        indices = np.random.permutation(class_n) if random else np.arange(class_n)
+        limit = int(class_n * percentage)
+        x1.append(class_x[indices[:limit]])
+        y1.append(class_y[indices[:limit]])
+        x2.append(class_x[indices[limit:]])
+        y2.append(class_y[indices[limit:]])
+    return np.vstack(x1), np.vstack(y1), np.vstack(x2), np.vstack(y2)
+
+
+@pytest.mark.parametrize("n,classes", [(1000, 10), (537, 7)])
+@pytest.mark.parametrize("percentage", [0.1, 0.33, 0.5, 0.999])
+@pytest.mark.parametrize("random", [False, True])
+def test_reduce_size_subset_stratified(n, classes, percentage, random):
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 255, (n, 3, 4, 4)).astype(np.uint8)
+    y = rng.integers(0, classes, (n, 1))
+    np.random.seed(1)
+    expected = split_by_class(percentage, x, y, random)
+    np.random.seed(1)
+    result = reduce_size_subset_stratified(percentage, x, y, random)
+    for a, b in zip(expected, result):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize("subset", [datasets.DatasetSubset.train, datasets.DatasetSubset.test])
+@pytest.mark.parametrize("size", [100, 250, 500])
+def test_subset_stratified_equals_reduced_dataset(subset, size):
+    rng = np.random.default_rng(0)
+    x_train = rng.integers(0, 255, (1000, 3, 8, 8)).astype(np.uint8)
+    x_test = rng.integers(0, 255, (500, 3, 8, 8)).astype(np.uint8)
+    y_train, y_test = rng.integers(0, 10, (1000, 1)), rng.integers(0, 10, (500, 1))
+    dataset = datasets.ClassificationDataset("test", x_train, x_test, y_train, y_test, 10, (8, 8, 3),
+                                             [str(i) for i in range(10)], "NCHW")
+
+    reduced = copy.deepcopy(dataset).reduce_size_stratified_fixed(size, subset)
+    reduced.normalize_features()
+    x_expected, y_expected = reduced.get_subset(subset)
+
+    x, y = dataset.subset_stratified_fixed(size, subset, normalize=True)
+    assert np.array_equal(x, x_expected) and np.array_equal(y, y_expected)
+    # the samples of the dataset are not normalized in place
+    assert dataset.x_train.dtype == np.uint8
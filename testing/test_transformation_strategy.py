@@ -0,0 +1,65 @@
+'''
+The iterate_all strategies visit every (sample, transformation) pair once per epoch, and their batches are the same
+samples as fetching each index separately.
+Run with `python -m pytest testing/test_transformation_strategy.py`
+'''
+import numpy as np
+import pytest
+import torch
+from tmeasures.pytorch.transformations.affine import RotationGenerator
+from tmeasures.transformations.parameters import UniformRotation
+
+from pytorch.numpy_dataset import NumpyDataset
+from pytorch.pytorch_image_dataset import ImageClassificationDataset, TransformationStrategy, TransformationBatchSampler
+
+
+def pairs(batches):
+    return np.concatenate([np.arange(b.start, b.stop) if isinstance(b, slice) else b for b in batches])
+
+
+@pytest.mark.parametrize("n_samples,n_transformations,batch_size", [(10, 3, 4), (7, 5, 7), (16, 4, 64)])
+def test_sampler_visits_every_pair(n_samples, n_transformations, batch_size):
+    n = n_samples * n_transformations
+    sampler = TransformationBatchSampler(n_samples, n_transformations, batch_size)
+    assert np.array_equal(pairs(sampler), np.arange(n))
+
+    sampler = TransformationBatchSampler(n_samples, n_transformations, batch_size, shuffle=True, seed=3)
+    epoch1, epoch2 = list(sampler), list(sampler)
+    assert len(epoch1) == len(sampler)
+    for epoch in [epoch1, epoch2]:
+        assert np.array_equal(np.sort(pairs(epoch)), np.arange(n))
+        for batch in epoch:
+            # grouped by transformation
+            assert np.all(np.diff(batch // n_samples) >= 0)
+    assert not np.array_equal(pairs(epoch1), pairs(epoch2))
+    # reproducible given the seed
+    again = TransformationBatchSampler(n_samples, n_transformations, batch_size, shuffle=True, seed=3)
+    assert np.array_equal(pairs(again), pairs(epoch1))
+
+
+def test_sampler_drop_last():
+    sampler = TransformationBatchSampler(10, 3, 4, shuffle=True, drop_last=True)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 7
+    assert all(len(b) == 4 for b in batches)
+    assert len(np.unique(pairs(batches))) == 28
+
+
+@pytest.mark.parametrize("strategy", [TransformationStrategy.iterate_all, TransformationStrategy.iterate_all_shuffled])
+def test_loader_equals_plain_items(strategy):
+    rng = np.random.default_rng(0)
+    x = rng.random((12, 1, 8, 8)).astype(np.float32)
+    y = np.arange(12).reshape(-1, 1)
+    transformations = RotationGenerator(UniformRotation(3, 1.0))
+    dataset = ImageClassificationDataset(NumpyDataset(x, y), transformations, strategy)
+    assert len(dataset) == 36
+
+    seen = []
+    # two new loaders sample the same batches (same seed and epoch)
+    for batch_indices, (xb, yb) in zip(dataset.loader(5).sampler, dataset.loader(5)):
+        for i, xi, yi in zip(pairs([batch_indices]), xb, yb):
+            x_expected, y_expected = dataset.get_item(int(i))
+            assert torch.allclose(xi, x_expected, atol=1e-6)
+            assert yi == y_expected
+            seen.append(int(i))
+    assert sorted(seen) == list(range(36))